@@ -0,0 +1,136 @@
+"""Admin helpers for tables with millions of rows.
+
+The default changelist runs an exact COUNT(*) of the filtered and of the
+whole table on every page. EstimatedCountPaginator uses the planner's row
+estimate of an unfiltered table on PostgreSQL, and otherwise counts at most
+ORBIT_ADMIN_COUNT_LIMIT rows (pages past the limit are not linked; narrow
+the list with filters or search instead). date_hierarchy is not used: its
+year list is a DISTINCT over the whole table. CreatedListFilter filters by
+indexed date ranges instead.
+"""
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+def _count_limit():
+    # a capped count must exceed list_max_show_all, or the changelist
+    # would list all rows on one page
+    return max(getattr(settings, 'ORBIT_ADMIN_COUNT_LIMIT', 10000), 1000)
+
+def estimated_table_rows(model, using):
+    """Returns the planner's row estimate of the table of model (PostgreSQL), or None"""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [model._meta.db_table])
+        row = cursor.fetchone()
+    return int(row[0]) if row else None
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        qs = self.object_list
+        limit = _count_limit()
+        if not qs.query.where:
+            estimate = estimated_table_rows(qs.model, qs.db)
+            if estimate is not None and estimate > limit:
+                return estimate
+        # counts the rows of a LIMIT subquery, which stops after limit rows
+        return qs.order_by()[:limit].count()
+
+
+class CreatedListFilter(admin.SimpleListFilter):
+    """
+    Filter on an indexed datetime field (default created) by recent ranges
+    and by year. The years come from the min and max of the field, which
+    are two index lookups.
+    """
+    title = 'created'
+    parameter_name = 'created_range'
+    field_name = 'created'
+    RECENT = (
+        ('today', 'Today', 0),
+        ('7d', 'Past 7 days', 7),
+        ('30d', 'Past 30 days', 30),
+    )
+
+    def lookups(self, request, model_admin):
+        bounds = model_admin.model._default_manager.aggregate(
+            first=Min(self.field_name), last=Max(self.field_name))
+        choices = [(value, label) for value, label, days in self.RECENT]
+        if bounds['first']:
+            first = timezone.localtime(bounds['first']).year
+            last = timezone.localtime(bounds['last']).year
+            choices.extend((str(year), str(year)) for year in range(last, first-1, -1))
+        return choices
+
+    def get_range(self, value):
+        """Returns (start, end) datetimes for the parameter value, or None"""
+        today = timezone.localtime(timezone.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+        for v, label, days in self.RECENT:
+            if value == v:
+                return (today - timedelta(days=days), today + timedelta(days=1))
+        try:
+            year = int(value)
+            return (timezone.make_aware(datetime(year, 1, 1)), timezone.make_aware(datetime(year+1, 1, 1)))
+        except (TypeError, ValueError, OverflowError):
+            return None
+
+    def queryset(self, request, queryset):
+        bounds = self.get_range(self.value())
+        if bounds is None:
+            return queryset
+        return queryset.filter(**{
+            self.field_name + '__gte': bounds[0],
+            self.field_name + '__lt': bounds[1]
+        })
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin for large tables: estimated counts, no count of the whole
+    table for filtered lists, and search by exact match. Subclasses should
+    also set list_select_related for the FKs in list_display, raw_id_fields
+    for FKs to large tables, and CreatedListFilter (not date_hierarchy) in
+    list_filter.
+    search_fields must use the '=' prefix and may follow forward relations
+    only. A term is matched with an exact (indexable) lookup on each field
+    for which it is a valid value, instead of the case-insensitive match of
+    the default admin search.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        search_fields = self.get_search_fields(request)
+        term = search_term.strip()
+        if not term or not search_fields:
+            return queryset, False
+        q = Q()
+        for name in search_fields:
+            path = name.lstrip('=')
+            field = self.lookup_field(path)
+            try:
+                value = field.to_python(term)
+            except ValidationError:
+                continue
+            q |= Q(**{path: value})
+        if not q:
+            return queryset.none(), False
+        return queryset.filter(q), False
+
+    def lookup_field(self, path):
+        """Returns the model field at the end of the lookup path"""
+        model = self.model
+        parts = path.split('__')
+        for part in parts[:-1]:
+            model = model._meta.get_field(part).related_model
+        return model._meta.get_field(parts[-1])
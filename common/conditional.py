@@ -0,0 +1,73 @@
+"""Conditional GET (ETag / Last-Modified) for DRF views"""
+import calendar
+import hashlib
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+class ConditionalGetMixin(object):
+    """
+    For DRF views with a get method. Subclasses implement get_validators,
+    which returns (version, last_modified) of the resource from a cheap
+    query. If the request has a matching If-None-Match (or, without it, an
+    If-Modified-Since not older than last_modified), a 304 response is
+    returned without running the view, so the full query and serialization
+    are skipped. Otherwise the ETag and Last-Modified headers are set on the
+    response.
+    """
+    def get_validators(self, request, *args, **kwargs):
+        """Returns (version string, last_modified datetime or None), or None to skip.
+        Without last_modified, If-Modified-Since is ignored and no Last-Modified
+        header is set.
+        """
+        raise NotImplementedError
+
+    def make_etag(self, request, version):
+        # the full path is included because query params select the page
+        key = '{0}:{1}:{2}'.format(request.user.pk, request.get_full_path(), version)
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def not_modified(self, request, etag, last_modified):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            # weak comparison (parse_etags drops the W/ prefix)
+            etags = parse_etags(if_none_match)
+            return '*' in etags or etag in etags
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if if_modified_since and last_modified:
+            return int(calendar.timegm(last_modified.utctimetuple())) <= if_modified_since
+        return False
+
+    def get(self, request, *args, **kwargs):
+        validators = self.get_validators(request, *args, **kwargs)
+        if validators is None:
+            return super(ConditionalGetMixin, self).get(request, *args, **kwargs)
+        version, last_modified = validators
+        etag = self.make_etag(request, version)
+        if self.not_modified(request, etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = super(ConditionalGetMixin, self).get(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        response['ETag'] = 'W/' + quote_etag(etag)
+        if last_modified:
+            response['Last-Modified'] = http_date(calendar.timegm(last_modified.utctimetuple()))
+        # the response depends on the bearer token
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class ObjectConditionalGetMixin(ConditionalGetMixin):
+    """ConditionalGetMixin for detail views of a model with a modified field.
+    The object is fetched once (with the permission check) and reused by
+    the view if the request is not answered with a 304.
+    """
+    def get_object(self):
+        if not hasattr(self, '_object'):
+            self._object = super(ObjectConditionalGetMixin, self).get_object()
+        return self._object
+
+    def get_validators(self, request, *args, **kwargs):
+        obj = self.get_object()
+        return (obj.modified.isoformat(), obj.modified)
@@ -0,0 +1,33 @@
+"""Health check of persistent database connections (CONN_MAX_AGE > 0).
+
+Django only notices that a persistent connection was dropped by the server
+(restart, idle timeout, pgbouncer reconnect) when a query on it fails, so
+the first request after the drop returns an error. check_connections runs
+at the start of each request and replaces a connection that is no longer
+usable. A connection is checked only if it has been idle for at least
+ORBIT_DB_HEALTH_CHECK_INTERVAL seconds, so busy workers do not pay a round
+trip per request.
+"""
+import time
+from django.conf import settings
+from django.db import connections
+
+def check_connections(**kwargs):
+    interval = getattr(settings, 'ORBIT_DB_HEALTH_CHECK_INTERVAL', 30)
+    now = time.time()
+    for conn in connections.all():
+        if conn.connection is None or conn.in_atomic_block:
+            continue
+        last_used = getattr(conn, 'health_checked_at', 0)
+        conn.health_checked_at = now
+        if now - last_used < interval:
+            continue
+        if not conn.is_usable():
+            # next query opens a new connection
+            conn.close()
+
+def mark_connections_used(**kwargs):
+    now = time.time()
+    for conn in connections.all():
+        if conn.connection is not None:
+            conn.health_checked_at = now
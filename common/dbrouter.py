@@ -0,0 +1,100 @@
+"""Read-replica routing with read-your-writes stickiness.
+
+Reads go to the primary ('default') unless the current thread has been
+switched to replica reads by ReplicaReadMixin. The mixin does that only
+for safe-method requests of views that opt in, after authentication, and
+only if the user has not written within ORBIT_REPLICA_PIN_SECONDS. A user
+is pinned to the primary by PinPrimaryAfterWriteMiddleware after each
+unsafe-method request, so a just-created entry still shows up in the
+user's feed even if the replicas lag behind.
+
+Replica aliases are listed in settings.ORBIT_REPLICA_DATABASES.
+"""
+import random
+import threading
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+PIN_KEY = 'db:pin:{0}'
+
+# apps and models that are always read from the primary
+PRIMARY_APPS = ('oauth2_provider', 'sessions', 'admin', 'social_auth')
+PRIMARY_MODELS = ('users.job', 'users.outboxevent', 'users.idempotencykey', 'users.documenttombstone')
+
+_state = threading.local()
+
+def get_replicas():
+    return getattr(settings, 'ORBIT_REPLICA_DATABASES', [])
+
+def use_replica(user_id=None):
+    """Send reads of the current thread to a replica, unless user_id is pinned to the primary"""
+    replicas = get_replicas()
+    if not replicas or (user_id is not None and is_pinned(user_id)):
+        _state.replica = None
+        return
+    _state.replica = random.choice(replicas)
+
+def use_primary():
+    _state.replica = None
+
+def pin_user(user_id):
+    """Read from the primary for the user's next requests"""
+    cache.set(PIN_KEY.format(user_id), 1, getattr(settings, 'ORBIT_REPLICA_PIN_SECONDS', 10))
+
+def is_pinned(user_id):
+    return cache.get(PIN_KEY.format(user_id)) is not None
+
+
+class ReplicaRouter(object):
+    """Routes reads to the replica selected for the current thread. Writes go to the primary."""
+    def db_for_read(self, model, **hints):
+        replica = getattr(_state, 'replica', None)
+        if replica is None:
+            return 'default'
+        opts = model._meta
+        if opts.app_label in PRIMARY_APPS or opts.label_lower in PRIMARY_MODELS:
+            return 'default'
+        return replica
+
+    def db_for_write(self, model, **hints):
+        # any later read of this request must see the write
+        use_primary()
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # all databases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+class ReplicaReadMixin(object):
+    """For DRF views whose safe-method responses may be read from a replica"""
+    def initial(self, request, *args, **kwargs):
+        # authentication and permission checks read from the primary
+        super(ReplicaReadMixin, self).initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            use_replica(request.user.pk)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super(ReplicaReadMixin, self).dispatch(request, *args, **kwargs)
+        finally:
+            use_primary()
+
+
+class PinPrimaryAfterWriteMiddleware(object):
+    """Pin the user to the primary after an unsafe-method request"""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS and get_replicas():
+            # DRF sets request.user to the user of the token
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                pin_user(user.pk)
+        return response
@@ -0,0 +1,60 @@
+"""Bounded in-process LRU cache with per-entry TTL"""
+import threading
+import time
+from collections import OrderedDict
+
+class LRUCache(object):
+    """
+    Thread-safe LRU cache. At most maxsize entries are kept (the least
+    recently used entry is evicted first), and an entry expires ttl seconds
+    after it was set (a smaller ttl may be given per entry).
+    """
+    def __init__(self, maxsize=1000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict() # key => (expires timestamp, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None or item[0] <= time.time():
+                self.misses += 1
+                return default
+            # re-insert to mark as most recently used
+            self._data[key] = item
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        if ttl is None or ttl > self.ttl:
+            ttl = self.ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + ttl, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
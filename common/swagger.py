@@ -7,7 +7,7 @@ class SwaggerCustomUIRenderer(SwaggerUIRenderer):
 
     def render(self, data, accepted_media_type=None, renderer_context=None):
         self.set_context(renderer_context)
-        token = new_access_token(renderer_context['request'].user)
+        token = new_access_token(renderer_context['request'].user, reuse=True)
         renderer_context['access_token'] = token
         return render(
             renderer_context['request'],
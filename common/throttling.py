@@ -0,0 +1,194 @@
+"""Token-bucket request throttling shared by all processes.
+
+The bucket of a scope and client is kept in the cache as its theoretical
+arrival time (GCRA, which is equivalent to a token bucket): each request
+atomically increments it by the time that one token takes to refill, and
+is allowed if the result is at most one full bucket ahead of now. A
+rejected request gives its token back. Only the increment is needed per
+request, so no lock or read-modify-write cycle is involved. This needs a
+cache whose incr is atomic (memcached or redis): settings.ORBIT_THROTTLE_CACHE
+names that cache. The configured local and file caches are rejected, as
+their incr is a get and set that loses updates, and they evict keys. If
+ORBIT_THROTTLE_CACHE is None, the buckets are kept in a cache local to the
+process (its incr holds a lock), so each process allows the full rate. That
+is only a system check warning with DEBUG, and an error otherwise (see
+check_throttle_cache). To disable throttling, set ORBIT_THROTTLE_RATES to {}.
+
+Rates are configured per scope in settings.ORBIT_THROTTLE_RATES, with
+separate 'user' and 'ip' rates, in the DRF format 'N/s|m|h|d'. A view
+selects its scope with the throttle_scope attribute (default 'write').
+Safe-method requests are not throttled, except by throttles that set
+exempt_safe_methods = False (e.g. login). Rejected requests get a 429
+response with a Retry-After header, and are counted per scope in the cache.
+"""
+import hashlib
+import math
+import time
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import force_bytes
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+DEFAULT_SCOPE = 'write'
+BUCKET_KEY = 'throttle:{0}:{1}:{2}'
+REJECTS_KEY = 'throttle:rejects:{0}:{1}'
+# buckets of idle clients are full again long before this
+KEY_TTL = 86400
+KINDS = ('user', 'ip')
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+# cache backends with an atomic (server-side) incr
+ATOMIC_INCR_BACKENDS = (
+    'django.core.cache.backends.memcached.MemcachedCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+    'django_redis.cache.RedisCache',
+)
+
+# buckets of the process if ORBIT_THROTTLE_CACHE is None. MAX_ENTRIES is
+# large, since an evicted bucket is full again.
+_local_cache = LocMemCache('orbit-throttle', {'OPTIONS': {'MAX_ENTRIES': 100000}})
+
+def get_cache():
+    """Returns the throttle cache (the cache of the process if
+    ORBIT_THROTTLE_CACHE is None).
+    Raises ImproperlyConfigured if the incr of the cache is not atomic.
+    """
+    alias = getattr(settings, 'ORBIT_THROTTLE_CACHE', None)
+    if alias is None:
+        return _local_cache
+    backend = settings.CACHES[alias]['BACKEND']
+    if backend not in ATOMIC_INCR_BACKENDS:
+        raise ImproperlyConfigured(
+            'ORBIT_THROTTLE_CACHE {0!r} uses {1}, which has no atomic incr. '
+            'Use memcached or redis, or set it to None to disable throttling.'.format(alias, backend))
+    return caches[alias]
+
+def check_throttle_cache(app_configs, **kwargs):
+    """System check: error if the throttle cache is not usable, or if the
+    buckets are local to each process (only a warning with DEBUG)"""
+    try:
+        get_cache()
+    except ImproperlyConfigured as e:
+        return [checks.Error(str(e), id='orbit.E001')]
+    if getattr(settings, 'ORBIT_THROTTLE_CACHE', None) is None:
+        msg = 'ORBIT_THROTTLE_CACHE is not set: each process throttles requests on its own.'
+        hint = 'Set ORBIT_MEMCACHED_LOCATION (or ORBIT_THROTTLE_CACHE to a memcached or redis cache).'
+        if settings.DEBUG:
+            return [checks.Warning(msg, hint=hint, id='orbit.W001')]
+        return [checks.Error(msg, hint=hint, id='orbit.E001')]
+    return []
+
+def get_rate(scope, kind):
+    """Returns (capacity, period seconds) or None if the scope is not limited for kind"""
+    rate = getattr(settings, 'ORBIT_THROTTLE_RATES', {}).get(scope, {}).get(kind)
+    if not rate:
+        return None
+    num, period = rate.split('/')
+    return (int(num), DURATIONS[period[0]])
+
+def take(cache, key, capacity, period):
+    """Take a token from the bucket at key in cache.
+    Returns seconds to wait for the next token, or 0 if a token was taken.
+    """
+    interval = max(int(period*1000/capacity), 1) # ms to refill one token
+    now = int(time.time()*1000)
+    try:
+        tat = cache.incr(key, interval)
+    except ValueError:
+        tat = None
+    if tat is None or tat < now + interval:
+        # bucket is full: new client, or idle for a full refill
+        cache.set(key, now + interval, KEY_TTL)
+        return 0
+    excess = tat - now - capacity*interval
+    if excess <= 0:
+        return 0
+    try:
+        cache.decr(key, interval)
+    except ValueError:
+        pass
+    return int(math.ceil(excess/1000.0))
+
+def count_reject(cache, scope, kind):
+    key = REJECTS_KEY.format(scope, kind)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+def throttle_stats():
+    """Returns dict of scope => number of rejected requests per kind
+    (of this process only if ORBIT_THROTTLE_CACHE is None)
+    """
+    cache = get_cache()
+    scopes = getattr(settings, 'ORBIT_THROTTLE_RATES', {})
+    keys = [REJECTS_KEY.format(scope, kind) for scope in scopes for kind in KINDS]
+    counts = cache.get_many(keys)
+    return dict(
+        (scope, dict((kind, counts.get(REJECTS_KEY.format(scope, kind), 0)) for kind in KINDS))
+        for scope in scopes
+    )
+
+
+class TokenBucketThrottle(BaseThrottle):
+    kind = None
+    scope = None # default: throttle_scope of the view
+    exempt_safe_methods = True
+
+    def get_scope(self, view):
+        return self.scope or getattr(view, 'throttle_scope', DEFAULT_SCOPE)
+
+    def get_client_id(self, request):
+        raise NotImplementedError('.get_client_id() must be overridden')
+
+    def get_ip_id(self, request):
+        """Returns a digest of the client IP address. The address can come from
+        X-Forwarded-For (see NUM_PROXIES), so it is not used in keys as is.
+        """
+        return hashlib.sha1(force_bytes(self.get_ident(request) or '')).hexdigest()
+
+    def allow_request(self, request, view):
+        if self.exempt_safe_methods and request.method in SAFE_METHODS:
+            return True
+        scope = self.get_scope(view)
+        rate = get_rate(scope, self.kind)
+        if rate is None:
+            return True
+        cache = get_cache()
+        key = BUCKET_KEY.format(scope, self.kind, self.get_client_id(request))
+        self._wait = take(cache, key, *rate)
+        if self._wait:
+            count_reject(cache, scope, self.kind)
+            return False
+        return True
+
+    def wait(self):
+        return self._wait
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """Bucket per user. Anonymous requests use the bucket of their IP address."""
+    kind = 'user'
+
+    def get_client_id(self, request):
+        if request.user and request.user.is_authenticated:
+            return request.user.pk
+        return 'ip-{0}'.format(self.get_ip_id(request))
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    """Bucket per client IP address (see NUM_PROXIES in DRF settings)"""
+    kind = 'ip'
+
+    def get_client_id(self, request):
+        return self.get_ip_id(request)
+
+
+class LoginThrottle(IPTokenBucketThrottle):
+    """For the login views, which are called with GET"""
+    scope = 'login'
+    exempt_safe_methods = False
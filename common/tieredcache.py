@@ -0,0 +1,140 @@
+"""Two-level cache: bounded in-process LRU (L1) in front of a shared Django
+cache backend (L2).
+
+Keys of a TieredCache live in a namespace whose version number is stored in
+L2. invalidate() increments the version, so that every node stops using the
+entries of the old version (L1 entries of other nodes are dropped once
+their process re-reads the version, at most version_ttl seconds later).
+delete() removes a key from L2 and the local L1. Other nodes may serve
+their L1 copy of the key for up to local_ttl seconds.
+"""
+import threading
+import time
+from django.core.cache import caches
+from .lrucache import LRUCache
+
+# namespace => TieredCache
+_registry = {}
+_registry_lock = threading.Lock()
+
+class TieredCache(object):
+    def __init__(self, namespace, alias='default', maxsize=1000, ttl=300, local_ttl=60, version_ttl=5):
+        """
+        namespace: prefix of all keys of this cache
+        alias: CACHES alias of the L2 backend
+        maxsize: max number of L1 entries
+        ttl: default seconds an entry is kept in L2
+        local_ttl: max seconds an entry is kept in L1
+        version_ttl: seconds the namespace version is cached in-process
+        """
+        self.namespace = namespace
+        self.alias = alias
+        self.ttl = ttl
+        self.version_ttl = version_ttl
+        self.local = LRUCache(maxsize=maxsize, ttl=local_ttl)
+        self._version = None
+        self._version_checked = 0
+        self._lock = threading.Lock()
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.invalidations = 0
+        with _registry_lock:
+            _registry[namespace] = self
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def _version_key(self):
+        return '{0}:version'.format(self.namespace)
+
+    def get_version(self):
+        """Returns the namespace version, re-read from L2 every version_ttl seconds"""
+        now = time.time()
+        if self._version is None or now - self._version_checked > self.version_ttl:
+            version = self.shared.get(self._version_key())
+            if version is None:
+                version = int(now)
+                if not self.shared.add(self._version_key(), version, None):
+                    version = self.shared.get(self._version_key(), version)
+            with self._lock:
+                self._version = version
+                self._version_checked = now
+        return self._version
+
+    def make_key(self, key):
+        return '{0}:{1}:{2}'.format(self.namespace, self.get_version(), key)
+
+    def get(self, key, default=None):
+        full_key = self.make_key(key)
+        value = self.local.get(full_key)
+        if value is not None:
+            return value
+        value = self.shared.get(full_key)
+        if value is None:
+            self.l2_misses += 1
+            return default
+        self.l2_hits += 1
+        self.local.set(full_key, value)
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Store value (must not be None) in L1 and L2.
+        ttl (seconds) defaults to the ttl of the cache."""
+        if ttl is None:
+            ttl = self.ttl
+        ttl = max(int(ttl), 1)
+        full_key = self.make_key(key)
+        self.shared.set(full_key, value, ttl)
+        self.local.set(full_key, value, ttl)
+
+    def get_or_set(self, key, func, ttl=None):
+        """Returns cached value of key, or calls func to compute and store it"""
+        value = self.get(key)
+        if value is None:
+            value = func()
+            self.set(key, value, ttl)
+        return value
+
+    def delete(self, key):
+        full_key = self.make_key(key)
+        self.local.delete(full_key)
+        self.shared.delete(full_key)
+
+    def invalidate(self):
+        """Drop all entries of this cache on all nodes"""
+        try:
+            version = self.shared.incr(self._version_key())
+        except ValueError:
+            # version key is missing from L2: start a new version
+            version = int(time.time())
+            self.shared.set(self._version_key(), version, None)
+        with self._lock:
+            self._version = version
+            self._version_checked = time.time()
+        self.invalidations += 1
+        self.local.clear()
+
+    def stats(self):
+        local = self.local.stats()
+        return {
+            'l1': local,
+            'l2': {
+                'alias': self.alias,
+                'hits': self.l2_hits,
+                'misses': self.l2_misses
+            },
+            'hitRatio': self._hit_ratio(local['hits'] + self.l2_hits, self.l2_misses),
+            'invalidations': self.invalidations
+        }
+
+    def _hit_ratio(self, hits, misses):
+        total = hits + misses
+        return round(float(hits)/total, 4) if total else None
+
+
+def cache_stats():
+    """Returns dict of namespace => stats of all TieredCache instances of the process"""
+    with _registry_lock:
+        tiered = list(_registry.values())
+    return dict((c.namespace, c.stats()) for c in tiered)
@@ -0,0 +1,27 @@
+"""URL normalization for deduplicating page URLs.
+
+normalize_url lowercases the scheme and host, drops the default port, the
+fragment and the userinfo, and uses / for an empty path. Path and query are
+kept as they are, since sites may treat them as case and order sensitive.
+"""
+import hashlib
+from django.utils.encoding import force_bytes
+from django.utils.six.moves.urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').rstrip('.')
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port != DEFAULT_PORTS.get(scheme):
+        host = '{0}:{1}'.format(host, port)
+    return urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+def url_hash(url):
+    """sha256 hex digest of the normalized url"""
+    return hashlib.sha256(force_bytes(normalize_url(url))).hexdigest()
@@ -72,17 +72,27 @@ api_patterns = [
     # FEED
     url(r'^feed/?$', views.FeedList.as_view()),
     url(r'^feed/(?P<pk>[0-9]+)/?$', views.FeedEntryDetail.as_view()),
+    url(r'^feed/sync/?$', views.FeedSync.as_view()),
     url(r'^feed/browser-cme-offers/?$', views.BrowserCmeOfferList.as_view()),
     ##url(r'^feed/browser-cme-offer/?$', views.GetBrowserCmeOffer.as_view()),
     url(r'^feed/browser-cme/?$', views.CreateBrowserCme.as_view()),
+    url(r'^feed/browser-cme-batch/?$', views.RedeemBrowserCmeBatch.as_view()),
+    url(r'^activity/?$', views.ActivityIngest.as_view()),
     url(r'^feed/browser-cme/(?P<pk>[0-9]+)/?$', views.UpdateBrowserCme.as_view()),
     url(r'^feed/cme/?$', views.CreateSRCme.as_view()),
     url(r'^feed/cme-spec/?$', views.CreateSRCmeSpec.as_view()),
+    url(r'^feed/cme-bulk/?$', views.CreateSRCmeBulk.as_view()),
     url(r'^feed/cme/(?P<pk>[0-9]+)/?$', views.UpdateSRCme.as_view()),
 
     # user feedback (list/create)
     url(r'^feedback/?$', views.UserFeedbackList.as_view()),
 
+    # entries and offers including archived ones
+    url(r'^archive/(?P<kind>entries|offers)/(?P<pk>[0-9]+)/?$', views.ArchiveLookup.as_view()),
+
+    # operational metrics (staff only)
+    url(r'^metrics/?$', views.Metrics.as_view()),
+
     # debug
     url(r'^debug/make-browser-cme-offer/?$', debug_views.MakeBrowserCmeOffer.as_view()),
     url(r'^debug/feed/reward/?$', debug_views.MakeRewardEntry.as_view()),
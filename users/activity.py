@@ -0,0 +1,199 @@
+"""Plugin activity ingestion and offer generation.
+
+The activity endpoint stores the browsing events of a request with a
+single bulk insert into ActivityEvent, and schedules a processing job at
+most once per ORBIT_ACTIVITY_PROCESS_DELAY seconds. The job claims the
+buffered events in batches by deleting them, aggregates them per user and
+page into PageActivity, and makes a BrowserCmeOffer for each PageActivity that passes the
+thresholds in settings (one offer per user and page). The process_activity
+command does the same for use from cron.
+"""
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from common.urlnorm import url_hash
+from .jobs import enqueue
+from .models import ActivityEvent, BrowserCmeOffer, Page, PageActivity
+
+logger = logging.getLogger(__name__)
+
+SCHEDULED_KEY = 'activity:scheduled'
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+def add_events(user, events):
+    """Store validated event dicts (url, pageTitle, startTime, dwell) of user.
+    Returns number of events stored.
+    """
+    ActivityEvent.objects.bulk_create([
+        ActivityEvent(
+            user=user,
+            url=event['url'],
+            pageTitle=event.get('pageTitle', ''),
+            startTime=event['startTime'],
+            dwell=event['dwell'])
+        for event in events
+    ])
+    transaction.on_commit(schedule_processing)
+    return len(events)
+
+def schedule_processing():
+    """Enqueue a processing job unless one was enqueued in the last
+    ORBIT_ACTIVITY_PROCESS_DELAY seconds. The job runs after that delay,
+    so that it aggregates the events of many requests.
+    """
+    delay = _setting('ORBIT_ACTIVITY_PROCESS_DELAY', 30)
+    if cache.add(SCHEDULED_KEY, 1, delay):
+        enqueue(process_activity, delay=delay)
+
+def aggregate(events):
+    """Returns OrderedDict of (user_id, urlHash) => dict of the events' url,
+    pageTitle, visits, dwell, firstActivity and lastActivity.
+    """
+    groups = OrderedDict()
+    for e in events:
+        key = (e.user_id, url_hash(e.url))
+        g = groups.get(key)
+        if g is None:
+            groups[key] = {
+                'url': e.url,
+                'pageTitle': e.pageTitle,
+                'visits': 1,
+                'dwell': e.dwell,
+                'firstActivity': e.startTime,
+                'lastActivity': e.startTime
+            }
+            continue
+        g['visits'] += 1
+        g['dwell'] += e.dwell
+        g['firstActivity'] = min(g['firstActivity'], e.startTime)
+        g['lastActivity'] = max(g['lastActivity'], e.startTime)
+        if e.pageTitle:
+            g['pageTitle'] = e.pageTitle
+    return groups
+
+def passes_thresholds(activity):
+    return activity.offered is None \
+        and activity.dwell >= _setting('ORBIT_OFFER_MIN_DWELL', 120) \
+        and activity.visits >= _setting('ORBIT_OFFER_MIN_VISITS', 1)
+
+def make_offers(activities, now):
+    """Bulk insert a BrowserCmeOffer per PageActivity, and mark them offered"""
+    expireDate = now + timedelta(seconds=_setting('ORBIT_OFFER_TTL', 7*86400))
+    points = Decimal(str(_setting('ORBIT_OFFER_POINTS', '10.0')))
+    credits = Decimal(str(_setting('ORBIT_OFFER_CREDITS', '0.5')))
+    BrowserCmeOffer.objects.bulk_create([
+        BrowserCmeOffer(
+            user_id=a.user_id,
+            page_id=a.page_id,
+            activityDate=a.lastActivity,
+            expireDate=expireDate,
+            points=points,
+            credits=credits)
+        for a in activities
+    ])
+    PageActivity.objects.filter(pk__in=[a.pk for a in activities]).update(offered=now)
+
+class ClaimConflict(Exception):
+    """Some events of the batch were claimed by a concurrent run"""
+
+def claim_events(batch_size):
+    """
+    Returns the oldest batch_size events, deleted in the current transaction.
+    The delete is the claim: a concurrent run that read some of the same
+    events deletes fewer rows than it read, and raises ClaimConflict to
+    roll back its batch. The events are also locked on PostgreSQL, so that
+    the concurrent run waits instead.
+    """
+    events = list(ActivityEvent.objects.select_for_update().order_by('pk')[:batch_size])
+    if events:
+        num_deleted, details = ActivityEvent.objects.filter(pk__in=[e.pk for e in events]).delete()
+        if num_deleted != len(events):
+            raise ClaimConflict()
+    return events
+
+def process_batch(batch_size):
+    """
+    Claim the oldest batch_size events, aggregate them into PageActivity
+    and make the offers that are due, in one transaction. A batch that
+    conflicts with a concurrent run is rolled back and claimed again.
+    Returns (num_events, num_offers).
+    """
+    while True:
+        try:
+            return _process_batch(batch_size)
+        except ClaimConflict:
+            logger.info('Activity events were claimed by a concurrent run, retrying')
+
+def _process_batch(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        events = claim_events(batch_size)
+        if not events:
+            return (0, 0)
+        groups = aggregate(events)
+        pages = Page.objects.get_for_urls(OrderedDict(
+            (g['url'], g['pageTitle']) for g in groups.values()))
+        totals = OrderedDict(((user_id, pages[h]), g) for (user_id, h), g in groups.items())
+        existing = PageActivity.objects.select_for_update().filter(
+            user_id__in=set(user_id for user_id, page_id in totals),
+            page_id__in=set(page_id for user_id, page_id in totals))
+        activities = dict(((a.user_id, a.page_id), a) for a in existing if (a.user_id, a.page_id) in totals)
+        new = []
+        for key, g in totals.items():
+            a = activities.get(key)
+            if a is None:
+                new.append(PageActivity(
+                    user_id=key[0],
+                    page_id=key[1],
+                    visits=g['visits'],
+                    dwell=g['dwell'],
+                    firstActivity=g['firstActivity'],
+                    lastActivity=g['lastActivity']))
+                continue
+            a.visits += g['visits']
+            a.dwell += g['dwell']
+            a.lastActivity = max(a.lastActivity, g['lastActivity'])
+            PageActivity.objects.filter(pk=a.pk).update(
+                visits=F('visits') + g['visits'],
+                dwell=F('dwell') + g['dwell'],
+                lastActivity=a.lastActivity,
+                modified=now)
+        due = [a for a in activities.values() if passes_thresholds(a)]
+        if new:
+            PageActivity.objects.bulk_create(new)
+            due_keys = set((a.user_id, a.page_id) for a in new if passes_thresholds(a))
+            if due_keys:
+                # bulk_create does not set the ids on all backends
+                due.extend(a for a in PageActivity.objects.filter(
+                    user_id__in=set(user_id for user_id, page_id in due_keys),
+                    page_id__in=set(page_id for user_id, page_id in due_keys),
+                    offered__isnull=True) if (a.user_id, a.page_id) in due_keys)
+        if due:
+            make_offers(due, now)
+    return (len(events), len(due))
+
+def process_activity(batch_size=None):
+    """Job task: process buffered events in batches until none are left.
+    Returns (num_events, num_offers).
+    """
+    if batch_size is None:
+        batch_size = _setting('ORBIT_ACTIVITY_BATCH_SIZE', 500)
+    total_events = 0
+    total_offers = 0
+    while True:
+        num_events, num_offers = process_batch(batch_size)
+        total_events += num_events
+        total_offers += num_offers
+        if num_events < batch_size:
+            break
+    if total_events:
+        logger.info('Processed {0} activity events, made {1} offers'.format(total_events, total_offers))
+    return (total_events, total_offers)
@@ -1,4 +1,5 @@
 from django.contrib import admin
+from common.adminutils import CreatedListFilter, LargeTableAdmin
 from .models import *
 
 class DegreeAdmin(admin.ModelAdmin):
@@ -15,23 +16,39 @@ class ProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'firstName', 'lastName', 'contactEmail', 'npiNumber', 'modified')
     search_fields = ['npiNumber', 'lastName']
 
-class CustomerAdmin(admin.ModelAdmin):
+class CustomerAdmin(LargeTableAdmin):
     list_display = ('user', 'customerId', 'balance', 'modified')
-    search_fields = ['contactEmail',]
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    search_fields = ['=customerId', '=user__username']
 
-class BrowserCmeOfferAdmin(admin.ModelAdmin):
-    list_display = ('user', 'activityDate', 'redeemed', 'expireDate', 'url')
-    list_filter = ('redeemed',)
+class BrowserCmeOfferAdmin(LargeTableAdmin):
+    list_display = ('user', 'activityDate', 'redeemed', 'expireDate', 'page')
+    list_filter = ('redeemed', CreatedListFilter)
+    list_select_related = ('user', 'page')
+    raw_id_fields = ('user', 'page')
+    search_fields = ['=user__username']
+
+class PageAdmin(admin.ModelAdmin):
+    list_display = ('url', 'title', 'created')
+    search_fields = ['^url']
 
 class EntryTypeAdmin(admin.ModelAdmin):
     list_display = ('name', 'description', 'created')
 
-class EntryAdmin(admin.ModelAdmin):
+class EntryAdmin(LargeTableAdmin):
     list_display = ('user', 'entryType', 'activityDate', 'valid', 'document', 'description', 'created')
-    list_filter = ('entryType', 'valid')
+    list_filter = ('entryType', 'valid', CreatedListFilter)
+    list_select_related = ('user', 'entryType')
+    raw_id_fields = ('user',)
+    search_fields = ['=user__username']
 
-class PointTransactionAdmin(admin.ModelAdmin):
+class PointTransactionAdmin(LargeTableAdmin):
     list_display = ('customer', 'points', 'pricePaid', 'transactionId', 'created')
+    list_filter = (CreatedListFilter,)
+    list_select_related = ('customer',)
+    raw_id_fields = ('customer', 'entry')
+    search_fields = ['=transactionId', '=customer__user__username']
 
 class PpoAdmin(admin.ModelAdmin):
     list_display = ('points', 'price', 'created')
@@ -53,6 +70,7 @@ admin.site.register(Customer, CustomerAdmin)
 admin.site.register(Degree, DegreeAdmin)
 admin.site.register(Entry, EntryAdmin)
 admin.site.register(EntryType, EntryTypeAdmin)
+admin.site.register(Page, PageAdmin)
 admin.site.register(Profile, ProfileAdmin)
 admin.site.register(PointTransaction, PointTransactionAdmin)
 admin.site.register(PointPurchaseOption, PpoAdmin)
@@ -1,7 +1,25 @@
 from __future__ import unicode_literals
 
 from django.apps import AppConfig
+from django.core import checks
+from django.core.signals import request_started, request_finished
+from django.db.models.signals import post_save, post_delete
 
 
 class UsersConfig(AppConfig):
     name = 'users'
+
+    def ready(self):
+        from common.dbhealth import check_connections, mark_connections_used
+        request_started.connect(check_connections, dispatch_uid='db-health-check')
+        request_finished.connect(mark_connections_used, dispatch_uid='db-health-mark-used')
+        from .refdata import REFDATA_MODELS, invalidate_refdata
+        for model in REFDATA_MODELS:
+            post_save.connect(invalidate_refdata, sender=model, dispatch_uid='refdata-save-{0}'.format(model.__name__))
+            post_delete.connect(invalidate_refdata, sender=model, dispatch_uid='refdata-delete-{0}'.format(model.__name__))
+        from django.contrib.auth.models import User
+        from .authentication import check_jwt_cache, invalidate_user_tokens
+        post_save.connect(invalidate_user_tokens, sender=User, dispatch_uid='token-cache-deactivate')
+        checks.register(check_jwt_cache)
+        from common.throttling import check_throttle_cache
+        checks.register(check_throttle_cache)
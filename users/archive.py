@@ -0,0 +1,169 @@
+"""Archival of old rows to ArchivedRecord.
+
+The archive_data command moves, in chunks of one transaction each:
+    - invalid Entries last modified before ORBIT_ARCHIVE_ENTRY_DAYS, with
+      their SRCme/BrowserCme/ExBrowserCme/Reward row and tags. Entries that
+      a PointTransaction refers to are kept.
+    - BrowserCmeOffers that expired before ORBIT_ARCHIVE_OFFER_DAYS and
+      that no BrowserCme or ExBrowserCme refers to.
+Each row is stored as zlib-compressed JSON (see entry_payload and
+offer_payload) and deleted from its table. The document of an archived
+entry is kept in storage (documents.referenced_names includes archives).
+Invalid entries were already reported as deleted by feed sync, and sync
+tokens older than ORBIT_SYNC_TOMBSTONE_TTL get a reset, so the retention
+must be longer than that TTL.
+
+find_entry and find_offer read through: they return the payload of the
+live row if it exists, else that of the archived row.
+"""
+import json
+import zlib
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.utils import timezone
+from .models import ArchivedRecord, BrowserCmeOffer, Entry, PointTransaction
+
+ENTRY_SUBTYPES = ('srcme', 'brcme', 'exbrcme', 'reward')
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+def row(obj):
+    """Returns dict of the concrete field values of obj (FKs by id, files by name)"""
+    data = {}
+    for f in obj._meta.concrete_fields:
+        value = f.value_from_object(obj)
+        if isinstance(f, models.FileField):
+            value = value.name if value else None
+        data[f.attname] = value
+    return data
+
+def entry_payload(entry):
+    """Expects entry with entryType, subtypes (and their page) selected and tags prefetched"""
+    payload = {
+        'entry': row(entry),
+        'entryType': entry.entryType.name,
+        'tags': [tag.pk for tag in entry.tags.all()]
+    }
+    for name in ENTRY_SUBTYPES:
+        try:
+            sub = getattr(entry, name)
+        except ObjectDoesNotExist:
+            continue
+        payload[name] = row(sub)
+        if hasattr(sub, 'page'):
+            payload[name]['url'] = sub.get_url()
+            payload[name]['pageTitle'] = sub.get_page_title()
+    return payload
+
+def offer_payload(offer):
+    """Expects offer with page selected"""
+    payload = {'offer': row(offer)}
+    payload['offer']['url'] = offer.page.url
+    payload['offer']['pageTitle'] = offer.page.title
+    return payload
+
+def to_json(payload):
+    return json.dumps(payload, cls=DjangoJSONEncoder)
+
+def compress(payload):
+    return zlib.compress(to_json(payload).encode('utf-8'))
+
+def decompress(data):
+    return json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
+
+def entry_candidates(cutoff):
+    return Entry.objects.filter(valid=False, modified__lt=cutoff, pointtransaction__isnull=True)
+
+def offer_candidates(cutoff):
+    return BrowserCmeOffer.objects.filter(expireDate__lt=cutoff, brcme__isnull=True, exbrcme__isnull=True)
+
+def archive_entries(cutoff, chunk_size):
+    """Archive one chunk of entries. Returns (number of candidates, number
+    archived): candidates that fail the re-check under the lock are skipped.
+    Raises ProtectedError (and rolls back the chunk) if an entry got a
+    PointTransaction meanwhile.
+    """
+    with transaction.atomic():
+        ids = list(entry_candidates(cutoff).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        num_candidates = len(ids)
+        if not ids:
+            return (0, 0)
+        # lock the rows (without the outer joins) and re-check them under the lock
+        ids = set(Entry.objects.select_for_update()
+            .filter(pk__in=ids, valid=False).values_list('pk', flat=True))
+        ids -= set(PointTransaction.objects.filter(entry_id__in=ids).values_list('entry_id', flat=True))
+        entries = Entry.objects.filter(pk__in=ids) \
+            .select_related('entryType', 'srcme', 'brcme__page', 'exbrcme__page', 'reward') \
+            .prefetch_related('tags')
+        ArchivedRecord.objects.bulk_create([
+            ArchivedRecord(
+                kind=ArchivedRecord.KIND_ENTRY,
+                objectId=entry.pk,
+                userId=entry.user_id,
+                document=entry.document.name if entry.document else '',
+                created=entry.created,
+                payload=compress(entry_payload(entry)))
+            for entry in entries
+        ])
+        Entry.objects.filter(pk__in=ids).delete()
+    return (num_candidates, len(ids))
+
+def archive_offers(cutoff, chunk_size):
+    """Archive one chunk of offers. Returns (number of candidates, number
+    archived). Raises ProtectedError (and rolls back the chunk) if an offer
+    was redeemed meanwhile.
+    """
+    with transaction.atomic():
+        ids = list(offer_candidates(cutoff).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        num_candidates = len(ids)
+        if not ids:
+            return (0, 0)
+        # lock the offers only (FOR UPDATE of a join would lock the pages too)
+        ids = list(BrowserCmeOffer.objects.select_for_update().filter(pk__in=ids).values_list('pk', flat=True))
+        offers = BrowserCmeOffer.objects.filter(pk__in=ids).select_related('page')
+        ArchivedRecord.objects.bulk_create([
+            ArchivedRecord(
+                kind=ArchivedRecord.KIND_OFFER,
+                objectId=offer.pk,
+                userId=offer.user_id,
+                created=offer.created,
+                payload=compress(offer_payload(offer)))
+            for offer in offers
+        ])
+        BrowserCmeOffer.objects.filter(pk__in=ids).delete()
+    return (num_candidates, len(ids))
+
+def find_entry(pk):
+    """Returns (payload, archived datetime or None) of the entry, or None if not found"""
+    entry = Entry.objects.filter(pk=pk) \
+        .select_related('entryType', 'srcme', 'brcme__page', 'exbrcme__page', 'reward') \
+        .prefetch_related('tags') \
+        .first()
+    if entry is not None:
+        # same value types as an archived payload
+        return (json.loads(to_json(entry_payload(entry))), None)
+    return _find_archived(ArchivedRecord.KIND_ENTRY, pk)
+
+def find_offer(pk):
+    """Returns (payload, archived datetime or None) of the offer, or None if not found"""
+    offer = BrowserCmeOffer.objects.filter(pk=pk).select_related('page').first()
+    if offer is not None:
+        return (json.loads(to_json(offer_payload(offer))), None)
+    return _find_archived(ArchivedRecord.KIND_OFFER, pk)
+
+def _find_archived(kind, pk):
+    record = ArchivedRecord.objects.filter(kind=kind, objectId=pk).first()
+    if record is None:
+        return None
+    return (decompress(record.payload), record.archived)
+
+def default_cutoffs():
+    now = timezone.now()
+    return (
+        now - timedelta(days=_setting('ORBIT_ARCHIVE_ENTRY_DAYS', 365)),
+        now - timedelta(days=_setting('ORBIT_ARCHIVE_OFFER_DAYS', 180))
+    )
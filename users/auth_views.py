@@ -3,15 +3,20 @@ from pprint import pprint
 from django.contrib.auth import login as auth_login
 from django.contrib.auth import logout as auth_logout
 from django.shortcuts import render, redirect
+from django.utils import timezone
 from django.contrib.auth.decorators import login_required
 from social.apps.django_app.utils import psa
 from rest_framework import status
-from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, throttle_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 # proj
+from common.throttling import LoginThrottle
 from common.viewutils import render_to_json_response
 # app
-from .oauth_tools import new_access_token, get_access_token, delete_access_token
+from .authentication import SignedAccessToken, get_bearer_token
+from .oauth_tools import new_access_token, get_access_token, delete_access_token, get_jwt_token_dict
+from .social_tools import get_cached_user, cache_verified_user
+from .identity import get_identity
 from .models import Profile, Customer
 import logging
 
@@ -64,14 +69,25 @@ def auth_status(request):
             'error_message': 'User not authenticated'
         }
         return render_to_json_response(context, status_code=401)
-    token = get_access_token(user)
+    if isinstance(request.auth, SignedAccessToken):
+        signed_token = request.auth
+        expires_in = (signed_token.expires - timezone.now()).total_seconds()
+        token = get_jwt_token_dict(signed_token.token, expires_in, signed_token.scope)
+    else:
+        token = get_access_token(user)
     if not token:
         context = {
             'success': False,
             'error_message': 'User not authenticated'
         }
         return render_to_json_response(context, status_code=401)
-    customer = Customer.objects.get(user=user)
+    customer = get_identity(request).customer
+    if customer is None:
+        context = {
+            'success': False,
+            'error_message': 'Local customer object not found for user'
+        }
+        return render_to_json_response(context, status_code=400)
     context = {
         'success': True,
         'token': token,
@@ -88,11 +104,14 @@ def auth_status(request):
 @psa('social:complete')
 @api_view()
 @permission_classes((AllowAny,))
+@throttle_classes((LoginThrottle,))
 def login_via_token(request, backend, access_token):
     """
     This view expects an access_token GET parameter.
     request.backend and request.strategy will be loaded with the current
     backend and strategy.
+    A social token that was recently verified is not sent to the provider
+    again (and the pipeline is not rerun).
 
     parameters:
         - name: access_token
@@ -102,11 +121,21 @@ def login_via_token(request, backend, access_token):
           paramType: form
 
     """
-    user = request.backend.do_auth(access_token)
+    user = get_cached_user(request.backend, access_token)
+    if user is None:
+        user = request.backend.do_auth(access_token)
+        if user:
+            cache_verified_user(request.backend, access_token, user)
     pprint(user)
     if user:
         auth_login(request, user)
-        customer = Customer.objects.get(user=user)
+        customer = get_identity(request).customer
+        if customer is None:
+            context = {
+                'success': False,
+                'error_message': 'Local customer object not found for user'
+            }
+            return render_to_json_response(context, status_code=400)
         context = {
             'success': True,
             'token': new_access_token(user),
@@ -128,9 +157,13 @@ def login_via_token(request, backend, access_token):
 def logout_via_token(request):
     if request.user.is_authenticated:
         logger.info('logout user: {}'.format(request.user))
-        token = get_access_token(request.user)
-        logger.debug('got token {}'.format(token))
-        delete_access_token(request.user, token.get('access_token'))
+        # revoke the token that was presented with this request
+        if isinstance(request.auth, SignedAccessToken):
+            request.auth.revoke()
+        else:
+            token = get_bearer_token(request)
+            if token:
+                delete_access_token(request.user, token)
         auth_logout(request)
     context = {'success': True}
     return render_to_json_response(context)
@@ -0,0 +1,224 @@
+"""DRF authentication classes"""
+import copy
+import datetime
+import hashlib
+import time
+import jwt
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import checks
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework import exceptions
+from oauth2_provider.ext.rest_framework import OAuth2Authentication
+from oauth2_provider.models import AccessToken
+from common.tieredcache import TieredCache
+
+JWT_ISSUER = 'orbit'
+JWT_REVOKED_KEY = 'jwt:revoked:{0}'
+JWT_USER_REVOKED_KEY = 'jwt:revoked-user:{0}'
+# cache backends shared by all nodes (the revocation list of signed tokens must be)
+SHARED_CACHE_BACKENDS = (
+    'django.core.cache.backends.memcached.MemcachedCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+    'django.core.cache.backends.db.DatabaseCache',
+    'django_redis.cache.RedisCache',
+)
+
+token_cache = TieredCache('tokens',
+    maxsize=getattr(settings, 'ORBIT_TOKEN_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'ORBIT_TOKEN_CACHE_TTL', 60),
+    local_ttl=getattr(settings, 'ORBIT_TOKEN_CACHE_LOCAL_TTL', 10)
+)
+
+def token_cache_key(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def invalidate_token(token):
+    """Remove token from the validation cache (call after token is deleted)"""
+    token_cache.delete(token_cache_key(token))
+
+def invalidate_user_tokens(sender, instance, **kwargs):
+    """post_save receiver for User: removes the tokens of a deactivated user
+    from the validation cache, so that the cached copy of the user (with
+    is_active set) is not used any more, and revokes the user's signed tokens"""
+    if not instance.is_active:
+        for token in AccessToken.objects.filter(user=instance).values_list('token', flat=True):
+            invalidate_token(token)
+        revoke_user_jwts(instance.pk)
+
+def get_bearer_token(request):
+    auth = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(auth) == 2 and auth[0].lower() == 'bearer':
+        return auth[1]
+    return None
+
+
+class BaseTokenInfo(object):
+    """
+    Offers the same validity checks as oauth2_provider AccessToken, so that
+    subclasses can be used as request.auth by TokenHasScope permissions.
+    Subclasses must set the scope and expires attributes.
+    """
+    def is_valid(self, scopes=None):
+        return not self.is_expired() and self.allow_scopes(scopes)
+
+    def is_expired(self):
+        return timezone.now() >= self.expires
+
+    def allow_scopes(self, scopes):
+        if not scopes:
+            return True
+        return set(scopes).issubset(set(self.scope.split()))
+
+
+class CachedAccessToken(BaseTokenInfo):
+    """Validated access token as held in the validation cache"""
+    def __init__(self, access_token):
+        self.user = access_token.user
+        self.user_id = access_token.user_id
+        self.application_id = access_token.application_id
+        self.scope = access_token.scope
+        self.expires = access_token.expires
+
+
+class CachedOAuth2Authentication(OAuth2Authentication):
+    """
+    OAuth2Authentication with a two-level validation cache keyed by the
+    hash of the bearer token. A cache hit authenticates the request without
+    any database access. Entries expire after ORBIT_TOKEN_CACHE_TTL seconds
+    or when the token expires, whichever comes first. The in-process copy
+    (at most ORBIT_TOKEN_CACHE_SIZE entries) is kept for at most
+    ORBIT_TOKEN_CACHE_LOCAL_TTL seconds, which bounds how long a token
+    deleted (or a user deactivated) on another node is still accepted.
+    """
+    def authenticate(self, request):
+        token = get_bearer_token(request)
+        if token is None:
+            return super(CachedOAuth2Authentication, self).authenticate(request)
+        key = token_cache_key(token)
+        cached = token_cache.get(key)
+        if cached is not None and not cached.is_expired():
+            # copy so that changes to request.user do not leak into the cache
+            return copy.copy(cached.user), cached
+        result = super(CachedOAuth2Authentication, self).authenticate(request)
+        if result is not None:
+            user, access_token = result
+            cached = CachedAccessToken(access_token)
+            ttl = (access_token.expires - timezone.now()).total_seconds()
+            token_cache.set(key, cached, ttl)
+        return result
+
+
+#
+# Stateless signed access tokens (ORBIT_TOKEN_MODE = 'jwt')
+#
+def _jwt_secret():
+    return getattr(settings, 'ORBIT_JWT_SECRET', settings.SECRET_KEY)
+
+def _jwt_algorithm():
+    return getattr(settings, 'ORBIT_JWT_ALGORITHM', 'HS256')
+
+def encode_jwt(claims):
+    return jwt.encode(claims, _jwt_secret(), algorithm=_jwt_algorithm()).decode('utf-8')
+
+def decode_jwt(token):
+    """Verify signature, expiry and issuer of the token and return its claims.
+    Raises jwt.InvalidTokenError.
+    """
+    return jwt.decode(token, _jwt_secret(), algorithms=[_jwt_algorithm()], issuer=JWT_ISSUER)
+
+def revoke_user_jwts(user_id):
+    """Revoke all signed tokens of the user issued until now (e.g. when the
+    user is deactivated)"""
+    ttl = getattr(settings, 'ORBIT_JWT_EXPIRE_SECONDS', 3600) + 1
+    cache.set(JWT_USER_REVOKED_KEY.format(user_id), int(time.time()), ttl)
+
+def check_jwt_cache(app_configs, **kwargs):
+    """System check: in jwt token mode, the revocation list must be kept in a
+    cache that all nodes share, or a revoked token stays valid on the other
+    nodes. Error unless DEBUG is set."""
+    if getattr(settings, 'ORBIT_TOKEN_MODE', 'db') != 'jwt':
+        return []
+    backend = settings.CACHES['default']['BACKEND']
+    if backend in SHARED_CACHE_BACKENDS:
+        return []
+    msg = 'ORBIT_TOKEN_MODE is jwt, but the default cache ({0}) is not shared by all nodes.'.format(backend)
+    hint = 'Set ORBIT_MEMCACHED_LOCATION (the revocation list of signed tokens is kept in the default cache).'
+    if settings.DEBUG:
+        return [checks.Warning(msg, hint=hint, id='orbit.W002')]
+    return [checks.Error(msg, hint=hint, id='orbit.E002')]
+
+def _read_only(*args, **kwargs):
+    raise TypeError('The user of a signed access token is built from its claims and cannot be saved or deleted')
+
+
+class SignedAccessToken(BaseTokenInfo):
+    """Access token whose claims were verified from its signature"""
+    def __init__(self, token, claims):
+        self.token = token
+        self.claims = claims
+        self.jti = claims['jti']
+        self.user_id = claims['sub']
+        self.scope = claims.get('scope', '')
+        self.expires = datetime.datetime.fromtimestamp(claims['exp'], timezone.utc)
+
+    def make_user(self):
+        """Returns a User instance built from the claims (no database
+        access). It carries pk, username, names, email, is_staff and
+        is_active only, so it is read-only: save() and delete() raise
+        TypeError. Load the User from the database to change it.
+        """
+        user = User(
+            pk=self.user_id,
+            username=self.claims.get('username', ''),
+            first_name=self.claims.get('first_name', ''),
+            last_name=self.claims.get('last_name', ''),
+            email=self.claims.get('email', ''),
+            is_staff=self.claims.get('staff', False),
+            is_active=self.claims.get('active', False)
+        )
+        user.save = user.delete = _read_only
+        return user
+
+    def is_revoked(self):
+        """True if the token, or all tokens of the user issued until it was
+        issued, were revoked. One cache round trip."""
+        token_key = JWT_REVOKED_KEY.format(self.jti)
+        user_key = JWT_USER_REVOKED_KEY.format(self.user_id)
+        revoked = cache.get_many([token_key, user_key])
+        if token_key in revoked:
+            return True
+        return user_key in revoked and self.claims['iat'] <= revoked[user_key]
+
+    def revoke(self):
+        """Add the token to the revocation list until it expires"""
+        ttl = int((self.expires - timezone.now()).total_seconds()) + 1
+        if ttl > 0:
+            cache.set(JWT_REVOKED_KEY.format(self.jti), 1, ttl)
+
+
+class JWTAuthentication(OAuth2Authentication):
+    """
+    Authenticates a signed bearer token issued in ORBIT_TOKEN_MODE = 'jwt'.
+    Verification needs no database access: the user is built from the
+    token claims, and the revocation list is kept in the default cache,
+    which must be shared by all nodes (see check_jwt_cache). Bearer tokens
+    that are not JWTs are left to the next authentication class.
+    """
+    def authenticate(self, request):
+        token = get_bearer_token(request)
+        if token is None or token.count('.') != 2:
+            return None
+        try:
+            claims = decode_jwt(token)
+        except jwt.ExpiredSignatureError:
+            raise exceptions.AuthenticationFailed('Token has expired')
+        except jwt.InvalidTokenError:
+            raise exceptions.AuthenticationFailed('Invalid token')
+        signed_token = SignedAccessToken(token, claims)
+        if not claims.get('active', False):
+            raise exceptions.AuthenticationFailed('User inactive or deleted')
+        if signed_token.is_revoked():
+            raise exceptions.AuthenticationFailed('Token has been revoked')
+        return signed_token.make_user(), signed_token
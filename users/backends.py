@@ -0,0 +1,38 @@
+"""Social auth backends"""
+import hashlib
+from social.backends.oauth import BaseOAuth2
+
+class LocalOAuth2(BaseOAuth2):
+    """
+    Offline stand-in for the Facebook backend (for local testing only).
+    Any access token is accepted without a remote call. The same token
+    always maps to the same social uid, so the login flow, the pipeline and
+    the token cache of login_via_token can be exercised offline:
+        /api/v1/auth/login/local/<any-token>/
+    Enabled only if the environment sets ORBIT_ENABLE_LOCAL_AUTH=1.
+    """
+    name = 'local'
+    ID_KEY = 'id'
+    EXTRA_DATA = [
+        ('id', 'id'),
+        ('expires', 'expires')
+    ]
+
+    def user_data(self, access_token, *args, **kwargs):
+        uid = hashlib.sha1(access_token.encode('utf-8')).hexdigest()[:12]
+        return {
+            'id': uid,
+            'first_name': 'Local',
+            'last_name': uid,
+            'email': 'local-{0}@example.com'.format(uid),
+            'expires': 3600
+        }
+
+    def get_user_details(self, response):
+        return {
+            'username': 'local-{0}'.format(response['id']),
+            'email': response.get('email', ''),
+            'fullname': '{0} {1}'.format(response['first_name'], response['last_name']),
+            'first_name': response['first_name'],
+            'last_name': response['last_name']
+        }
@@ -0,0 +1,224 @@
+"""Helpers that front the Braintree gateway so that the checkout path does
+not pay for a gateway round trip on every request."""
+import collections
+import logging
+import threading
+import time
+import braintree
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from .models import Customer
+
+logger = logging.getLogger(__name__)
+
+CUSTOMER_TOKEN_KEY = 'bt:client-token:{0}'
+PAYMENT_METHODS_KEY = 'bt:payment-methods:{0}'
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class ClientTokenPool(object):
+    """
+    Pool of pre-generated (non customer-scoped) client tokens.
+    A background worker thread keeps the pool filled up to `size` tokens.
+    Tokens older than `ttl` seconds are evicted and never handed out.
+    """
+    def __init__(self, size, ttl, refill_interval):
+        self.size = size
+        self.ttl = ttl
+        self.refill_interval = refill_interval
+        self._tokens = collections.deque()  # (created timestamp, token)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker = None
+
+    def _evict_expired(self):
+        """Drop expired tokens. Caller must hold the lock"""
+        cutoff = time.time() - self.ttl
+        while self._tokens and self._tokens[0][0] < cutoff:
+            self._tokens.popleft()
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name='bt-client-token-pool')
+            self._worker.daemon = True
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refill()
+            except Exception:
+                logger.exception('ClientTokenPool refill failed')
+            self._wakeup.wait(self.refill_interval)
+            self._wakeup.clear()
+
+    def refill(self):
+        """Generate tokens until the pool is full"""
+        while True:
+            with self._lock:
+                self._evict_expired()
+                if len(self._tokens) >= self.size:
+                    return
+            token = braintree.ClientToken.generate()
+            with self._lock:
+                self._tokens.append((time.time(), token))
+
+    def get(self):
+        """Return an unexpired token from the pool.
+        Falls back to a synchronous gateway call if the pool is empty.
+        """
+        self._ensure_worker()
+        with self._lock:
+            self._evict_expired()
+            item = self._tokens.popleft() if self._tokens else None
+        self._wakeup.set()
+        if item is not None:
+            return item[1]
+        logger.debug('ClientTokenPool empty: generating token synchronously')
+        return braintree.ClientToken.generate()
+
+    def __len__(self):
+        with self._lock:
+            self._evict_expired()
+            return len(self._tokens)
+
+
+client_token_pool = ClientTokenPool(
+    size=_setting('BRAINTREE_CLIENT_TOKEN_POOL_SIZE', 10),
+    ttl=_setting('BRAINTREE_CLIENT_TOKEN_TTL', 3600),
+    refill_interval=_setting('BRAINTREE_CLIENT_TOKEN_REFILL_INTERVAL', 60)
+)
+
+def get_client_token():
+    """Returns a (non customer-scoped) client token from the pool"""
+    return client_token_pool.get()
+
+def get_customer_client_token(customer):
+    """Returns a client token scoped to the given local Customer instance
+    (not None). The token is generated on demand and cached briefly.
+    Raises ValueError if the Braintree Customer does not exist.
+    """
+    key = CUSTOMER_TOKEN_KEY.format(customer.customerId)
+    token = cache.get(key)
+    if token is None:
+        token = braintree.ClientToken.generate({
+            "customer_id": str(customer.customerId)
+        })
+        cache.set(key, token, _setting('BRAINTREE_CUSTOMER_TOKEN_TTL', 300))
+    return token
+
+
+def _run_in_background(func, *args):
+    """Run func(*args) in a daemon thread"""
+    def target():
+        try:
+            func(*args)
+        except Exception:
+            logger.exception('Background call to {0} failed'.format(func.__name__))
+        finally:
+            close_old_connections()
+    t = threading.Thread(target=target, name=func.__name__)
+    t.daemon = True
+    t.start()
+    return t
+
+def fetch_payment_methods(customerId):
+    """Fetch the masked payment methods of the Braintree Customer from the gateway"""
+    btree_customer = braintree.Customer.find(str(customerId))
+    return [{ "token": m.token, "number": m.masked_number, "type": m.card_type, "expiry": m.expiration_date } for m in btree_customer.payment_methods]
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+def refresh_payment_methods(user_id, customerId=None):
+    """Fetch the payment methods from the gateway and store them in the cache.
+    Returns the list of payment methods.
+    """
+    if customerId is None:
+        customerId = Customer.objects.values_list('customerId', flat=True).get(user_id=user_id)
+    results = fetch_payment_methods(customerId)
+    value = {
+        'customerId': customerId,
+        'results': results,
+        'fetched': time.time()
+    }
+    cache.set(PAYMENT_METHODS_KEY.format(user_id), value, _setting('BRAINTREE_PAYMENT_METHODS_MAX_AGE', 3600))
+    return results
+
+def _refresh_payment_methods_once(user_id, customerId=None):
+    """Refresh in the background unless a refresh for this user is already running"""
+    with _refreshing_lock:
+        if user_id in _refreshing:
+            return
+        _refreshing.add(user_id)
+    def refresh():
+        try:
+            refresh_payment_methods(user_id, customerId)
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(user_id)
+    _run_in_background(refresh)
+
+def get_payment_methods(user):
+    """
+    Returns the masked payment methods of the user's Braintree Customer.
+    A cached list is returned if one exists. Once the cached list is older
+    than BRAINTREE_PAYMENT_METHODS_TTL seconds it is still returned, but a
+    background refresh from the gateway is started.
+    """
+    value = cache.get(PAYMENT_METHODS_KEY.format(user.pk))
+    if value is None:
+        return refresh_payment_methods(user.pk)
+    if time.time() - value['fetched'] > _setting('BRAINTREE_PAYMENT_METHODS_TTL', 60):
+        _refresh_payment_methods_once(user.pk, value['customerId'])
+    return value['results']
+
+def invalidate_payment_methods(user_id, customerId=None):
+    """Drop the cached payment methods for the user (e.g. after a new
+    payment method was stored in the vault), and refetch them in the
+    background so that the next checkout does not wait on the gateway.
+    """
+    cache.delete(PAYMENT_METHODS_KEY.format(user_id))
+    _refresh_payment_methods_once(user_id, customerId)
+
+
+class VaultProvisionError(Exception):
+    pass
+
+def vault_customer_exists(customerId):
+    try:
+        braintree.Customer.find(str(customerId))
+    except braintree.exceptions.not_found_error.NotFoundError:
+        return False
+    return True
+
+def provision_vault_customer(user_id, check_exists=True):
+    """Create the Braintree Customer for the local Customer (pk=user_id)
+    unless it already exists in the vault, then set Customer.vaultCreated.
+    Set check_exists=False for a newly created local Customer to skip the
+    Customer.find call. If the create request is rejected, the vault is
+    checked anyway: a retry of a create that timed out but succeeded is
+    rejected because the id is taken.
+    Raises VaultProvisionError if the gateway rejects the create request.
+    """
+    customer = Customer.objects.select_related('user').get(pk=user_id)
+    if customer.vaultCreated:
+        return
+    user = customer.user
+    if not (check_exists and vault_customer_exists(customer.customerId)):
+        result = braintree.Customer.create({
+            "id": str(customer.customerId),
+            "first_name": user.first_name,
+            "last_name": user.last_name,
+            "email": user.email
+        })
+        if not result.is_success and not vault_customer_exists(customer.customerId):
+            raise VaultProvisionError('Create braintree Customer {0} failed: {1}'.format(customer.customerId, result.message))
+    Customer.objects.filter(pk=user_id).update(vaultCreated=True)
@@ -15,6 +15,8 @@ from common.viewutils import newUuid
 from .models import *
 from .permissions import *
 from .serializers import *
+from .identity import get_identity
+from .outbox import emit, TOPIC_BALANCE_CHANGED
 
 class MakeBrowserCmeOffer(APIView):
     """
@@ -25,14 +27,12 @@ class MakeBrowserCmeOffer(APIView):
         now = timezone.now()
         activityDate = now - timedelta(days=1)
         expireDate = now + timedelta(days=1)
-        url = 'https://radiopaedia.org/'
-        pageTitle = 'Sample page title'
+        page = Page.objects.get_for_url('https://radiopaedia.org/', 'Sample page title')
         offer = BrowserCmeOffer.objects.create(
             user=request.user,
             activityDate=activityDate,
             expireDate=expireDate,
-            url=url,
-            pageTitle=pageTitle,
+            page=page,
             points=Decimal('10.0'),
             credits=Decimal('0.5')
         )
@@ -47,9 +47,8 @@ class MakeRewardEntry(APIView):
     permission_classes = [permissions.IsAuthenticated, TokenHasReadWriteScope]
     def post(self, request, format=None):
         # get local customer instance for request.user
-        try:
-            customer = Customer.objects.get(user=request.user)
-        except ObjectDoesNotExist:
+        customer = get_identity(request).customer
+        if customer is None:
             context = {
                 'success': False,
                 'error': 'Local customer object not found for user'
@@ -72,7 +71,7 @@ class MakeRewardEntry(APIView):
                 rewardType='TEST-REWARD',
                 points=pointsEarned
             )
-            PointTransaction.objects.create(
+            pt = PointTransaction.objects.create(
                 customer=customer,
                 points=pointsEarned,
                 pricePaid=Decimal('0'),
@@ -80,6 +79,12 @@ class MakeRewardEntry(APIView):
             )
             customer.balance += pointsEarned
             customer.save()
+            emit(TOPIC_BALANCE_CHANGED,
+                userId=customer.pk,
+                points=pointsEarned,
+                balance=customer.balance,
+                transactionId=pt.transactionId,
+                reason='reward')
         context = {
             'success': True,
             'id': entry.pk,
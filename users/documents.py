@@ -0,0 +1,78 @@
+"""Deferred deletion of uploaded documents.
+
+A view that drops the reference to a document calls tombstone_document()
+inside its transaction instead of deleting the file. So the file is only
+deleted if the change is committed, and a crash cannot leave an orphan
+without a tombstone. Tombstones are purged in batches by a background job
+(or by the purge_documents command). Files that were orphaned in other
+ways are removed by the gc_documents command.
+"""
+import logging
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from .jobs import enqueue, task_path
+from .models import ArchivedRecord, DocumentTombstone, Entry, Job
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 10
+
+def tombstone_document(name):
+    """Record that the document with the given storage name must be deleted.
+    Call inside the transaction of the change. A purge job is queued on
+    commit unless one is already waiting.
+    """
+    if not name:
+        return
+    DocumentTombstone.objects.create(name=name)
+    transaction.on_commit(schedule_purge)
+
+def schedule_purge():
+    path = task_path(purge_documents)
+    if Job.objects.filter(task=path, state=Job.STATE_QUEUED).exists():
+        return
+    enqueue(path, delay=getattr(settings, 'ORBIT_DOCUMENT_PURGE_DELAY', 60))
+
+def referenced_names(names):
+    """Returns the subset of names that are still referenced by an Entry or an archived Entry"""
+    return set(Entry.objects.filter(document__in=names).values_list('document', flat=True)) \
+        | set(ArchivedRecord.objects.filter(document__in=names).values_list('document', flat=True))
+
+def purge_batch(batch_size=100):
+    """
+    Delete the files of up to batch_size tombstones. A file that is
+    referenced by an Entry again (e.g. re-uploaded under the same name) is
+    kept. Tombstones whose delete fails are retried on a later batch until
+    MAX_ATTEMPTS is reached.
+    Returns (num_purged, num_failed).
+    """
+    tombstones = list(DocumentTombstone.objects
+        .filter(attempts__lt=MAX_ATTEMPTS)
+        .order_by('id')[:batch_size])
+    if not tombstones:
+        return (0, 0)
+    keep = referenced_names([t.name for t in tombstones])
+    done = []
+    num_failed = 0
+    for t in tombstones:
+        try:
+            if t.name not in keep:
+                default_storage.delete(t.name) # no error if the file does not exist
+        except Exception as e:
+            logger.warning('Delete document {0} failed: {1}'.format(t.name, e))
+            DocumentTombstone.objects.filter(pk=t.pk).update(attempts=F('attempts')+1, lastError=str(e))
+            num_failed += 1
+        else:
+            done.append(t.pk)
+    if done:
+        DocumentTombstone.objects.filter(pk__in=done).delete()
+    return (len(done), num_failed)
+
+def purge_documents(batch_size=100):
+    """Job task: purge tombstones in batches until none are left"""
+    while True:
+        num_done, num_failed = purge_batch(batch_size)
+        if num_done + num_failed < batch_size:
+            break
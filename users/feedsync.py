@@ -0,0 +1,97 @@
+"""Delta sync of the feed.
+
+A sync token is a high-water mark (modified, id) over the entries of the
+user. get_changes returns the entries created or changed after the mark,
+and the ids of entries that were deleted (EntryTombstone) or invalidated
+since then, in (modified, id) order.
+
+A transaction may commit after a later transaction with a later modified
+timestamp, so the mark never advances past now - ORBIT_SYNC_SETTLE_SECONDS.
+Changes newer than that are returned again by the next sync. Clients must
+apply changes as upserts.
+"""
+import base64
+import calendar
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .models import Entry, EntryTombstone
+
+class InvalidSyncToken(Exception):
+    pass
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+def encode_token(modified, pk):
+    micros = calendar.timegm(modified.utctimetuple())*1000000 + modified.microsecond
+    return base64.urlsafe_b64encode('{0}.{1}'.format(micros, pk).encode('ascii')).decode('ascii')
+
+def decode_token(token):
+    """Returns (modified, id). Raises InvalidSyncToken"""
+    try:
+        micros, pk = base64.urlsafe_b64decode(token.encode('ascii')).decode('ascii').split('.')
+        modified = datetime.utcfromtimestamp(int(micros)//1000000).replace(microsecond=int(micros) % 1000000)
+        return (timezone.make_aware(modified, timezone.utc), int(pk))
+    except (TypeError, ValueError, UnicodeError):
+        raise InvalidSyncToken('Invalid sync token')
+
+def get_changes(user, token=None, limit=100):
+    """
+    Returns dict:
+        entries: list of changed valid Entry instances
+        deleted: list of ids of deleted or invalid entries
+        syncToken: token for the next sync
+        more: True if more changes are pending (sync again right away)
+        reset: True if the token is too old. The client must drop its
+            copy of the feed and sync again without a token.
+    Without a token, all valid entries are returned (in pages of limit).
+    """
+    now = timezone.now()
+    settled = (now - timedelta(seconds=_setting('ORBIT_SYNC_SETTLE_SECONDS', 10)), 0)
+    since = decode_token(token) if token else None
+    if since and since[0] < now - timedelta(seconds=_setting('ORBIT_SYNC_TOMBSTONE_TTL', 90*86400)):
+        # tombstones since then may have been purged
+        return {'entries': [], 'deleted': [], 'syncToken': None, 'more': False, 'reset': True}
+    qset = Entry.objects.filter(user=user)
+    if since:
+        qset = qset.filter(Q(modified__gt=since[0]) | Q(modified=since[0], id__gt=since[1]))
+    else:
+        qset = qset.filter(valid=True)
+    qset = qset \
+        .select_related('entryType', 'reward', 'srcme', 'brcme__page', 'exbrcme__page') \
+        .prefetch_related('tags') \
+        .order_by('modified', 'id')
+    changes = [(e.modified, e.pk, e) for e in qset[:limit+1]]
+    if since:
+        tombstones = EntryTombstone.objects \
+            .filter(user=user) \
+            .filter(Q(modified__gt=since[0]) | Q(modified=since[0], entryId__gt=since[1])) \
+            .order_by('modified', 'entryId') \
+            .values_list('modified', 'entryId')[:limit+1]
+        changes.extend((modified, entryId, None) for modified, entryId in tombstones)
+        changes.sort(key=lambda c: (c[0], c[1]))
+    more = len(changes) > limit
+    changes = changes[:limit]
+    if changes:
+        mark = min((changes[-1][0], changes[-1][1]), settled)
+        if mark == settled:
+            # the rest is returned by the next sync anyway
+            more = False
+    else:
+        # advance the mark of an unchanged feed, or its token would expire
+        mark = max(since, settled) if since else settled
+    return {
+        'entries': [e for modified, pk, e in changes if e is not None and e.valid],
+        'deleted': [pk for modified, pk, e in changes if e is None or not e.valid],
+        'syncToken': encode_token(*mark),
+        'more': more,
+        'reset': False
+    }
+
+def purge_tombstones():
+    """Delete tombstones older than ORBIT_SYNC_TOMBSTONE_TTL. Returns number deleted"""
+    cutoff = timezone.now() - timedelta(seconds=_setting('ORBIT_SYNC_TOMBSTONE_TTL', 90*86400))
+    num_deleted, details = EntryTombstone.objects.filter(modified__lt=cutoff).delete()
+    return num_deleted
@@ -0,0 +1,162 @@
+"""Idempotency-Key support for API views with side effects.
+
+A client may send an Idempotency-Key header (max 64 chars) with a request.
+The first request with a given key is executed and its response is stored.
+A repeat of that request by the same user returns the stored response
+without executing the view again. A duplicate that arrives while the
+first request is still in flight waits for it to finish.
+
+Once the view has started, the key stays taken even if the view fails: an
+exception or a 5xx response is stored as the response of the key, because
+the view may have done part of its work (e.g. charged a card) before it
+failed. The client must check the outcome before it retries with a new key.
+"""
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from common.viewutils import render_to_json_response
+from .models import IdempotencyKey
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 64
+POLL_INTERVAL = 0.1 # seconds
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+def request_hash(request):
+    """Hash of method, path and data of a DRF request"""
+    data = request.data
+    if hasattr(data, 'lists'):
+        # QueryDict (form data): uploaded files are represented by name and size
+        data = sorted((k, [(v.name, v.size) if hasattr(v, 'size') else v for v in vals])
+            for k, vals in data.lists())
+    payload = json.dumps([request.method, request.path, data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def claim(user, key, req_hash):
+    """
+    Returns (record, claimed). claimed is True if this request inserted the
+    record and must execute the view. Expired records, and in-flight
+    records older than ORBIT_IDEMPOTENCY_INFLIGHT_TIMEOUT (e.g. from a
+    process that crashed) are replaced.
+    """
+    ttl = _setting('ORBIT_IDEMPOTENCY_TTL', 86400)
+    inflight_timeout = _setting('ORBIT_IDEMPOTENCY_INFLIGHT_TIMEOUT', 300)
+    while True:
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=user,
+                    key=key,
+                    requestHash=req_hash,
+                    expireDate=now + timedelta(seconds=ttl)
+                )
+            return record, True
+        except IntegrityError:
+            pass
+        record = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if record is None:
+            continue # deleted in the meantime
+        stale = record.expireDate <= now or (record.statusCode is None and
+            record.created <= now - timedelta(seconds=inflight_timeout))
+        if stale:
+            IdempotencyKey.objects.filter(pk=record.pk, modified=record.modified).delete()
+            continue
+        return record, False
+
+def wait_for_response(record):
+    """Wait until the in-flight request of record has finished.
+    Returns the finished record, or None if the record was deleted in the
+    meantime (expired), or the unfinished record on timeout.
+    """
+    deadline = time.time() + _setting('ORBIT_IDEMPOTENCY_WAIT', 10)
+    while record.statusCode is None and time.time() < deadline:
+        time.sleep(POLL_INTERVAL)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+        if record is None:
+            return None
+    return record
+
+def replay(record):
+    response = HttpResponse(record.response, status=record.statusCode, content_type='application/json')
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+def store(record, response):
+    """Save the response on the record"""
+    if isinstance(response, Response):
+        body = JSONRenderer().render(response.data)
+    else:
+        body = response.content
+    record.statusCode = response.status_code
+    record.response = body.decode('utf-8')
+    record.save(update_fields=('statusCode', 'response', 'modified'))
+
+def store_failure(record):
+    """Save a 500 response on the record of a request whose view raised an
+    exception. The view may have been partly executed.
+    """
+    context = {
+        'success': False,
+        'error': 'The request failed and may have been partly executed. '
+            'Check its outcome before you retry it with a new Idempotency-Key'
+    }
+    store(record, render_to_json_response(context, status_code=500))
+
+def idempotent(handler):
+    """
+    Decorator for the post/create method of an APIView that makes it honor
+    the Idempotency-Key header. 5xx responses are stored like any other
+    response, and an exception is stored as a 500 response, so a retry with
+    the same key never executes the view a second time.
+    """
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(HEADER)
+        if not key:
+            return handler(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            context = {
+                'success': False,
+                'error': 'Idempotency-Key must be at most {0} characters'.format(MAX_KEY_LENGTH)
+            }
+            return render_to_json_response(context, status_code=400)
+        req_hash = request_hash(request)
+        while True:
+            record, claimed = claim(request.user, key, req_hash)
+            if claimed:
+                break
+            if record.requestHash != req_hash:
+                context = {
+                    'success': False,
+                    'error': 'Idempotency-Key was already used for a different request'
+                }
+                return render_to_json_response(context, status_code=422)
+            record = wait_for_response(record)
+            if record is None:
+                continue # expired in the meantime: try to execute it here
+            if record.statusCode is None:
+                context = {
+                    'success': False,
+                    'error': 'A request with this Idempotency-Key is still in progress'
+                }
+                return render_to_json_response(context, status_code=409)
+            return replay(record)
+        try:
+            response = handler(self, request, *args, **kwargs)
+        except Exception:
+            store_failure(record)
+            raise
+        store(record, response)
+        return response
+    return wrapper
@@ -0,0 +1,56 @@
+"""Request-scoped identity context"""
+from django.contrib.auth.models import User
+from .models import Customer, Profile
+
+class IdentityContext(object):
+    """
+    Holds the authenticated user with its Customer and Profile.
+    Customer and Profile are loaded together in one joined query, at most
+    once per request, the first time either of them is accessed.
+    """
+    def __init__(self, user):
+        self.user = user
+        self._loaded = False
+        self._customer = None
+        self._profile = None
+
+    def _load(self):
+        if self._loaded:
+            return
+        row = User.objects.select_related('customer', 'profile').get(pk=self.user.pk)
+        try:
+            self._customer = row.customer
+        except Customer.DoesNotExist:
+            pass
+        try:
+            self._profile = row.profile
+        except Profile.DoesNotExist:
+            pass
+        self._loaded = True
+
+    @property
+    def customer(self):
+        """Customer instance of the user or None"""
+        self._load()
+        return self._customer
+
+    @property
+    def profile(self):
+        """Profile instance of the user or None"""
+        self._load()
+        return self._profile
+
+
+def get_identity(request):
+    """
+    Returns the IdentityContext of the request's user. The context is
+    cached on the underlying HttpRequest, so the DRF Request and the Django
+    request share it.
+    """
+    http_request = getattr(request, '_request', request)
+    user = request.user
+    identity = getattr(http_request, '_identity', None)
+    if identity is None or identity.user.pk != user.pk:
+        identity = IdentityContext(user)
+        http_request._identity = identity
+    return identity
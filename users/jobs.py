@@ -0,0 +1,214 @@
+"""Lightweight background job queue stored in the project database.
+
+enqueue() stores a Job row for a task function. The runworker command
+claims due jobs and executes them in a thread pool. On PostgreSQL, jobs are
+claimed with SELECT ... FOR UPDATE SKIP LOCKED. Other backends use a
+conditional UPDATE per job, so that a job is claimed by at most one worker.
+While it runs jobs, a worker renews their lease (heartbeat) every
+ORBIT_JOB_LEASE/3 seconds. A running job whose lease has expired (e.g. the
+worker process died) is handled like a failed attempt. A failed job is
+retried with exponential backoff until maxAttempts is reached. The job is
+then marked failed, and a job.failed outbox event is emitted. Done and failed jobs are deleted by the purge_jobs command after
+ORBIT_JOB_RETENTION seconds.
+"""
+import json
+import logging
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import six, timezone
+from django.utils.module_loading import import_string
+from .models import Job
+from .outbox import emit, TOPIC_JOB_FAILED
+
+logger = logging.getLogger(__name__)
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+def task_path(func):
+    if isinstance(func, six.string_types):
+        return func
+    return '{0}.{1}'.format(func.__module__, func.__name__)
+
+def enqueue(func, args=(), kwargs=None, delay=0, max_attempts=None, key=''):
+    """
+    Store a job that calls func(*args, **kwargs) in a worker. func is a
+    module-level function or its dotted path. args and kwargs must be JSON
+    serializable. To enqueue only if the current transaction commits, use:
+        transaction.on_commit(lambda: enqueue(...))
+    If key is given and a queued or running job has the same key, no job is
+    stored and that job is returned. This is not atomic: two concurrent
+    calls may both store a job, so the task must tolerate a duplicate.
+    """
+    if key:
+        pending = Job.objects.filter(key=key, state__in=(Job.STATE_QUEUED, Job.STATE_RUNNING)).first()
+        if pending is not None:
+            return pending
+    if max_attempts is None:
+        max_attempts = _setting('ORBIT_JOB_MAX_ATTEMPTS', 5)
+    return Job.objects.create(
+        task=task_path(func),
+        payload=json.dumps({'args': list(args), 'kwargs': kwargs or {}}, cls=DjangoJSONEncoder),
+        key=key,
+        maxAttempts=max_attempts,
+        runAt=timezone.now() + timedelta(seconds=delay)
+    )
+
+def heartbeat(worker_id):
+    """Renew the lease of the running jobs of worker_id. Returns number renewed"""
+    return Job.objects.filter(state=Job.STATE_RUNNING, lockedBy=worker_id) \
+        .update(heartbeat=timezone.now())
+
+def _retry_delay(job):
+    return _setting('ORBIT_JOB_RETRY_BACKOFF', 2) * 2**(job.attempts-1)
+
+def _emit_failed(job, error):
+    emit(TOPIC_JOB_FAILED,
+        jobId=job.pk,
+        task=job.task,
+        payload=job.payload,
+        error=error)
+
+def requeue_stale():
+    """
+    Handle the running jobs whose lease expired ORBIT_JOB_LEASE seconds ago
+    (their worker died or lost its database connection) as failed attempts:
+    the attempt was counted when the job was claimed, so the job is requeued
+    with backoff if it has attempts left, and marked failed otherwise.
+    Returns number requeued.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=_setting('ORBIT_JOB_LEASE', 60))
+    stale = Job.objects.filter(
+        Q(heartbeat__lt=cutoff) | Q(heartbeat__isnull=True, startedAt__lt=cutoff),
+        state=Job.STATE_RUNNING)
+    num_requeued = 0
+    for job in stale:
+        error = 'Lease of worker {0} expired (last heartbeat {1})'.format(job.lockedBy, job.heartbeat)
+        logger.warning('Job {0} {1} attempt {2}: {3}'.format(job.pk, job.task, job.attempts, error))
+        # skip the job if its worker renewed the lease or finished it meanwhile
+        current = Job.objects.filter(pk=job.pk, state=Job.STATE_RUNNING, lockedBy=job.lockedBy, heartbeat=job.heartbeat)
+        if job.attempts < job.maxAttempts:
+            num_requeued += current.update(state=Job.STATE_QUEUED, lockedBy='', lastError=error,
+                runAt=now + timedelta(seconds=_retry_delay(job)), modified=now)
+        else:
+            with transaction.atomic():
+                if current.update(state=Job.STATE_FAILED, lockedBy='', lastError=error, finishedAt=now, modified=now):
+                    _emit_failed(job, error)
+    return num_requeued
+
+def _claim_skip_locked(worker_id, limit, now):
+    table = connection.ops.quote_name(Job._meta.db_table)
+    qn = connection.ops.quote_name
+    sql = (
+        'UPDATE {table} SET {state} = %s, {lockedBy} = %s, {startedAt} = %s, {heartbeat} = %s, {attempts} = {attempts} + 1 '
+        'WHERE {id} IN ('
+        'SELECT {id} FROM {table} WHERE {state} = %s AND {runAt} <= %s '
+        'ORDER BY {runAt} LIMIT %s FOR UPDATE SKIP LOCKED'
+        ') RETURNING {id}'
+    ).format(table=table, id=qn('id'), state=qn('state'), lockedBy=qn('lockedBy'),
+        startedAt=qn('startedAt'), heartbeat=qn('heartbeat'), attempts=qn('attempts'), runAt=qn('runAt'))
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [Job.STATE_RUNNING, worker_id, now, now, Job.STATE_QUEUED, now, limit])
+            ids = [row[0] for row in cursor.fetchall()]
+    return ids
+
+def _claim_conditional_update(worker_id, limit, now):
+    candidates = Job.objects.filter(state=Job.STATE_QUEUED, runAt__lte=now) \
+        .order_by('runAt').values_list('pk', 'attempts')[:limit]
+    ids = []
+    for pk, attempts in candidates:
+        # only one worker can move the job out of the queued state
+        claimed = Job.objects.filter(pk=pk, state=Job.STATE_QUEUED).update(
+            state=Job.STATE_RUNNING, lockedBy=worker_id, startedAt=now, heartbeat=now, attempts=attempts+1)
+        if claimed:
+            ids.append(pk)
+    return ids
+
+def claim(worker_id, limit):
+    """Mark up to limit due jobs as running by worker_id and return them"""
+    now = timezone.now()
+    if connection.vendor == 'postgresql':
+        ids = _claim_skip_locked(worker_id, limit, now)
+    else:
+        ids = _claim_conditional_update(worker_id, limit, now)
+    if not ids:
+        return []
+    return list(Job.objects.filter(pk__in=ids).order_by('runAt'))
+
+def run(job):
+    """Execute a claimed job and record the outcome"""
+    now = timezone.now
+    try:
+        payload = json.loads(job.payload)
+        func = import_string(job.task)
+        func(*payload['args'], **payload['kwargs'])
+    except Exception as e:
+        logger.warning('Job {0} {1} attempt {2} failed: {3}'.format(job.pk, job.task, job.attempts, e))
+        job.lastError = traceback.format_exc()
+        job.lockedBy = ''
+        if job.attempts < job.maxAttempts:
+            job.state = Job.STATE_QUEUED
+            job.runAt = now() + timedelta(seconds=_retry_delay(job))
+            job.save(update_fields=('state', 'runAt', 'lockedBy', 'lastError', 'modified'))
+        else:
+            job.state = Job.STATE_FAILED
+            job.finishedAt = now()
+            with transaction.atomic():
+                job.save(update_fields=('state', 'finishedAt', 'lockedBy', 'lastError', 'modified'))
+                _emit_failed(job, str(e))
+        return False
+    job.state = Job.STATE_DONE
+    job.finishedAt = now()
+    job.save(update_fields=('state', 'finishedAt', 'modified'))
+    return True
+
+def purge_finished():
+    """Delete done and failed jobs that finished more than ORBIT_JOB_RETENTION
+    seconds ago. Returns number deleted"""
+    cutoff = timezone.now() - timedelta(seconds=_setting('ORBIT_JOB_RETENTION', 7*86400))
+    num_deleted, details = Job.objects.filter(
+        state__in=(Job.STATE_DONE, Job.STATE_FAILED),
+        finishedAt__lt=cutoff).delete()
+    return num_deleted
+
+def queue_stats(window=3600):
+    """
+    Returns queue metrics:
+        depth: number of jobs per state
+        ready: queued jobs that are due now
+        oldestReadyAge: seconds the oldest due job has been waiting
+        latency: mean and max seconds from runAt to startedAt, and mean
+            run time, of the jobs finished in the last `window` seconds
+    """
+    now = timezone.now()
+    depth = dict((state, 0) for state, label in Job.STATE_CHOICES)
+    for row in Job.objects.values('state').annotate(num=Count('id')).order_by():
+        depth[row['state']] = row['num']
+    ready = Job.objects.filter(state=Job.STATE_QUEUED, runAt__lte=now)
+    oldest = ready.order_by('runAt').values_list('runAt', flat=True).first()
+    finished = Job.objects.filter(
+        state=Job.STATE_DONE,
+        finishedAt__gte=now - timedelta(seconds=window)
+    ).order_by('-finishedAt').values_list('runAt', 'startedAt', 'finishedAt')[:1000]
+    waits = []
+    runs = []
+    for runAt, startedAt, finishedAt in finished:
+        waits.append((startedAt - runAt).total_seconds())
+        runs.append((finishedAt - startedAt).total_seconds())
+    return {
+        'depth': depth,
+        'ready': ready.count(),
+        'oldestReadyAge': (now - oldest).total_seconds() if oldest else 0,
+        'latency': {
+            'samples': len(waits),
+            'meanWait': sum(waits)/len(waits) if waits else 0,
+            'maxWait': max(waits) if waits else 0,
+            'meanRun': sum(runs)/len(runs) if runs else 0
+        }
+    }
@@ -0,0 +1,71 @@
+import logging
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import ProtectedError
+from django.utils import timezone
+from users.archive import (
+    archive_entries, archive_offers, default_cutoffs, entry_candidates, offer_candidates)
+
+logger = logging.getLogger('users.management')
+
+# consecutive chunks that may fail before the command gives up
+MAX_FAILED_CHUNKS = 3
+
+class Command(BaseCommand):
+    help = 'Move old invalid entries and expired offers to ArchivedRecord in chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entry-days', type=int, default=None,
+            help='Archive invalid entries last modified this many days ago (default ORBIT_ARCHIVE_ENTRY_DAYS)')
+        parser.add_argument('--offer-days', type=int, default=None,
+            help='Archive unredeemed offers that expired this many days ago (default ORBIT_ARCHIVE_OFFER_DAYS)')
+        parser.add_argument('--chunk-size', type=int, default=500,
+            help='Rows archived per transaction')
+        parser.add_argument('--max-rate', type=float, default=1000.0,
+            help='Max rows archived per second (0 = unlimited)')
+        parser.add_argument('--dry-run', action='store_true',
+            help='Report the number of rows to archive without archiving them')
+
+    def handle(self, *args, **options):
+        entry_cutoff, offer_cutoff = default_cutoffs()
+        now = timezone.now()
+        if options['entry_days'] is not None:
+            entry_cutoff = now - timedelta(days=options['entry_days'])
+        if options['offer_days'] is not None:
+            offer_cutoff = now - timedelta(days=options['offer_days'])
+        if options['dry_run']:
+            self.stdout.write('Entries: {0}. Offers: {1}'.format(
+                entry_candidates(entry_cutoff).count(),
+                offer_candidates(offer_cutoff).count()))
+            return
+        # entries first: archiving an ExBrowserCme/BrowserCme entry frees its offer
+        num_entries = self.run(archive_entries, entry_cutoff, options['chunk_size'], options['max_rate'])
+        num_offers = self.run(archive_offers, offer_cutoff, options['chunk_size'], options['max_rate'])
+        self.stdout.write('Archived entries: {0}. Archived offers: {1}'.format(num_entries, num_offers))
+
+    def run(self, archive_chunk, cutoff, chunk_size, max_rate):
+        """Call archive_chunk until no candidates are left. Returns number archived"""
+        started = time.time()
+        total = 0
+        failed = 0
+        while True:
+            try:
+                num_candidates, num = archive_chunk(cutoff, chunk_size)
+            except ProtectedError as e:
+                # a row got referenced meanwhile. The chunk was rolled back,
+                # and the row is no longer a candidate on the next try.
+                failed += 1
+                logger.warning('Archive chunk rolled back: {0}'.format(e.args[0]))
+                if failed >= MAX_FAILED_CHUNKS:
+                    raise CommandError('{0} consecutive chunks failed'.format(failed))
+                continue
+            failed = 0
+            total += num
+            if num_candidates < chunk_size:
+                return total
+            if max_rate:
+                # sleep until the archived count is within the rate limit
+                ahead = total / max_rate - (time.time() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
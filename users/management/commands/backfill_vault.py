@@ -0,0 +1,48 @@
+import logging
+from multiprocessing.pool import ThreadPool
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from users.models import Customer
+from users.braintree_tools import provision_vault_customer
+
+logger = logging.getLogger('users.management')
+
+def provision(user_id):
+    """Returns (user_id, error message or None)"""
+    try:
+        provision_vault_customer(user_id)
+    except Exception as e:
+        return (user_id, str(e))
+    finally:
+        close_old_connections()
+    return (user_id, None)
+
+class Command(BaseCommand):
+    help = 'Create the Braintree Customer for each local Customer that is not known to exist in the vault.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8,
+            help='Number of threads making gateway calls')
+        parser.add_argument('--limit', type=int, default=0,
+            help='Max number of customers to process (0 = all)')
+
+    def handle(self, *args, **options):
+        qset = Customer.objects.filter(vaultCreated=False).order_by('pk').values_list('pk', flat=True)
+        if options['limit']:
+            qset = qset[:options['limit']]
+        user_ids = list(qset)
+        self.stdout.write('Customers to provision: {0}'.format(len(user_ids)))
+        num_ok = 0
+        num_failed = 0
+        pool = ThreadPool(options['workers'])
+        try:
+            for user_id, error in pool.imap_unordered(provision, user_ids):
+                if error:
+                    num_failed += 1
+                    logger.error('Provision customer {0} failed: {1}'.format(user_id, error))
+                else:
+                    num_ok += 1
+        finally:
+            pool.close()
+            pool.join()
+        self.stdout.write('Provisioned: {0}. Failed: {1}'.format(num_ok, num_failed))
@@ -0,0 +1,107 @@
+import timeit
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from oauth2_provider.models import Application
+from users import oauth_tools
+from users.models import Customer, Entry, EntryType, Profile, SRCme, ENTRYTYPE_SRCME
+
+
+class Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Run a benchmark scenario and report queries and timing. Changes made by the scenario are rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=self.scenarios())
+        parser.add_argument('-n', '--number', type=int, default=100,
+            help='Number of iterations to time')
+
+    @classmethod
+    def scenarios(cls):
+        return sorted(name[6:].replace('_', '-') for name in dir(cls) if name.startswith('bench_'))
+
+    def handle(self, *args, **options):
+        self.number = options['number']
+        method = getattr(self, 'bench_' + options['scenario'].replace('-', '_'))
+        try:
+            with transaction.atomic():
+                method()
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def report(self, label, func, conn=None):
+        """Print queries per call (on conn, default connection if None)
+        and mean time per call for func"""
+        func() # warm up
+        with CaptureQueriesContext(conn or connection) as ctx:
+            func()
+        # count now: requests made by func reset the query log
+        num_queries = len(ctx.captured_queries)
+        elapsed = timeit.timeit(func, number=self.number)
+        self.stdout.write('{0:<40} {1:>4} queries {2:>9.3f} ms/call'.format(
+            label, num_queries, 1000*elapsed/self.number))
+
+    def get_user(self):
+        user = User.objects.create(username='benchmark-user')
+        if not Application.objects.filter(name=oauth_tools.APP_NAME).exists():
+            Application.objects.create(
+                name=oauth_tools.APP_NAME,
+                user=user,
+                client_type=Application.CLIENT_CONFIDENTIAL,
+                authorization_grant_type=Application.GRANT_PASSWORD)
+        return user
+
+    def bench_tokens(self):
+        """Token issued on login (rotate) and on Swagger render (reuse)"""
+        user = self.get_user()
+        self.report('new_access_token (rotate)', lambda: oauth_tools.new_access_token(user))
+        self.report('new_access_token (reuse)', lambda: oauth_tools.new_access_token(user, reuse=True))
+        self.report('get_access_token', lambda: oauth_tools.get_access_token(user))
+
+    def bench_connections(self):
+        """Connection setup per request (CONN_MAX_AGE=0) vs a persistent connection"""
+        # separate connection to the default database, outside the rollback transaction
+        default = connections['default']
+        conn = default.__class__(dict(default.settings_dict), alias='benchmark')
+        def query():
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+        def connect_query_close():
+            query()
+            conn.close()
+        self.stdout.write('Database: {0} {1}'.format(connection.vendor, connection.settings_dict['HOST'] or connection.settings_dict['NAME']))
+        try:
+            self.report('connect + query + close', connect_query_close, conn)
+            self.report('query on persistent connection', query, conn)
+        finally:
+            conn.close()
+
+    def bench_conditional_get(self):
+        """Polling client: full GET vs revalidation with If-None-Match"""
+        user = self.get_user()
+        etype = EntryType.objects.create(name=ENTRYTYPE_SRCME)
+        for i in range(10):
+            entry = Entry.objects.create(user=user, entryType=etype, activityDate=timezone.now(), description='Entry {0}'.format(i))
+            SRCme.objects.create(entry=entry, credits=1)
+        profile = Profile.objects.create(user=user, firstName='Bench', lastName='Mark')
+        customer = Customer.objects.create(user=user)
+        token = oauth_tools.new_access_token(user)['access_token']
+        client = Client(HTTP_HOST='localhost', HTTP_AUTHORIZATION='Bearer ' + token)
+        for label, path in (
+                ('feed', '/api/v1/feed/'),
+                ('profile', '/api/v1/profiles/{0}/'.format(profile.pk)),
+                ('account', '/api/v1/accounts/{0}/'.format(customer.pk))):
+            response = client.get(path)
+            etag = response['ETag']
+            revalidated = client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.report('{0} GET'.format(label), lambda: client.get(path))
+            self.report('{0} GET If-None-Match'.format(label), lambda: client.get(path, HTTP_IF_NONE_MATCH=etag))
+            self.stdout.write('{0:<40} {1} bytes -> {2} bytes (status {3})'.format(
+                label, len(response.content), len(revalidated.content), revalidated.status_code))
@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand
+from users.outbox import dead_events, dispatch_batch, retry_dead
+
+class Command(BaseCommand):
+    help = 'Deliver pending outbox events to their consumers in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true',
+            help='Keep running, polling for new events (default: exit once drained)')
+        parser.add_argument('--interval', type=float, default=1.0,
+            help='Seconds to sleep when no events are pending (with --loop)')
+        parser.add_argument('--retry-dead', action='store_true',
+            help='First requeue the events that failed ORBIT_OUTBOX_MAX_ATTEMPTS times')
+
+    def handle(self, *args, **options):
+        if options['retry_dead']:
+            self.stdout.write('Requeued dead events: {0}'.format(retry_dead()))
+        else:
+            num_dead = dead_events().count()
+            if num_dead:
+                self.stderr.write('Dead events (not retried, see --retry-dead): {0}'.format(num_dead))
+        while True:
+            num_done, num_failed = dispatch_batch(options['batch_size'])
+            if num_done or num_failed:
+                self.stdout.write('Dispatched: {0}. Failed: {1}'.format(num_done, num_failed))
+            if num_done + num_failed < options['batch_size']:
+                # no more pending events
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,75 @@
+import os
+import time
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from users.documents import referenced_names
+from users.models import Entry
+
+class Command(BaseCommand):
+    help = 'Delete files under MEDIA_ROOT/entries that are not referenced by any Entry.document.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+            help='Number of files checked against the database per query')
+        parser.add_argument('--max-rate', type=float, default=200.0,
+            help='Max files examined per second (0 = unlimited)')
+        parser.add_argument('--min-age', type=int, default=86400,
+            help='Seconds since last modification before a file may be deleted. '
+                'Protects uploads whose Entry is not committed yet.')
+        parser.add_argument('--dry-run', action='store_true',
+            help='Report orphaned files without deleting them')
+
+    def iter_names(self, root, upload_to):
+        """Yield (storage name, mtime) of the files under root, one directory at a time"""
+        for dirpath, dirnames, filenames in os.walk(root):
+            rel_dir = os.path.relpath(dirpath, root)
+            for filename in filenames:
+                if rel_dir == os.curdir:
+                    name = '/'.join((upload_to, filename))
+                else:
+                    name = '/'.join([upload_to] + rel_dir.split(os.sep) + [filename])
+                try:
+                    mtime = os.path.getmtime(os.path.join(dirpath, filename))
+                except OSError:
+                    continue # deleted in the meantime
+                yield name, mtime
+
+    def handle(self, *args, **options):
+        upload_to = Entry._meta.get_field('document').upload_to
+        root = default_storage.path(upload_to)
+        chunk_size = options['chunk_size']
+        max_rate = options['max_rate']
+        cutoff = time.time() - options['min_age']
+        self.num_examined = 0
+        self.num_deleted = 0
+        self.started = time.time()
+        chunk = []
+        for name, mtime in self.iter_names(root, upload_to):
+            if mtime > cutoff:
+                continue
+            chunk.append(name)
+            if len(chunk) == chunk_size:
+                self.process(chunk, options['dry_run'], max_rate)
+                chunk = []
+        if chunk:
+            self.process(chunk, options['dry_run'], max_rate)
+        self.stdout.write('Examined: {0}. {1}: {2}'.format(
+            self.num_examined,
+            'Orphaned' if options['dry_run'] else 'Deleted',
+            self.num_deleted))
+
+    def process(self, names, dry_run, max_rate):
+        keep = referenced_names(names)
+        for name in names:
+            self.num_examined += 1
+            if name not in keep:
+                if dry_run:
+                    self.stdout.write(name)
+                else:
+                    default_storage.delete(name)
+                self.num_deleted += 1
+            if max_rate:
+                # sleep until the examined count is within the rate limit
+                ahead = self.num_examined / max_rate - (time.time() - self.started)
+                if ahead > 0:
+                    time.sleep(ahead)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from users.activity import process_activity
+
+class Command(BaseCommand):
+    help = 'Aggregate buffered plugin activity events and make the BrowserCME offers that are due.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+            help='Events per transaction (default ORBIT_ACTIVITY_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        num_events, num_offers = process_activity(options['batch_size'])
+        self.stdout.write('Processed {0} events, made {1} offers'.format(num_events, num_offers))
@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from users.documents import purge_batch
+
+class Command(BaseCommand):
+    help = 'Delete the files of document tombstones in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true',
+            help='Keep running, polling for new tombstones (default: exit once drained)')
+        parser.add_argument('--interval', type=float, default=10.0,
+            help='Seconds to sleep when no tombstones are pending (with --loop)')
+
+    def handle(self, *args, **options):
+        while True:
+            num_done, num_failed = purge_batch(options['batch_size'])
+            if num_done or num_failed:
+                self.stdout.write('Purged: {0}. Failed: {1}'.format(num_done, num_failed))
+            if num_done + num_failed < options['batch_size']:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
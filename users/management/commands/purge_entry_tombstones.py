@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from users.feedsync import purge_tombstones
+
+class Command(BaseCommand):
+    help = 'Delete entry tombstones older than ORBIT_SYNC_TOMBSTONE_TTL. Sync tokens older than that get a reset.'
+
+    def handle(self, *args, **options):
+        num_deleted = purge_tombstones()
+        self.stdout.write('Deleted {0} tombstones'.format(num_deleted))
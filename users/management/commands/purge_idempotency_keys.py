@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from users.models import IdempotencyKey
+
+class Command(BaseCommand):
+    help = 'Delete expired stored responses of Idempotency-Key requests.'
+
+    def handle(self, *args, **options):
+        num_deleted, details = IdempotencyKey.objects.filter(expireDate__lte=timezone.now()).delete()
+        self.stdout.write('Deleted {0} expired keys'.format(num_deleted))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from users.jobs import purge_finished
+
+class Command(BaseCommand):
+    help = 'Delete done and failed jobs that finished more than ORBIT_JOB_RETENTION seconds ago.'
+
+    def handle(self, *args, **options):
+        num_deleted = purge_finished()
+        self.stdout.write('Deleted {0} jobs'.format(num_deleted))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from users.outbox import purge_dispatched
+
+class Command(BaseCommand):
+    help = 'Delete outbox events dispatched more than ORBIT_OUTBOX_RETENTION seconds ago.'
+
+    def handle(self, *args, **options):
+        num_deleted = purge_dispatched()
+        self.stdout.write('Deleted {0} events'.format(num_deleted))
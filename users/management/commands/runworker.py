@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from multiprocessing import Process
+from multiprocessing.pool import ThreadPool
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from users import jobs
+
+logger = logging.getLogger('users.management')
+
+def run_job(job):
+    try:
+        return jobs.run(job)
+    finally:
+        close_old_connections()
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database job queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4,
+            help='Jobs executed concurrently per process')
+        parser.add_argument('--processes', type=int, default=1,
+            help='Number of worker processes')
+        parser.add_argument('--interval', type=float, default=1.0,
+            help='Seconds to sleep when no job is due')
+        parser.add_argument('--once', action='store_true',
+            help='Exit once no job is due')
+        parser.add_argument('--stats', action='store_true',
+            help='Print queue depth and job latency metrics and exit')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(jobs.queue_stats(), indent=2))
+            return
+        if options['processes'] <= 1:
+            self.work(options)
+            return
+        # child processes must not share the parent's database connection
+        connections.close_all()
+        procs = [Process(target=self.work, args=(options,)) for i in range(options['processes'])]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+
+    def work(self, options):
+        num_threads = options['threads']
+        worker_id = '{0}:{1}'.format(socket.gethostname(), os.getpid())
+        pool = ThreadPool(num_threads)
+        busy = [0]
+        lock = threading.Lock()
+        heartbeat_interval = getattr(settings, 'ORBIT_JOB_LEASE', 60) / 3.0
+        last_heartbeat = time.time()
+        def execute(job):
+            # the slot is freed even if recording the outcome fails (e.g. the
+            # database is down). The job is then requeued by requeue_stale.
+            try:
+                run_job(job)
+            except Exception:
+                logger.exception('Job {0} {1} could not be run'.format(job.pk, job.task))
+            finally:
+                with lock:
+                    busy[0] -= 1
+        logger.info('worker {0} started with {1} threads'.format(worker_id, num_threads))
+        try:
+            while True:
+                # renew the lease of the running jobs, so that requeue_stale
+                # in other workers leaves them alone
+                if time.time() - last_heartbeat >= heartbeat_interval:
+                    jobs.heartbeat(worker_id)
+                    last_heartbeat = time.time()
+                jobs.requeue_stale()
+                with lock:
+                    free = num_threads - busy[0]
+                claimed = jobs.claim(worker_id, free) if free > 0 else []
+                for job in claimed:
+                    with lock:
+                        busy[0] += 1
+                    pool.apply_async(execute, (job,))
+                if not claimed:
+                    with lock:
+                        idle = busy[0] == 0
+                    if options['once'] and idle:
+                        break
+                    time.sleep(options['interval'])
+        finally:
+            pool.close()
+            pool.join()
+            close_old_connections()
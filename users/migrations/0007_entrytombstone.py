@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-19 07:44
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('users', '0006_documenttombstone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntryTombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entryId', models.IntegerField()),
+                ('modified', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='entry',
+            index_together=set([('user', 'modified', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='entrytombstone',
+            index_together=set([('user', 'modified', 'entryId')]),
+        ),
+    ]
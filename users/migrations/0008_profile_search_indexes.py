@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-19 07:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# Case-insensitive prefix search (lastName__istartswith) compiles to
+# UPPER("lastName") LIKE 'X%' on PostgreSQL, which needs an expression index.
+PG_INDEX = 'users_profile_lastname_upper_like'
+
+def create_upper_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX {0} ON users_profile (UPPER("lastName") varchar_pattern_ops)'.format(PG_INDEX))
+
+def drop_upper_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS {0}'.format(PG_INDEX))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_entrytombstone'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='lastName',
+            field=models.CharField(db_index=True, max_length=30),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='npiNumber',
+            field=models.CharField(blank=True, db_index=True, max_length=20),
+        ),
+        migrations.RunPython(create_upper_index, drop_upper_index),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-19 08:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_profile_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Page',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=500)),
+                ('urlHash', models.CharField(help_text='sha256 hex digest of the normalized url', max_length=64, unique=True)),
+                ('title', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='browsercmeoffer',
+            name='page',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='users.Page'),
+        ),
+        migrations.AddField(
+            model_name='browsercme',
+            name='page',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='users.Page'),
+        ),
+        migrations.AddField(
+            model_name='exbrowsercme',
+            name='page',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='users.Page'),
+        ),
+    ]
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from django.db import migrations, transaction
+from common.urlnorm import url_hash
+
+# Rows are backfilled in chunks, one transaction per chunk, so that the
+# migration does not hold locks on the whole table and can be resumed.
+CHUNK_SIZE = 2000
+MODELS = ('BrowserCmeOffer', 'BrowserCme', 'ExBrowserCme')
+# entries keep their url and pageTitle where they differ from the page's
+SNAPSHOT_MODELS = ('BrowserCme', 'ExBrowserCme')
+
+def get_pages(Page, rows):
+    """Returns dict urlHash => (Page id, url, title) for the (pk, url, pageTitle)
+    rows, creating missing pages with the first url and title seen
+    """
+    titles = {}
+    urls = {}
+    for pk, url, title in rows:
+        h = url_hash(url)
+        urls.setdefault(h, url.strip())
+        if title:
+            titles.setdefault(h, title)
+    fields = ('urlHash', 'pk', 'url', 'title')
+    pages = dict((h, (pk, url, title)) for h, pk, url, title in
+        Page.objects.filter(urlHash__in=list(urls)).values_list(*fields))
+    missing = [h for h in urls if h not in pages]
+    if missing:
+        Page.objects.bulk_create([
+            Page(urlHash=h, url=urls[h], title=titles.get(h, ''))
+            for h in missing
+        ])
+        pages.update((h, (pk, url, title)) for h, pk, url, title in
+            Page.objects.filter(urlHash__in=missing).values_list(*fields))
+    return pages
+
+def backfill(apps, schema_editor):
+    Page = apps.get_model('users', 'Page')
+    for name in MODELS:
+        model = apps.get_model('users', name)
+        while True:
+            with transaction.atomic():
+                rows = list(model.objects.filter(page__isnull=True)
+                    .order_by('pk').values_list('pk', 'url', 'pageTitle')[:CHUNK_SIZE])
+                if not rows:
+                    break
+                pages = get_pages(Page, rows)
+                by_page = defaultdict(list)
+                for pk, url, title in rows:
+                    page_id, page_url, page_title = pages[url_hash(url)]
+                    if name not in SNAPSHOT_MODELS or (url == page_url and title == page_title):
+                        by_page[page_id].append(pk)
+                        continue
+                    # rare: the entry keeps the url and title it was redeemed with
+                    model.objects.filter(pk=pk).update(page_id=page_id,
+                        url='' if url == page_url else url,
+                        pageTitle='' if title == page_title else title)
+                # popular pages repeat, so this is one UPDATE per distinct page
+                for page_id, pks in by_page.items():
+                    if name in SNAPSHOT_MODELS:
+                        model.objects.filter(pk__in=pks).update(page_id=page_id, url='', pageTitle='')
+                    else:
+                        model.objects.filter(pk__in=pks).update(page_id=page_id)
+
+def restore(apps, schema_editor):
+    Page = apps.get_model('users', 'Page')
+    for name in MODELS:
+        model = apps.get_model('users', name)
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                pages = list(Page.objects.filter(pk__gt=last_pk).order_by('pk')[:CHUNK_SIZE])
+                if not pages:
+                    break
+                for page in pages:
+                    if name in SNAPSHOT_MODELS:
+                        model.objects.filter(page=page, url='').update(url=page.url)
+                        model.objects.filter(page=page, pageTitle='').update(pageTitle=page.title)
+                    else:
+                        model.objects.filter(page=page).update(url=page.url, pageTitle=page.title)
+                last_pk = pages[-1].pk
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('users', '0009_page'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, restore),
+    ]
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-19 08:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_page_backfill'),
+    ]
+
+    # url and pageTitle of offers get a default before they are removed, so
+    # that unapplying can re-add the columns to existing rows (0010 restores
+    # them). Entries keep them, blank where they equal the page's.
+    operations = [
+        migrations.AlterField(
+            model_name='browsercmeoffer',
+            name='page',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='users.Page'),
+        ),
+        migrations.AlterField(
+            model_name='browsercme',
+            name='page',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='users.Page'),
+        ),
+        migrations.AlterField(
+            model_name='exbrowsercme',
+            name='page',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='users.Page'),
+        ),
+        migrations.AlterField(
+            model_name='browsercmeoffer',
+            name='url',
+            field=models.URLField(default='', max_length=500),
+        ),
+        migrations.AlterField(
+            model_name='browsercmeoffer',
+            name='pageTitle',
+            field=models.TextField(default=''),
+        ),
+        migrations.AlterField(
+            model_name='browsercme',
+            name='url',
+            field=models.URLField(blank=True, help_text='Url as redeemed, if it differs from the url of the page', max_length=500),
+        ),
+        migrations.AlterField(
+            model_name='browsercme',
+            name='pageTitle',
+            field=models.TextField(blank=True, help_text='Title as redeemed, if it differs from the title of the page'),
+        ),
+        migrations.AlterField(
+            model_name='exbrowsercme',
+            name='url',
+            field=models.URLField(blank=True, help_text='Url as offered, if it differs from the url of the page', max_length=500),
+        ),
+        migrations.AlterField(
+            model_name='exbrowsercme',
+            name='pageTitle',
+            field=models.TextField(blank=True, help_text='Title as offered, if it differs from the title of the page'),
+        ),
+        migrations.RemoveField(
+            model_name='browsercmeoffer',
+            name='url',
+        ),
+        migrations.RemoveField(
+            model_name='browsercmeoffer',
+            name='pageTitle',
+        ),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-19 07:59
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('users', '0011_page_required'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=500)),
+                ('pageTitle', models.TextField(blank=True)),
+                ('startTime', models.DateTimeField()),
+                ('dwell', models.IntegerField(help_text='Seconds spent on the page')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PageActivity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('visits', models.IntegerField(default=0)),
+                ('dwell', models.IntegerField(default=0, help_text='Total seconds spent on the page')),
+                ('firstActivity', models.DateTimeField()),
+                ('lastActivity', models.DateTimeField()),
+                ('offered', models.DateTimeField(blank=True, help_text='Time a BrowserCmeOffer was made for this activity', null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='users.Page')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Page activities',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='pageactivity',
+            unique_together=set([('user', 'page')]),
+        ),
+    ]
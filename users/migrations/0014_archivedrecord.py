@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-19 08:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_created_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('entry', 'Entry'), ('offer', 'BrowserCmeOffer')], max_length=10)),
+                ('objectId', models.IntegerField(help_text='id of the archived row')),
+                ('userId', models.IntegerField(db_index=True)),
+                ('document', models.CharField(blank=True, db_index=True, help_text='Storage name of the document of an archived Entry', max_length=255)),
+                ('created', models.DateTimeField(help_text='created of the archived row')),
+                ('archived', models.DateTimeField(auto_now_add=True)),
+                ('payload', models.BinaryField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='archivedrecord',
+            unique_together=set([('kind', 'objectId')]),
+        ),
+    ]
@@ -5,12 +5,13 @@ from decimal import Decimal
 import uuid
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
 #from django.contrib.contenttypes.fields import GenericForeignKey
 #from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
+from common.urlnorm import url_hash
 
 #
 # constants (should match the database values)
@@ -65,11 +66,11 @@ class Profile(models.Model):
         primary_key=True
     )
     firstName = models.CharField(max_length=30)
-    lastName = models.CharField(max_length=30)
+    lastName = models.CharField(max_length=30, db_index=True)
     contactEmail = models.EmailField(blank=True)
     jobTitle = models.CharField(max_length=100, blank=True)
     description = models.TextField(blank=True) # about me
-    npiNumber = models.CharField(max_length=20, blank=True)
+    npiNumber = models.CharField(max_length=20, blank=True, db_index=True)
     inviteId = models.CharField(max_length=12, unique=True)
     socialUrl = models.URLField(blank=True)
     pictureUrl = models.URLField(max_length=300, blank=True)
@@ -91,12 +92,67 @@ class Customer(models.Model):
     customerId = models.UUIDField(unique=True, editable=False, default=uuid.uuid4,
         help_text='Used for Braintree customerId')
     balance = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    vaultCreated = models.BooleanField(default=False,
+        help_text='Set once the Braintree Customer is known to exist in the vault')
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return str(self.customerId)
 
+class PageManager(models.Manager):
+    def get_for_url(self, url, title=''):
+        """Returns the Page of the normalized url, creating it with url and
+        title if needed. An existing page is not changed: its url and title
+        are shown by the offers and entries that reference it.
+        """
+        page, created = self.get_or_create(
+            urlHash=url_hash(url),
+            defaults={'url': url.strip(), 'title': title}
+        )
+        return page
+
+    def get_for_urls(self, urls):
+        """urls: dict of url => title.
+        Returns dict of urlHash => Page id. Missing pages are created with
+        one bulk insert. Titles of existing pages are not changed.
+        If a concurrent request inserted some of the pages first, the
+        missing pages are created one by one instead.
+        """
+        pages = {}
+        for url, title in urls.items():
+            h = url_hash(url)
+            if h not in pages or title:
+                pages[h] = self.model(urlHash=h, url=url.strip(), title=title)
+        found = dict(self.filter(urlHash__in=list(pages)).values_list('urlHash', 'pk'))
+        missing = [h for h in pages if h not in found]
+        if missing:
+            try:
+                # savepoint, so that the caller's transaction survives the conflict
+                with transaction.atomic():
+                    self.bulk_create([pages[h] for h in missing])
+            except IntegrityError:
+                for h in missing:
+                    self.get_or_create(urlHash=h, defaults={'url': pages[h].url, 'title': pages[h].title})
+            found.update(self.filter(urlHash__in=missing).values_list('urlHash', 'pk'))
+        return found
+
+# Catalog of web pages referenced by BrowserCME offers and entries.
+# A page is stored once per normalized url (see common.urlnorm), with the
+# url and title as first seen.
+@python_2_unicode_compatible
+class Page(models.Model):
+    url = models.URLField(max_length=500)
+    urlHash = models.CharField(max_length=64, unique=True,
+        help_text='sha256 hex digest of the normalized url')
+    title = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+    objects = PageManager()
+
+    def __str__(self):
+        return self.url
+
 # Browser CME offer
 # An offer for a user is generated based on the user's plugin activity.
 @python_2_unicode_compatible
@@ -106,22 +162,70 @@ class BrowserCmeOffer(models.Model):
         db_index=True
     )
     activityDate = models.DateTimeField()
-    url = models.URLField(max_length=500)
-    pageTitle = models.TextField(blank=True)
+    page = models.ForeignKey(Page,
+        on_delete=models.PROTECT,
+        db_index=True
+    )
     expireDate = models.DateTimeField()
     redeemed = models.BooleanField(default=False)
     points = models.DecimalField(max_digits=6, decimal_places=2,
         help_text='Points needed to redeem this offer')
     credits = models.DecimalField(max_digits=5, decimal_places=2,
         help_text='CME credits to be awarded upon redemption')
-    created = models.DateTimeField(auto_now_add=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
     modified = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return self.url
+        return self.page.url
     class Meta:
         verbose_name_plural = 'BrowserCME Offers'
 
+# Browsing activity event sent by the plugin (see users/activity.py).
+# Events are only inserted and, once aggregated into PageActivity, deleted.
+# The table has no secondary index, to keep the inserts cheap.
+@python_2_unicode_compatible
+class ActivityEvent(models.Model):
+    user = models.ForeignKey(User,
+        on_delete=models.CASCADE,
+        db_index=False
+    )
+    url = models.URLField(max_length=500)
+    pageTitle = models.TextField(blank=True)
+    startTime = models.DateTimeField()
+    dwell = models.IntegerField(help_text='Seconds spent on the page')
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.url
+
+# Browsing activity of a user on a page, aggregated from ActivityEvents.
+# A BrowserCmeOffer is made once the activity passes the thresholds in settings.
+@python_2_unicode_compatible
+class PageActivity(models.Model):
+    user = models.ForeignKey(User,
+        on_delete=models.CASCADE,
+        db_index=True
+    )
+    page = models.ForeignKey(Page,
+        on_delete=models.PROTECT,
+        db_index=True
+    )
+    visits = models.IntegerField(default=0)
+    dwell = models.IntegerField(default=0, help_text='Total seconds spent on the page')
+    firstActivity = models.DateTimeField()
+    lastActivity = models.DateTimeField()
+    offered = models.DateTimeField(null=True, blank=True,
+        help_text='Time a BrowserCmeOffer was made for this activity')
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{0.user_id}:{0.page_id}'.format(self)
+
+    class Meta:
+        unique_together = ('user', 'page')
+        verbose_name_plural = 'Page activities'
+
 # Extensible list of entry types that can appear in a user's feed
 @python_2_unicode_compatible
 class EntryType(models.Model):
@@ -136,6 +240,35 @@ class EntryType(models.Model):
 # Base class for all feed entries (contains fields common to all entry types)
 # A entry belongs to a user, and is defined by an activityDate and
 # a description.
+class EntryManager(models.Manager):
+    def bulk_create_with_ids(self, entries, batch_size=100):
+        """
+        bulk_create that sets the pk of each entry on all backends.
+        Must be called inside a transaction.
+        PostgreSQL returns the ids of a bulk insert. On SQLite, a single
+        multi-row INSERT assigns consecutive rowids while the transaction
+        holds the write lock, so the ids of each batch are derived from
+        last_insert_rowid(). Other backends insert one row at a time.
+        """
+        connection = connections[self.db]
+        if connection.features.can_return_ids_from_bulk_insert:
+            return self.bulk_create(entries, batch_size=batch_size)
+        if connection.vendor != 'sqlite':
+            for entry in entries:
+                entry.save(force_insert=True, using=self.db)
+            return entries
+        # keep each batch within one INSERT statement (SQLite allows 999 parameters)
+        batch_size = min(batch_size, connection.ops.bulk_batch_size(self.model._meta.concrete_fields, entries))
+        for start in range(0, len(entries), batch_size):
+            batch = entries[start:start+batch_size]
+            self.bulk_create(batch, batch_size=len(batch))
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT last_insert_rowid()')
+                last_id = cursor.fetchone()[0]
+            for i, entry in enumerate(batch):
+                entry.pk = last_id - len(batch) + 1 + i
+        return entries
+
 @python_2_unicode_compatible
 class Entry(models.Model):
     user = models.ForeignKey(User,
@@ -151,14 +284,38 @@ class Entry(models.Model):
     valid = models.BooleanField(default=True)
     document = models.FileField(upload_to='entries', blank=True, null=True)
     tags = models.ManyToManyField(CmeTag, related_name='entries')
-    created = models.DateTimeField(auto_now_add=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
     modified = models.DateTimeField(auto_now=True)
+    objects = EntryManager()
 
     def __str__(self):
         return self.description
 
     class Meta:
         verbose_name_plural = 'Entries'
+        index_together = [
+            # feed sync: changes of a user after a (modified, id) high-water mark
+            ['user', 'modified', 'id']
+        ]
+
+# Deleted Entry, returned by feed sync so that clients drop their copy.
+# modified is the time of deletion.
+@python_2_unicode_compatible
+class EntryTombstone(models.Model):
+    user = models.ForeignKey(User,
+        on_delete=models.CASCADE,
+        db_index=True
+    )
+    entryId = models.IntegerField()
+    modified = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return str(self.entryId)
+
+    class Meta:
+        index_together = [
+            ['user', 'modified', 'entryId']
+        ]
 
 # Reward entry to show points earned by user
 @python_2_unicode_compatible
@@ -189,11 +346,22 @@ class SRCme(models.Model):
         return str(self.credits)
 
 
+class PageSnapshotMixin(object):
+    """For entries with a page and the url/pageTitle fields, which keep the
+    url and title as redeemed where they differ from the page's (rows
+    migrated from before the Page table). They are blank otherwise.
+    """
+    def get_url(self):
+        return self.url or self.page.url
+
+    def get_page_title(self):
+        return self.pageTitle or self.page.title
+
 # Browser CME entry
 # An entry is created when a Browser CME offer is redeemed by the user
 # in exchange for points.
 @python_2_unicode_compatible
-class BrowserCme(models.Model):
+class BrowserCme(PageSnapshotMixin, models.Model):
     PURPOSE_DX = 0  # Diagnosis
     PURPOSE_TX = 1 # Treatment
     PURPOSE_CHOICES = (
@@ -217,8 +385,14 @@ class BrowserCme(models.Model):
         db_index=True
     )
     credits = models.DecimalField(max_digits=5, decimal_places=2)
-    url = models.URLField(max_length=500)
-    pageTitle = models.TextField()
+    page = models.ForeignKey(Page,
+        on_delete=models.PROTECT,
+        db_index=True
+    )
+    url = models.URLField(max_length=500, blank=True,
+        help_text='Url as redeemed, if it differs from the url of the page')
+    pageTitle = models.TextField(blank=True,
+        help_text='Title as redeemed, if it differs from the title of the page')
     purpose = models.IntegerField(
         default=0,
         choices=PURPOSE_CHOICES,
@@ -230,12 +404,12 @@ class BrowserCme(models.Model):
     )
 
     def __str__(self):
-        return self.url
+        return self.get_url()
 
 # Expired Browser CME entry
 # An entry is created for an expired Browser CME offer that was never redeemed
 @python_2_unicode_compatible
-class ExBrowserCme(models.Model):
+class ExBrowserCme(PageSnapshotMixin, models.Model):
     entry = models.OneToOneField(Entry,
         on_delete=models.CASCADE,
         related_name='exbrcme',
@@ -246,11 +420,17 @@ class ExBrowserCme(models.Model):
         related_name='exbrcme',
         db_index=True
     )
-    url = models.URLField(max_length=500)
-    pageTitle = models.TextField()
+    page = models.ForeignKey(Page,
+        on_delete=models.PROTECT,
+        db_index=True
+    )
+    url = models.URLField(max_length=500, blank=True,
+        help_text='Url as offered, if it differs from the url of the page')
+    pageTitle = models.TextField(blank=True,
+        help_text='Title as offered, if it differs from the title of the page')
 
     def __str__(self):
-        return self.url
+        return self.get_url()
 
 
 # User points activity
@@ -271,7 +451,7 @@ class PointTransaction(models.Model):
     pricePaid = models.DecimalField(max_digits=6, decimal_places=2)
     transactionId = models.CharField(max_length=36, unique=True)
     valid = models.BooleanField(default=True)
-    created = models.DateTimeField(auto_now_add=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
     modified = models.DateTimeField(auto_now=True)
 
     def __str__(self):
@@ -316,3 +496,122 @@ class UserFeedback(models.Model):
         return self.message
     class Meta:
         verbose_name_plural = 'User Feedback'
+
+# Stored response of a request that was made with an Idempotency-Key header.
+# A row with null statusCode is a request that is still in flight.
+@python_2_unicode_compatible
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(User,
+        on_delete=models.CASCADE,
+        db_index=True
+    )
+    key = models.CharField(max_length=64)
+    requestHash = models.CharField(max_length=64,
+        help_text='Hash of the request method, path and data')
+    statusCode = models.IntegerField(null=True, blank=True)
+    response = models.TextField(blank=True)
+    expireDate = models.DateTimeField(db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.key
+
+    class Meta:
+        unique_together = ('user', 'key')
+
+# Side-effect event written in the same transaction as the change that caused it.
+# Events are delivered in batches to the consumers configured in
+# settings.ORBIT_OUTBOX_CONSUMERS by the dispatch_outbox command.
+@python_2_unicode_compatible
+class OutboxEvent(models.Model):
+    topic = models.CharField(max_length=60)
+    payload = models.TextField(help_text='JSON-encoded event data')
+    dispatched = models.DateTimeField(null=True, blank=True, db_index=True)
+    attempts = models.IntegerField(default=0)
+    nextAttempt = models.DateTimeField(default=timezone.now,
+        help_text='Event is not delivered before this time (retry backoff)')
+    lastError = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.topic
+
+# Uploaded document to be deleted from storage. The tombstone is written in
+# the same transaction that drops the reference to the document, and the
+# file is deleted later in a batch (see users/documents.py).
+@python_2_unicode_compatible
+class DocumentTombstone(models.Model):
+    name = models.CharField(max_length=255, help_text='Storage name of the document')
+    attempts = models.IntegerField(default=0)
+    lastError = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+# Background job stored in the project database (see users/jobs.py).
+# Jobs are claimed and executed by the runworker command.
+@python_2_unicode_compatible
+class Job(models.Model):
+    STATE_QUEUED = 'queued'
+    STATE_RUNNING = 'running'
+    STATE_DONE = 'done'
+    STATE_FAILED = 'failed'
+    STATE_CHOICES = (
+        (STATE_QUEUED, 'Queued'),
+        (STATE_RUNNING, 'Running'),
+        (STATE_DONE, 'Done'),
+        (STATE_FAILED, 'Failed')
+    )
+    task = models.CharField(max_length=200, help_text='Dotted path of the task function')
+    payload = models.TextField(help_text='JSON-encoded args and kwargs')
+    key = models.CharField(max_length=100, blank=True, db_index=True,
+        help_text='enqueue() adds no job while a queued or running job has the same key')
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default=STATE_QUEUED)
+    attempts = models.IntegerField(default=0)
+    maxAttempts = models.IntegerField(default=5)
+    runAt = models.DateTimeField(help_text='Job is not run before this time')
+    startedAt = models.DateTimeField(null=True, blank=True)
+    finishedAt = models.DateTimeField(null=True, blank=True)
+    lockedBy = models.CharField(max_length=100, blank=True)
+    heartbeat = models.DateTimeField(null=True, blank=True,
+        help_text='Last time the worker running the job renewed its lease')
+    lastError = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.task
+
+    class Meta:
+        index_together = [
+            ['state', 'runAt']
+        ]
+
+# Entry or BrowserCmeOffer moved out of its table by the archive_data command
+# (see users/archive.py). payload is the zlib-compressed JSON of the row and
+# its dependent rows. userId is not a FK, so that archives outlive the tables'
+# constraints.
+@python_2_unicode_compatible
+class ArchivedRecord(models.Model):
+    KIND_ENTRY = 'entry'
+    KIND_OFFER = 'offer'
+    KIND_CHOICES = (
+        (KIND_ENTRY, 'Entry'),
+        (KIND_OFFER, 'BrowserCmeOffer')
+    )
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    objectId = models.IntegerField(help_text='id of the archived row')
+    userId = models.IntegerField(db_index=True)
+    document = models.CharField(max_length=255, blank=True, db_index=True,
+        help_text='Storage name of the document of an archived Entry')
+    created = models.DateTimeField(help_text='created of the archived row')
+    archived = models.DateTimeField(auto_now_add=True)
+    payload = models.BinaryField()
+
+    def __str__(self):
+        return '{0.kind}:{0.objectId}'.format(self)
+
+    class Meta:
+        unique_together = ('kind', 'objectId')
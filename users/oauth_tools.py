@@ -1,19 +1,42 @@
-from django.core.exceptions import ObjectDoesNotExist
+import calendar
+import uuid
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
 from oauth2_provider.settings import oauth2_settings
 from oauthlib.common import generate_token
 from oauth2_provider.models import AccessToken, Application, RefreshToken
 from django.utils.timezone import now, timedelta
+from .authentication import invalidate_token, encode_jwt, JWT_ISSUER
+
+TOKEN_MODE_DB = 'db'
+TOKEN_MODE_JWT = 'jwt'
 
 APP_NAME = 'orbit'
+# a valid token is only reused if it remains valid for at least this long
+REUSE_MIN_SECONDS = 300
+
+_application_ids = {}
+
+def jwt_mode():
+    """True if ORBIT_TOKEN_MODE is set to issue stateless signed tokens"""
+    return getattr(settings, 'ORBIT_TOKEN_MODE', TOKEN_MODE_DB) == TOKEN_MODE_JWT
+
+def get_application_id(name=APP_NAME):
+    """Returns pk of our oauth2 app. The value is looked up once per process."""
+    if name not in _application_ids:
+        _application_ids[name] = Application.objects.values_list('pk', flat=True).get(name=name)
+    return _application_ids[name]
 
 def get_token_dict(access_token):
     """
     Takes an AccessToken instance as an argument
     and returns a dict from that AccessToken.
     """
+    expires_in = int(round((access_token.expires - now()).total_seconds()))
     token = {
         'access_token': access_token.token,
-        'expires_in': oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS,
+        'expires_in': max(expires_in, 0),
         'token_type': 'Bearer',
         'refresh_token': access_token.refresh_token.token,
         'scope': access_token.scope
@@ -24,68 +47,110 @@ def get_access_token(user):
     """
    Takes a user instance and return an access_token as a dict if available
    """
-    # our oauth2 app
-    app = Application.objects.get(name=APP_NAME)
-
-    try:
-        access_token = AccessToken.objects.get(application=app, user=user)
-    except ObjectDoesNotExist:
+    access_token = AccessToken.objects \
+        .filter(application_id=get_application_id(), user=user, expires__gt=now()) \
+        .select_related('refresh_token') \
+        .order_by('-expires') \
+        .first()
+    if access_token is None:
         return None
-    if not access_token.is_expired():
-        return get_token_dict(access_token)
-    return None
+    return get_token_dict(access_token)
 
-def new_access_token(user):
+def new_access_token(user, reuse=False):
     """
-    Takes a user instance and return a new access_token as a dict
+    Takes a user instance and return a new access_token as a dict.
+    All existing tokens of the user are replaced in a single transaction:
+    the user row is locked, the old tokens are deleted with one queryset
+    delete and the new access and refresh token are inserted.
+    If reuse is True, an existing token that remains valid for at least
+    REUSE_MIN_SECONDS is returned instead of rotating the tokens.
+    In jwt mode a new signed token is returned and nothing is stored.
     """
-    # our oauth2 app
-    app = Application.objects.get(name=APP_NAME)
-    # delete the old access_token and refresh_token
-    try:
-        old_access_token = AccessToken.objects.get(application=app, user=user)
-        old_refresh_token = RefreshToken.objects.get(application=app, user=user, access_token=old_access_token)
-    except ObjectDoesNotExist:
-        pass
-    else:
-        old_access_token.delete()
-        old_refresh_token.delete()
-
-    # generate a new access token, and refresh token
-    token = generate_token()
-    refresh_token = generate_token()
-    expires = now() + timedelta(seconds=oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS)
-    scope = "read write"
+    if jwt_mode():
+        return new_jwt_token(user)
+    app_id = get_application_id()
+    with transaction.atomic():
+        # lock user row so that concurrent logins of the same user are serialized
+        list(User.objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True))
+        if reuse:
+            access_token = AccessToken.objects \
+                .filter(application_id=app_id, user=user,
+                    expires__gt=now() + timedelta(seconds=REUSE_MIN_SECONDS),
+                    refresh_token__isnull=False) \
+                .select_related('refresh_token') \
+                .order_by('-expires') \
+                .first()
+            if access_token is not None:
+                return get_token_dict(access_token)
 
-    # create the access token
-    # https://django-oauth-toolkit.readthedocs.io/en/latest/models.html
-    access_token = AccessToken.objects.create(
-        user=user,
-        application=app,
-        expires=expires,
-        token=token,
-        scope=scope)
-
-    # create the refresh token
-    RefreshToken.objects.create(
-        user=user,
-        application=app,
-        token=refresh_token,
-        access_token=access_token)
+        # delete all old access_tokens of the user (refresh_tokens are deleted by cascade)
+        old_tokens = list(AccessToken.objects.filter(application_id=app_id, user=user).values_list('pk', 'token'))
+        if old_tokens:
+            AccessToken.objects.filter(pk__in=[pk for pk, token in old_tokens]).delete()
+            for pk, token in old_tokens:
+                invalidate_token(token)
+
+        # create the access token and refresh token
+        # https://django-oauth-toolkit.readthedocs.io/en/latest/models.html
+        # These are two inserts into two tables. They cannot be one bulk
+        # insert: the refresh token references the pk of the access token,
+        # which is only known once the access token is inserted.
+        access_token = AccessToken.objects.create(
+            user=user,
+            application_id=app_id,
+            expires=now() + timedelta(seconds=oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS),
+            token=generate_token(),
+            scope="read write")
+        RefreshToken.objects.create(
+            user=user,
+            application_id=app_id,
+            token=generate_token(),
+            access_token=access_token)
 
     # return access token as dict
     return get_token_dict(access_token)
 
 
 def delete_access_token(user, token):
-    """Delete access token and refresh_token"""
-    app = Application.objects.get(name=APP_NAME)
-    # delete the access_token and refresh_token
-    try:
-        access_token = AccessToken.objects.get(application=app, token=token, user=user)
-        refresh_token = RefreshToken.objects.get(application=app, access_token=access_token, user=user)
-    except:
-        pass
-    else:
-        access_token.delete()
-        refresh_token.delete()
+    """Delete access token and refresh_token (by cascade)"""
+    AccessToken.objects.filter(application_id=get_application_id(), user=user, token=token).delete()
+    invalidate_token(token)
+
+
+def new_jwt_token(user):
+    """
+    Takes a user instance and return a new signed (stateless) access token as a dict.
+    The token carries the user id, the user fields of SignedAccessToken.make_user,
+    scope and expiry.
+    """
+    expires_in = getattr(settings, 'ORBIT_JWT_EXPIRE_SECONDS', 3600)
+    issued = now()
+    scope = "read write"
+    claims = {
+        'iss': JWT_ISSUER,
+        'jti': uuid.uuid4().hex,
+        'sub': user.pk,
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'email': user.email,
+        'staff': user.is_staff,
+        'active': user.is_active,
+        'scope': scope,
+        'iat': calendar.timegm(issued.utctimetuple()),
+        'exp': calendar.timegm((issued + timedelta(seconds=expires_in)).utctimetuple())
+    }
+    return get_jwt_token_dict(encode_jwt(claims), expires_in, scope)
+
+def get_jwt_token_dict(token, expires_in, scope):
+    """Returns a signed access token in the same format as get_token_dict.
+    Signed tokens are not refreshed: the client logs in again when the
+    token expires.
+    """
+    return {
+        'access_token': token,
+        'expires_in': max(int(expires_in), 0),
+        'token_type': 'Bearer',
+        'refresh_token': None,
+        'scope': scope
+    }
@@ -0,0 +1,139 @@
+"""Transactional outbox.
+
+Request handlers call emit() inside the transaction that makes the change,
+so an event is stored if and only if the change is committed. The
+dispatch_outbox command drains pending events in batches and delivers them
+to the consumers configured for their topic (at-least-once delivery:
+consumers must tolerate duplicates). A failed delivery is retried with
+exponential backoff. After ORBIT_OUTBOX_MAX_ATTEMPTS failures the event is
+dead: it is no longer delivered, is counted by outbox_stats, and can be
+requeued with dispatch_outbox --retry-dead. Dispatched events are deleted by
+the purge_outbox command after ORBIT_OUTBOX_RETENTION seconds.
+"""
+import json
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, F, Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+# topics
+TOPIC_BALANCE_CHANGED = 'balance.changed'
+TOPIC_BRCME_REDEEMED = 'brcme.redeemed'
+TOPIC_SRCME_CREATED = 'srcme.created'
+TOPIC_ENTRY_DELETED = 'entry.deleted'
+TOPIC_JOB_FAILED = 'job.failed'
+# consumers registered for this topic receive events of all topics
+ALL_TOPICS = '*'
+
+def emit(topic, **data):
+    """Store an event. Call inside the transaction of the change."""
+    return OutboxEvent.objects.create(
+        topic=topic,
+        payload=json.dumps(data, cls=DjangoJSONEncoder)
+    )
+
+def emit_many(topic, items):
+    """Store one event per dict in items with a single insert. Call inside the transaction of the change."""
+    return OutboxEvent.objects.bulk_create([
+        OutboxEvent(topic=topic, payload=json.dumps(data, cls=DjangoJSONEncoder))
+        for data in items
+    ])
+
+def get_consumers(topic):
+    config = getattr(settings, 'ORBIT_OUTBOX_CONSUMERS', {})
+    paths = list(config.get(topic, [])) + list(config.get(ALL_TOPICS, []))
+    return [import_string(path) for path in paths]
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+def pending_events():
+    """Events that may be delivered (not dispatched and not dead)"""
+    return OutboxEvent.objects.filter(dispatched__isnull=True,
+        attempts__lt=_setting('ORBIT_OUTBOX_MAX_ATTEMPTS', 10))
+
+def dead_events():
+    """Events that failed ORBIT_OUTBOX_MAX_ATTEMPTS times"""
+    return OutboxEvent.objects.filter(dispatched__isnull=True,
+        attempts__gte=_setting('ORBIT_OUTBOX_MAX_ATTEMPTS', 10))
+
+def _record_failure(events, error):
+    """Increment the attempt count of the failed events and set the time of
+    their next attempt (ORBIT_OUTBOX_RETRY_BACKOFF seconds, doubled after each
+    attempt)"""
+    max_attempts = _setting('ORBIT_OUTBOX_MAX_ATTEMPTS', 10)
+    backoff = _setting('ORBIT_OUTBOX_RETRY_BACKOFF', 2)
+    now = timezone.now()
+    by_attempts = {}
+    for event in events:
+        by_attempts.setdefault(event.attempts, []).append(event.pk)
+    for attempts, ids in by_attempts.items():
+        OutboxEvent.objects.filter(pk__in=ids).update(
+            attempts=attempts+1,
+            nextAttempt=now + timedelta(seconds=backoff * 2**attempts),
+            lastError=error)
+        if attempts+1 >= max_attempts:
+            logger.error('Outbox events {0} are dead after {1} attempts'.format(ids, attempts+1))
+
+def dispatch_batch(batch_size=100):
+    """
+    Deliver up to batch_size due events. Each consumer is called once per
+    topic with the list of events of that topic (in order). Events are
+    marked dispatched only if all their consumers succeed. Otherwise they
+    are retried with backoff until ORBIT_OUTBOX_MAX_ATTEMPTS is reached.
+    Returns (num_dispatched, num_failed).
+    """
+    events = list(pending_events()
+        .filter(nextAttempt__lte=timezone.now())
+        .order_by('id')[:batch_size])
+    by_topic = OrderedDict()
+    for event in events:
+        event.data = json.loads(event.payload)
+        by_topic.setdefault(event.topic, []).append(event)
+    done = []
+    num_failed = 0
+    for topic, topic_events in by_topic.items():
+        try:
+            for consumer in get_consumers(topic):
+                consumer(topic_events)
+        except Exception as e:
+            logger.exception('Outbox consumer failed for topic {0}'.format(topic))
+            _record_failure(topic_events, str(e))
+            num_failed += len(topic_events)
+        else:
+            done.extend(event.pk for event in topic_events)
+    if done:
+        OutboxEvent.objects.filter(pk__in=done).update(dispatched=timezone.now(), attempts=F('attempts')+1)
+    return (len(done), num_failed)
+
+def retry_dead():
+    """Make dead events due again with a fresh attempt count. Returns number requeued"""
+    return dead_events().update(attempts=0, nextAttempt=timezone.now())
+
+def outbox_stats():
+    """
+    Returns outbox metrics:
+        pending: events not dispatched yet (due or backing off)
+        oldestPendingAge: seconds since the oldest pending event was created
+        dead: events that are no longer retried
+    """
+    now = timezone.now()
+    pending = pending_events().aggregate(num=Count('id'), oldest=Min('created'))
+    return {
+        'pending': pending['num'],
+        'oldestPendingAge': (now - pending['oldest']).total_seconds() if pending['oldest'] else 0,
+        'dead': dead_events().count()
+    }
+
+def purge_dispatched():
+    """Delete events dispatched more than ORBIT_OUTBOX_RETENTION seconds ago. Returns number deleted"""
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'ORBIT_OUTBOX_RETENTION', 7*86400))
+    num_deleted, details = OutboxEvent.objects.filter(dispatched__lt=cutoff).delete()
+    return num_deleted
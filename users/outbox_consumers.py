@@ -0,0 +1,21 @@
+"""Consumers of outbox events (see settings.ORBIT_OUTBOX_CONSUMERS).
+A consumer is called with a list of events of the same topic. Each event
+has the attributes: pk, topic, created, and data (the decoded payload).
+"""
+import logging
+from django.core.mail import mail_admins
+
+logger = logging.getLogger(__name__)
+
+def log_event(events):
+    """Write events to the analytics log"""
+    for event in events:
+        logger.info('event {0} {1} {2}'.format(event.pk, event.topic, event.data))
+
+def notify_admins(events):
+    """Send a single email to the site admins for a batch of events"""
+    lines = ['{0:%Y-%m-%d %H:%M:%S} {1}'.format(event.created, event.data) for event in events]
+    mail_admins(
+        'Orbit: {0} {1} event(s)'.format(len(events), events[0].topic),
+        '\n'.join(lines)
+    )
@@ -20,6 +20,10 @@ from rest_framework.parsers import JSONParser
 from common.viewutils import JsonResponseMixin
 # app
 from .models import *
+from .identity import get_identity
+from .idempotency import idempotent
+from .outbox import emit, TOPIC_BALANCE_CHANGED
+from .braintree_tools import get_client_token, get_customer_client_token, get_payment_methods, invalidate_payment_methods
 import logging
 
 TPL_DIR = 'users'
@@ -30,17 +34,44 @@ logger = logging.getLogger(__name__)
 class GetToken(JsonResponseMixin, APIView):
     """
     This endpoint returns a Braintree Client Token.
+    Tokens are served from a pre-generated pool. If the customer=1 query
+    parameter is given, a token scoped to the user's Braintree Customer is
+    returned instead (the Drop-in UI then shows the vaulted payment methods).
+    That returns 409 while the Braintree Customer is still being created
+    after the first login.
 
     """
     def get(self, request, *args, **kwargs):
+        if request.query_params.get('customer') in ('1', 'true'):
+            customer = get_identity(request).customer
+            if customer is None:
+                context = {
+                    'success': False,
+                    'error_message': 'Local customer object not found for user'
+                }
+                return self.render_to_json_response(context, status_code=400)
+            try:
+                token = get_customer_client_token(customer)
+            except ValueError:
+                # gateway error: the customer_id does not exist in the vault
+                if customer.vaultCreated:
+                    raise
+                context = {
+                    'success': False,
+                    'error_message': 'Payment account is still being set up. Try again later'
+                }
+                return self.render_to_json_response(context, status_code=409)
+        else:
+            token = get_client_token()
         context = {
-            'token': braintree.ClientToken.generate()
+            'token': token
         }
         return self.render_to_json_response(context)
 
 class GetPaymentMethods(JsonResponseMixin, APIView):
     """
     This endpoint returns a list of existing payment methods from the Braintree Customer (if any).
+    The list is cached per user, and refreshed in the background once it is stale.
 
     """
     def get(self, request, *args, **kwargs):
@@ -52,10 +83,8 @@ class GetPaymentMethods(JsonResponseMixin, APIView):
             }
             return self.render_to_json_response(context, status_code=401)
 
-        local_customer = Customer.objects.get(user=user)
-        btree_customer = braintree.Customer.find(str(local_customer.customerId))
-        results = [{ "token": m.token, "number": m.masked_number, "type": m.card_type, "expiry": m.expiration_date } for m in btree_customer.payment_methods]
-        logger.debug("Customer {} payment methods: {}".format(local_customer, results))
+        results = get_payment_methods(user)
+        logger.debug("User {} payment methods: {}".format(user, results))
         return self.render_to_json_response(results)
 
 # @method_decorator(csrf_exempt, name='dispatch')
@@ -70,7 +99,11 @@ class Checkout(JsonResponseMixin, APIView):
     Example JSON when using a new payment method with a Nonce prepared on client:
     {"point-purchase-option-id":1,"payment-method-nonce":"cd36493e-f883-48c2-aef8-3789ee3569a9"}
 
+    Send an Idempotency-Key header to make retries safe: a repeated request
+    with the same key returns the original response without a second sale.
+
     """
+    @idempotent
     def post(self, request, *args, **kwargs):
         context = {}
         userdata = request.data
@@ -101,7 +134,13 @@ class Checkout(JsonResponseMixin, APIView):
             return self.render_to_json_response(context, status_code=400)
 
         # get customer object from database
-        customer = Customer.objects.get(user=request.user)
+        customer = get_identity(request).customer
+        if customer is None:
+            context = {
+                'success': False,
+                'error_message': 'Local customer object not found for user'
+            }
+            return self.render_to_json_response(context, status_code=400)
 
         # prepare transaction details depending on payment method
         transaction_params = {
@@ -145,9 +184,19 @@ class Checkout(JsonResponseMixin, APIView):
                 # update points balance
                 customer.balance += ppo.points
                 customer.save()
+                emit(TOPIC_BALANCE_CHANGED,
+                    userId=customer.pk,
+                    points=ppo.points,
+                    balance=customer.balance,
+                    transactionId=result.transaction.id,
+                    reason='purchase')
+            if payment_nonce:
+                # new payment method was stored in the vault
+                invalidate_payment_methods(customer.pk, customer.customerId)
             context['balance'] = str(customer.balance)
             return self.render_to_json_response(context)
         else:
+            status_code = 400
             if hasattr(result, 'transaction') and result.transaction is not None:
                 trans = result.transaction
                 status = trans.status
@@ -165,7 +214,6 @@ class Checkout(JsonResponseMixin, APIView):
                     context['gateway_rejection_reason'] = trans.gateway_rejection_reason
             else:
                 # validation error
-                status_code = 400
                 context['status'] = 'validation_error'
                 context['validation_errors'] = []
                 for error in result.errors.deep_errors:
@@ -185,5 +233,5 @@ class TestForm(generic.TemplateView):
     template_name = os.path.join(TPL_DIR, 'payment_test_form.html')
     def get_context_data(self, **kwargs):
         context = super(TestForm, self).get_context_data(**kwargs)
-        context['token'] = braintree.ClientToken.generate()
+        context['token'] = get_client_token()
         return context
@@ -32,7 +32,7 @@ class IsOwnerOrAuthenticated(permissions.BasePermission):
             return False
         if request.method in permissions.SAFE_METHODS:
             return True
-        return obj.user.pk == request.user.pk
+        return obj.user_id == request.user.pk
 
 
 class IsOwnerOrAdmin(permissions.BasePermission):
@@ -46,7 +46,7 @@ class IsOwnerOrAdmin(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if not (request.user and request.user.is_active and request.user.is_authenticated()):
             return False
-        is_owner = obj.user.pk == request.user.pk
+        is_owner = obj.user_id == request.user.pk
         if request.method in permissions.SAFE_METHODS:
             return is_owner or request.user.is_staff
         return is_owner
@@ -60,6 +60,6 @@ class IsEntryOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if not (request.user and request.user.is_active and request.user.is_authenticated()):
             return False
-        is_owner = obj.entry.user.pk == request.user.pk
+        is_owner = obj.entry.user_id == request.user.pk
         return is_owner
 
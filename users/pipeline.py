@@ -1,13 +1,38 @@
+from django.conf import settings
 from django.contrib.auth.models import User
-import braintree
-from pprint import pprint
+from django.db import transaction
 from .models import Profile, Customer
+from .braintree_tools import provision_vault_customer
+from .jobs import enqueue
+import logging
+
+logger = logging.getLogger(__name__)
+
+VAULT_CUSTOMER_JOB_KEY = 'vault-customer:{0}'
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+def enqueue_vault_customer(user_id, check_exists):
+    """Queue a job that creates the Braintree Customer for the user, unless
+    one is already queued or running (e.g. after repeated logins)"""
+    enqueue(provision_vault_customer,
+        args=(user_id,),
+        kwargs={'check_exists': check_exists},
+        max_attempts=_setting('BRAINTREE_PROVISION_ATTEMPTS', 5),
+        key=VAULT_CUSTOMER_JOB_KEY.format(user_id))
 
 def save_profile(backend, user, response, *args, **kwargs):
-    """Save Profile and Customer models for the user"""
-    pprint(response)
-    qset = Profile.objects.filter(user=user)
-    if not qset.exists():
+    """Save Profile and Customer models for the user.
+    Profile and Customer are fetched together in a single query. Creating
+    the Braintree Customer is queued as a background job so that login does
+    not wait on the payment gateway.
+    """
+    logger.debug(response)
+    row = User.objects.select_related('profile', 'customer').get(pk=user.pk)
+    try:
+        profile = row.profile
+    except Profile.DoesNotExist:
         profile = Profile(user=user)
         profile.firstName = response.get('first_name', '')
         profile.lastName = response.get('last_name', '')
@@ -18,56 +43,34 @@ def save_profile(backend, user, response, *args, **kwargs):
         sa_email = response.get('email', '').lower()
         if sa_email.endswith('gmail.com'):
             profile.contactEmail = sa_email
-        profile.save()
+        profile.save(force_insert=True)
     else:
-        profile = qset[0]
-        changed = False
+        changed = []
         if not profile.firstName:
             profile.firstName = response.get('first_name', '')
-            changed = True
+            changed.append('firstName')
         if not profile.lastName:
             profile.lastName = response.get('last_name', '')
-            changed = True
+            changed.append('lastName')
         if not profile.socialUrl and 'link' in response:
             profile.socialUrl = response['link']
-            changed = True
+            changed.append('socialUrl')
         # copy social-auth email if it is a gmail address
         sa_email = response.get('email', '').lower()
         if sa_email.endswith('gmail.com') and not profile.contactEmail:
             profile.contactEmail = sa_email
-            changed = True
+            changed.append('contactEmail')
         if changed:
-            profile.save()
-    qset = Customer.objects.filter(user=user)
-    if not qset.exists():
+            profile.save(update_fields=changed + ['modified'])
+    try:
+        customer = row.customer
+    except Customer.DoesNotExist:
         customer = Customer(user=user)
         customer.balance = 100
-        customer.save()
-        # create braintree Customer
-        result = braintree.Customer.create({
-            "id": str(customer.customerId),
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "email": user.email
-        })
-        if not result.is_success:
-            print('Create braintree Customer failed.')
-            # send email to admins...
+        customer.save(force_insert=True)
+        # create braintree Customer (new customer cannot exist in the vault yet)
+        transaction.on_commit(lambda: enqueue_vault_customer(user.pk, check_exists=False))
     else:
-        customer = qset[0]
-        # if braintree Customer does not exist, then create it
-        try:
-            bt_customer = braintree.Customer.find(str(customer.customerId))
-        except braintree.exceptions.not_found_error.NotFoundError:
-            # create braintree Customer
-            result = braintree.Customer.create({
-                "id": str(customer.customerId),
-                "first_name": user.first_name,
-                "last_name": user.last_name,
-                "email": user.email
-            })
-            if not result.is_success:
-                print('Create braintree Customer failed.')
-                # send email to admins...
-        else:
-            pass
+        # if braintree Customer is not known to exist, then check and create it
+        if not customer.vaultCreated:
+            transaction.on_commit(lambda: enqueue_vault_customer(user.pk, check_exists=True))
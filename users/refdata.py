@@ -0,0 +1,40 @@
+"""Cache of reference data (degrees, specialties, tags, entry types).
+
+List responses of the reference data views are served from the two-level
+refdata cache. Any save or delete of a reference data model invalidates the
+whole cache on all nodes (see UsersConfig.ready) once its transaction
+commits. Invalidating earlier would let a concurrent request cache the
+uncommitted old data under the new version.
+"""
+import hashlib
+from django.conf import settings
+from django.db import transaction
+from rest_framework.response import Response
+from common.tieredcache import TieredCache
+from .models import Degree, PracticeSpecialty, CmeTag, EntryType
+
+REFDATA_MODELS = (Degree, PracticeSpecialty, CmeTag, EntryType)
+
+refdata_cache = TieredCache('refdata',
+    maxsize=getattr(settings, 'ORBIT_REFDATA_CACHE_SIZE', 200),
+    ttl=getattr(settings, 'ORBIT_REFDATA_CACHE_TTL', 3600),
+    local_ttl=getattr(settings, 'ORBIT_REFDATA_CACHE_LOCAL_TTL', 300)
+)
+
+def invalidate_refdata(sender, **kwargs):
+    transaction.on_commit(refdata_cache.invalidate)
+
+class CachedListMixin(object):
+    """Serve list() of a ListAPIView from the refdata cache.
+    The key is the hash of the absolute request URL, because the
+    pagination links in the response data are absolute.
+    """
+    def list(self, request, *args, **kwargs):
+        url = request.build_absolute_uri().encode('utf-8')
+        key = '{0}:{1}'.format(self.queryset.model._meta.model_name, hashlib.md5(url).hexdigest())
+        data = refdata_cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = super(CachedListMixin, self).list(request, *args, **kwargs)
+        refdata_cache.set(key, response.data)
+        return response
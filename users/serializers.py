@@ -2,11 +2,13 @@ from datetime import timedelta
 from decimal import Decimal
 import os
 from pprint import pprint
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils import timezone
 from rest_framework import serializers
 from common.viewutils import md5_uploaded_file
 from .models import *
+from .documents import tombstone_document
 
 class DegreeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -25,7 +27,7 @@ class CmeTagSerializer(serializers.ModelSerializer):
 
 
 class ProfileSerializer(serializers.ModelSerializer):
-    id = serializers.IntegerField(source='user.id', read_only=True)
+    id = serializers.IntegerField(source='user_id', read_only=True)
     socialUrl = serializers.ReadOnlyField()
     cmeTags = serializers.PrimaryKeyRelatedField(
         queryset=CmeTag.objects.all(),
@@ -65,7 +67,7 @@ class ProfileSerializer(serializers.ModelSerializer):
 
 
 class CustomerSerializer(serializers.ModelSerializer):
-    id = serializers.IntegerField(source='user.id', read_only=True)
+    id = serializers.IntegerField(source='user_id', read_only=True)
     balance = serializers.ReadOnlyField()
     class Meta:
         model = Customer
@@ -78,10 +80,10 @@ class CustomerSerializer(serializers.ModelSerializer):
         )
 
 class BrowserCmeOfferSerializer(serializers.ModelSerializer):
-    userId = serializers.IntegerField(source='user.id', read_only=True)
+    userId = serializers.IntegerField(source='user_id', read_only=True)
     activityDate = serializers.ReadOnlyField()
-    url = serializers.ReadOnlyField()
-    pageTitle = serializers.ReadOnlyField()
+    url = serializers.ReadOnlyField(source='page.url')
+    pageTitle = serializers.ReadOnlyField(source='page.title')
     expireDate = serializers.ReadOnlyField()
     credits = serializers.DecimalField(max_digits=5, decimal_places=2, coerce_to_string=False, read_only=True)
     points = serializers.DecimalField(max_digits=6, decimal_places=2, coerce_to_string=False, read_only=True)
@@ -129,8 +131,8 @@ class SRCmeSubSerializer(serializers.ModelSerializer):
 class BRCmeSubSerializer(serializers.ModelSerializer):
     offer = serializers.PrimaryKeyRelatedField(read_only=True)
     credits = serializers.DecimalField(max_digits=5, decimal_places=2, coerce_to_string=False, read_only=True)
-    url = serializers.ReadOnlyField()
-    pageTitle = serializers.ReadOnlyField()
+    url = serializers.ReadOnlyField(source='get_url')
+    pageTitle = serializers.ReadOnlyField(source='get_page_title')
     purpose = serializers.ReadOnlyField()
     planEffect = serializers.ReadOnlyField()
 
@@ -149,8 +151,8 @@ class BRCmeSubSerializer(serializers.ModelSerializer):
 class ExpiredBRCmeSubSerializer(serializers.ModelSerializer):
     offer = serializers.PrimaryKeyRelatedField(read_only=True)
     credits = serializers.DecimalField(max_digits=5, decimal_places=2, coerce_to_string=False, read_only=True)
-    url = serializers.ReadOnlyField()
-    pageTitle = serializers.ReadOnlyField()
+    url = serializers.ReadOnlyField(source='get_url')
+    pageTitle = serializers.ReadOnlyField(source='get_page_title')
     expireDate = serializers.ReadOnlyField()
 
     class Meta:
@@ -164,7 +166,7 @@ class ExpiredBRCmeSubSerializer(serializers.ModelSerializer):
         )
 
 class EntryReadSerializer(serializers.ModelSerializer):
-    user = serializers.IntegerField(source='user.id', read_only=True)
+    user = serializers.IntegerField(source='user_id', read_only=True)
     entryTypeId = serializers.PrimaryKeyRelatedField(source='entryType.id', read_only=True)
     entryType = serializers.StringRelatedField(read_only=True)
     documentUrl = serializers.FileField(source='document', max_length=None, allow_empty_file=True, use_url=True)
@@ -260,8 +262,7 @@ class BRCmeCreateSerializer(serializers.Serializer):
             offer=offer,
             purpose=validated_data.get('purpose'),
             planEffect=validated_data.get('planEffect'),
-            url=offer.url,
-            pageTitle=offer.pageTitle,
+            page_id=offer.page_id,
             credits=offer.credits
         )
         return instance
@@ -386,8 +387,9 @@ class SRCmeFormSerializer(serializers.Serializer):
             else:
                 docName = newDoc.name
             if entry.document:
-                entry.document.delete()
-            entry.document.save(docName.lower(), newDoc)
+                # old file is deleted in the background (see users/documents.py)
+                tombstone_document(entry.document.name)
+            entry.document.save(docName.lower(), newDoc, save=False)
         entry.save()  # updates modified timestamp
         # replace old tags with new tags (wholesale)
         tag_ids = validated_data.get('tags', [])
@@ -397,6 +399,54 @@ class SRCmeFormSerializer(serializers.Serializer):
         instance.save()
         return instance
 
+# One browsing event sent by the plugin (see views.ActivityIngest).
+# dwell defaults to endTime - startTime and is capped at ORBIT_ACTIVITY_MAX_DWELL.
+class ActivityEventSerializer(serializers.Serializer):
+    url = serializers.URLField(max_length=500)
+    pageTitle = serializers.CharField(required=False, allow_blank=True, max_length=500)
+    startTime = serializers.DateTimeField()
+    endTime = serializers.DateTimeField(required=False)
+    dwell = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, data):
+        dwell = data.get('dwell')
+        if dwell is None:
+            if 'endTime' not in data:
+                raise serializers.ValidationError('Either dwell or endTime is required')
+            if data['endTime'] < data['startTime']:
+                raise serializers.ValidationError('endTime must not be before startTime')
+            dwell = int((data['endTime'] - data['startTime']).total_seconds())
+        data['dwell'] = min(dwell, getattr(settings, 'ORBIT_ACTIVITY_MAX_DWELL', 3600))
+        return data
+
+# One offer of a batch redemption (see views.RedeemBrowserCmeBatch).
+# The offer itself is checked by the view (with the offer rows locked).
+class BRCmeBatchItemSerializer(serializers.Serializer):
+    offerId = serializers.IntegerField()
+    description = serializers.CharField(max_length=500)
+    purpose = serializers.IntegerField(min_value=0, max_value=1)
+    planEffect = serializers.IntegerField(min_value=0, max_value=1)
+    tags = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+    def validate_tags(self, value):
+        unknown = set(value) - self.context['tag_ids']
+        if unknown:
+            raise serializers.ValidationError('Invalid tag ids: {0}'.format(sorted(unknown)))
+        return value
+
+# One item of a bulk SRCme import (see views.CreateSRCmeBulk).
+# Same fields and validation as SRCmeFormSerializer, except that tags are
+# validated against context['tag_ids'] (the set of all CmeTag ids), so that
+# validating many items does not query the tags per item.
+class SRCmeBulkItemSerializer(SRCmeFormSerializer):
+    tags = serializers.ListField(child=serializers.IntegerField())
+
+    def validate_tags(self, value):
+        unknown = set(value) - self.context['tag_ids']
+        if unknown:
+            raise serializers.ValidationError('Invalid tag ids: {0}'.format(sorted(unknown)))
+        return value
+
 class PointTransactionSerializer(serializers.ModelSerializer):
     customerId = serializers.UUIDField(source='customer.customerId', format='hex_verbose', read_only=True)
     entry = serializers.PrimaryKeyRelatedField(allow_null=True, read_only=True)
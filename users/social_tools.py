@@ -0,0 +1,48 @@
+"""Cache of verified social access tokens used by login_via_token"""
+import hashlib
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+SOCIAL_TOKEN_KEY = 'social-token:{0}:{1}'
+
+def _key(backend, access_token):
+    digest = hashlib.sha256(access_token.encode('utf-8')).hexdigest()
+    return SOCIAL_TOKEN_KEY.format(backend.name, digest)
+
+def backend_path(backend):
+    """Dotted path of the backend class as listed in AUTHENTICATION_BACKENDS"""
+    return '{0}.{1}'.format(backend.__module__, backend.__class__.__name__)
+
+def get_cached_user(backend, access_token):
+    """
+    Returns the active user previously verified with this social access
+    token, or None. The returned user has the backend attribute set so it
+    can be passed to auth.login.
+    """
+    user_id = cache.get(_key(backend, access_token))
+    if user_id is None:
+        return None
+    user = User.objects.filter(pk=user_id, is_active=True).first()
+    if user is not None:
+        user.backend = backend_path(backend)
+    return user
+
+def cache_verified_user(backend, access_token, user):
+    """
+    Remember that access_token was verified by the provider for user.
+    The entry lives for ORBIT_SOCIAL_TOKEN_CACHE_TTL seconds, or less if the
+    provider reported an earlier expiry for the token.
+    """
+    ttl = getattr(settings, 'ORBIT_SOCIAL_TOKEN_CACHE_TTL', 600)
+    social_user = getattr(user, 'social_user', None)
+    if social_user is not None:
+        expires = social_user.extra_data.get('expires')
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            pass
+        else:
+            if expires > 0:
+                ttl = min(ttl, expires)
+    cache.set(_key(backend, access_token), user.pk, ttl)
@@ -1,3 +1,1026 @@
-from django.test import TestCase
+import collections
+import hashlib
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.utils.six import StringIO
+from oauth2_provider.models import AccessToken, Application, RefreshToken
+import braintree
+from social.apps.django_app import utils as psa_utils
+from common import throttling, tieredcache
+from common.urlnorm import url_hash
+from . import braintree_tools, oauth_tools
+from .backends import LocalOAuth2
+from .documents import purge_batch
+from .feedsync import InvalidSyncToken, decode_token, encode_token, get_changes
+from .refdata import refdata_cache
+from .activity import ClaimConflict, add_events, claim_events, process_activity
+from .authentication import JWTAuthentication, check_jwt_cache, decode_jwt, encode_jwt, token_cache, token_cache_key
+from .jobs import claim, enqueue, heartbeat, requeue_stale, run
+from .models import *
+from .outbox import dispatch_batch, emit, outbox_stats, retry_dead
+from .oauth_tools import new_access_token
+from .pipeline import enqueue_vault_customer
 
-# Create your tests here.
+# the default file-based cache would keep tokens and cached data between runs
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'orbit-tests',
+    }
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ApiTestCase(TestCase):
+    fixtures = ['entrytypes', 'cmetags']
+
+    def setUp(self):
+        cache.clear()
+        throttling.get_cache().clear()
+        for tiered in tieredcache._registry.values():
+            tiered.local.clear()
+            tiered._version = None
+        self.user = User.objects.create(username='member')
+        # the cached application id does not survive the test rollback
+        oauth_tools._application_ids.clear()
+        Application.objects.create(name='orbit', client_type='confidential',
+            authorization_grant_type='password', user=self.user)
+        self.customer = Customer.objects.create(user=self.user, balance=Decimal('100'))
+        token = new_access_token(self.user)['access_token']
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer ' + token
+        self.now = timezone.now()
+
+    def post_json(self, url, data, **extra):
+        return self.client.post(url, json.dumps(data), content_type='application/json', **extra)
+
+
+def patch(test, obj, name, value):
+    """Replace the attribute of a module or class for the duration of the test"""
+    orig = vars(obj)[name]
+    setattr(obj, name, value)
+    test.addCleanup(setattr, obj, name, orig)
+
+
+def use_temp_media_root(test):
+    """Store the uploads of the test in a temporary MEDIA_ROOT"""
+    media_root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, media_root)
+    override = test.settings(MEDIA_ROOT=media_root)
+    override.enable()
+    test.addCleanup(override.disable)
+
+
+class FakeResult(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class IdempotencyTest(ApiTestCase):
+    url = '/api/v1/feed/browser-cme/'
+
+    def setUp(self):
+        super(IdempotencyTest, self).setUp()
+        self.offer = BrowserCmeOffer.objects.create(
+            user=self.user,
+            activityDate=self.now,
+            page=Page.objects.get_for_url('https://radiopaedia.org/articles/x', 'X'),
+            expireDate=self.now + timedelta(days=1),
+            points=Decimal('10'),
+            credits=Decimal('0.5'))
+
+    def body(self, description='read it'):
+        return {'offerId': self.offer.pk, 'description': description, 'purpose': 0, 'planEffect': 0, 'tags': []}
+
+    def test_replay(self):
+        r1 = self.post_json(self.url, self.body(), HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(r1.status_code, 201)
+        r2 = self.post_json(self.url, self.body(), HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(r2.status_code, 201)
+        self.assertEqual(r2['Idempotent-Replayed'], 'true')
+        self.assertEqual(json.loads(r2.content), json.loads(r1.content))
+        self.assertEqual(BrowserCme.objects.count(), 1)
+        self.assertEqual(PointTransaction.objects.count(), 1)
+        self.assertEqual(Customer.objects.get(pk=self.user.pk).balance, Decimal('90'))
+
+    def test_key_reused_for_other_request(self):
+        self.post_json(self.url, self.body(), HTTP_IDEMPOTENCY_KEY='k1')
+        r = self.post_json(self.url, self.body('other'), HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(r.status_code, 422)
+
+    def test_without_key(self):
+        self.post_json(self.url, self.body())
+        r = self.post_json(self.url, self.body())
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(BrowserCme.objects.count(), 1)
+
+
+class BatchRedemptionTest(ApiTestCase):
+    url = '/api/v1/feed/browser-cme-batch/'
+
+    def make_offer(self, user=None, points='10', **kwargs):
+        data = dict(
+            user=user or self.user,
+            activityDate=self.now,
+            page=Page.objects.get_for_url('https://radiopaedia.org/articles/{0}'.format(Page.objects.count()), 'Article'),
+            expireDate=self.now + timedelta(days=1),
+            points=Decimal(points),
+            credits=Decimal('0.5'))
+        data.update(kwargs)
+        return BrowserCmeOffer.objects.create(**data)
+
+    def item(self, offer_id, **kwargs):
+        item = {'offerId': offer_id, 'description': 'd', 'purpose': 0, 'planEffect': 1}
+        item.update(kwargs)
+        return item
+
+    def test_partial_success(self):
+        tag = CmeTag.objects.first()
+        good = [self.make_offer(points='10'), self.make_offer(points='15')]
+        expired = self.make_offer(expireDate=self.now - timedelta(days=1))
+        other = self.make_offer(user=User.objects.create(username='other'))
+        items = [
+            self.item(good[0].pk, tags=[tag.pk]),
+            self.item(expired.pk),
+            self.item(other.pk),
+            self.item(good[1].pk),
+            self.item(good[1].pk),
+            self.item(good[0].pk, purpose=7),
+        ]
+        r = self.post_json(self.url, {'redemptions': items})
+        self.assertEqual(r.status_code, 201)
+        data = json.loads(r.content)
+        self.assertEqual([x['offerId'] for x in data['redeemed']], [good[0].pk, good[1].pk])
+        self.assertEqual([(f['index'], f.get('error')) for f in data['failed']], [
+            (1, 'Offer has already expired'),
+            (2, 'Offer not found'),
+            (4, 'Offer has already been redeemed'),
+            (5, None),
+        ])
+        self.assertIn('purpose', data['failed'][3]['errors'])
+        self.assertEqual(data['balance'], 75)
+        self.assertEqual(Customer.objects.get(pk=self.user.pk).balance, Decimal('75'))
+        self.assertEqual(sorted(PointTransaction.objects.values_list('points', flat=True)),
+            [Decimal('-15'), Decimal('-10')])
+        self.assertEqual(BrowserCmeOffer.objects.filter(redeemed=True).count(), 2)
+        entry = Entry.objects.get(brcme__offer=good[0])
+        self.assertEqual(list(entry.tags.all()), [tag])
+
+    def test_nothing_redeemable(self):
+        offer = self.make_offer(redeemed=True)
+        r = self.post_json(self.url, {'redemptions': [self.item(offer.pk)]})
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(Customer.objects.get(pk=self.user.pk).balance, Decimal('100'))
+        self.assertEqual(PointTransaction.objects.count(), 0)
+
+    def test_invalid_body(self):
+        for body in ([self.item(1)], {'redemptions': []}, {'redemptions': 'x'}):
+            r = self.post_json(self.url, body)
+            self.assertEqual(r.status_code, 400)
+
+
+class CheckoutTest(ApiTestCase):
+    url = '/api/v1/shop/checkout/'
+
+    def setUp(self):
+        super(CheckoutTest, self).setUp()
+        self.ppo = PointPurchaseOption.objects.create(points=Decimal('50'), price=Decimal('9.99'))
+        self.sales = []
+        patch(self, braintree.Transaction, 'sale', staticmethod(self.sale))
+        self.result = FakeResult(is_success=True,
+            transaction=FakeResult(id='tx1', status='submitted_for_settlement'))
+
+    def sale(self, params):
+        self.sales.append(params)
+        return self.result
+
+    def checkout(self):
+        data = {'point-purchase-option-id': self.ppo.pk, 'payment-method-token': 'tok'}
+        return self.post_json(self.url, data, HTTP_IDEMPOTENCY_KEY='buy-1')
+
+    def test_replay(self):
+        r1 = self.checkout()
+        r2 = self.checkout()
+        self.assertEqual((r1.status_code, r2.status_code), (200, 200))
+        self.assertEqual(r2['Idempotent-Replayed'], 'true')
+        self.assertEqual(len(self.sales), 1)
+        self.assertEqual(Customer.objects.get(pk=self.user.pk).balance, Decimal('150'))
+
+    def test_failure_after_sale_keeps_key(self):
+        # the sale succeeds but recording it fails
+        PointTransaction.objects.create(customer=self.customer, points=1, pricePaid=1, transactionId='tx1')
+        with self.assertRaises(IntegrityError):
+            self.checkout()
+        r = self.checkout()
+        self.assertEqual(r.status_code, 500)
+        self.assertEqual(r['Idempotent-Replayed'], 'true')
+        self.assertEqual(len(self.sales), 1)
+
+    def test_declined(self):
+        self.result = FakeResult(is_success=False, transaction=FakeResult(
+            id='tx2',
+            status='processor_declined',
+            processor_response_code='2000',
+            processor_response_text='Do Not Honor',
+            additional_processor_response=''))
+        r = self.checkout()
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(json.loads(r.content)['processor_response_code'], '2000')
+        self.assertEqual(self.checkout()['Idempotent-Replayed'], 'true')
+        self.assertEqual(len(self.sales), 1)
+
+
+class WorkerlessTokenPool(braintree_tools.ClientTokenPool):
+    def _ensure_worker(self):
+        pass
+
+
+class ClientTokenTest(ApiTestCase):
+    def setUp(self):
+        super(ClientTokenTest, self).setUp()
+        self.generated = []
+        patch(self, braintree.ClientToken, 'generate', staticmethod(self.generate))
+
+    def generate(self, params=None):
+        self.generated.append(params)
+        return 'token{0}'.format(len(self.generated))
+
+    def test_pool(self):
+        pool = WorkerlessTokenPool(size=3, ttl=60, refill_interval=60)
+        pool.refill()
+        self.assertEqual(len(pool), 3)
+        self.assertEqual([pool.get(), pool.get()], ['token1', 'token2'])
+        pool.refill()
+        self.assertEqual(len(self.generated), 5)
+        # expired tokens are never handed out
+        pool._tokens = collections.deque((created - 61, token) for created, token in pool._tokens)
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(pool.get(), 'token6')
+
+    def test_customer_token(self):
+        other = Customer.objects.create(user=User.objects.create(username='other'))
+        tokens = [braintree_tools.get_customer_client_token(c) for c in (self.customer, self.customer, other)]
+        self.assertEqual(tokens, ['token1', 'token1', 'token2'])
+        self.assertEqual(self.generated, [
+            {'customer_id': str(self.customer.customerId)},
+            {'customer_id': str(other.customerId)},
+        ])
+        r = self.client.get('/api/v1/shop/client-token/', {'customer': '1'})
+        self.assertEqual(json.loads(r.content), {'token': 'token1'})
+
+
+class PaymentMethodsTest(ApiTestCase):
+    def setUp(self):
+        super(PaymentMethodsTest, self).setUp()
+        self.fetches = []
+        self.methods = [{'token': 'm1'}]
+        patch(self, braintree_tools, 'fetch_payment_methods', self.fetch)
+        # refresh in the foreground
+        patch(self, braintree_tools, '_run_in_background', lambda func, *args: func(*args))
+
+    def fetch(self, customerId):
+        self.fetches.append(customerId)
+        return list(self.methods)
+
+    def age_cached(self, seconds):
+        key = braintree_tools.PAYMENT_METHODS_KEY.format(self.user.pk)
+        value = cache.get(key)
+        value['fetched'] -= seconds
+        cache.set(key, value)
+
+    def test_stale_while_revalidate(self):
+        self.assertEqual(braintree_tools.get_payment_methods(self.user), [{'token': 'm1'}])
+        self.methods.append({'token': 'm2'})
+        self.assertEqual(braintree_tools.get_payment_methods(self.user), [{'token': 'm1'}])
+        self.assertEqual(self.fetches, [self.customer.customerId])
+        # a stale list is returned once more while it is refreshed
+        self.age_cached(61)
+        self.assertEqual(len(braintree_tools.get_payment_methods(self.user)), 1)
+        self.assertEqual(len(braintree_tools.get_payment_methods(self.user)), 2)
+        self.assertEqual(len(self.fetches), 2)
+
+    def test_invalidate(self):
+        braintree_tools.get_payment_methods(self.user)
+        self.methods.append({'token': 'm2'})
+        braintree_tools.invalidate_payment_methods(self.user.pk, self.customer.customerId)
+        r = self.client.get('/api/v1/shop/client-methods/')
+        self.assertEqual(json.loads(r.content), [{'token': 'm1'}, {'token': 'm2'}])
+        self.assertEqual(len(self.fetches), 2)
+
+
+class VaultProvisionTest(ApiTestCase):
+    def setUp(self):
+        super(VaultProvisionTest, self).setUp()
+        self.vault = set()
+        self.creates = []
+        patch(self, braintree.Customer, 'find', staticmethod(self.find))
+        patch(self, braintree.Customer, 'create', staticmethod(self.create))
+
+    def find(self, customer_id):
+        if customer_id not in self.vault:
+            raise braintree.exceptions.not_found_error.NotFoundError()
+
+    def create(self, params):
+        self.creates.append(params['id'])
+        if params['id'] in self.vault:
+            return FakeResult(is_success=False, message='Customer ID has already been taken.')
+        self.vault.add(params['id'])
+        return FakeResult(is_success=True)
+
+    def test_one_job_per_user(self):
+        enqueue_vault_customer(self.user.pk, check_exists=False)
+        enqueue_vault_customer(self.user.pk, check_exists=True)
+        self.assertEqual(Job.objects.count(), 1)
+        self.assertTrue(run(Job.objects.get()))
+        self.assertTrue(Customer.objects.get(pk=self.user.pk).vaultCreated)
+        # a finished job does not prevent a new one
+        enqueue_vault_customer(self.user.pk, check_exists=True)
+        self.assertEqual(Job.objects.count(), 2)
+
+    def test_retry_of_create_that_succeeded(self):
+        # the first create timed out after the customer was created
+        self.vault.add(str(self.customer.customerId))
+        braintree_tools.provision_vault_customer(self.user.pk, check_exists=False)
+        self.assertEqual(len(self.creates), 1)
+        self.assertTrue(Customer.objects.get(pk=self.user.pk).vaultCreated)
+
+
+@override_settings(ORBIT_SYNC_SETTLE_SECONDS=0)
+class FeedSyncTest(ApiTestCase):
+    def make_entries(self, num):
+        etype = EntryType.objects.get(name=ENTRYTYPE_SRCME)
+        entries = [Entry.objects.create(user=self.user, entryType=etype, activityDate=self.now, description=str(i))
+            for i in range(num)]
+        for entry in entries:
+            SRCme.objects.create(entry=entry, credits=Decimal('1'))
+        # distinct modified times in the past, in creation order
+        for i, entry in enumerate(entries):
+            Entry.objects.filter(pk=entry.pk).update(modified=self.now - timedelta(minutes=num-i))
+        return entries
+
+    def test_token_round_trip(self):
+        modified = timezone.now()
+        self.assertEqual(decode_token(encode_token(modified, 42)), (modified, 42))
+        for token in ('', 'not-a-token', encode_token(modified, 1)[:-4]):
+            with self.assertRaises(InvalidSyncToken):
+                decode_token(token)
+
+    def test_pages(self):
+        entries = self.make_entries(5)
+        pages = []
+        token = None
+        while True:
+            changes = get_changes(self.user, token, limit=2)
+            pages.append([e.pk for e in changes['entries']])
+            token = changes['syncToken']
+            if not changes['more']:
+                break
+        self.assertEqual(pages, [[e.pk for e in entries[0:2]], [e.pk for e in entries[2:4]], [entries[4].pk]])
+        # nothing changed since the last token
+        changes = get_changes(self.user, token, limit=2)
+        self.assertEqual((changes['entries'], changes['deleted'], changes['more']), ([], [], False))
+
+    def test_deleted_and_invalidated(self):
+        entries = self.make_entries(3)
+        token = get_changes(self.user, None, limit=10)['syncToken']
+        entries[0].valid = False
+        entries[0].save()
+        r = self.client.delete('/api/v1/feed/{0}/'.format(entries[1].pk))
+        self.assertEqual(r.status_code, 204)
+        changes = get_changes(self.user, token, limit=10)
+        self.assertEqual(changes['entries'], [])
+        self.assertEqual(sorted(changes['deleted']), [entries[0].pk, entries[1].pk])
+
+    def test_unchanged_feed_advances(self):
+        entry = self.make_entries(1)[0]
+        Entry.objects.filter(pk=entry.pk).update(modified=self.now - timedelta(days=2))
+        token = encode_token(self.now - timedelta(hours=20), entry.pk)
+        with self.settings(ORBIT_SYNC_TOMBSTONE_TTL=86400):
+            changes = get_changes(self.user, token)
+            self.assertEqual((changes['entries'], changes['reset']), ([], False))
+            # the next sync, even a day later, is within the TTL
+            modified, pk = decode_token(changes['syncToken'])
+            self.assertGreater(modified, self.now - timedelta(minutes=1))
+
+    def test_old_token_resets(self):
+        token = encode_token(self.now - timedelta(days=365), 1)
+        with self.settings(ORBIT_SYNC_TOMBSTONE_TTL=86400):
+            self.assertTrue(get_changes(self.user, token)['reset'])
+
+    def test_api(self):
+        self.make_entries(3)
+        r = self.client.get('/api/v1/feed/sync/', {'limit': 2})
+        data = json.loads(r.content)
+        self.assertEqual((r.status_code, len(data['entries']), data['more']), (200, 2, True))
+        r = self.client.get('/api/v1/feed/sync/', {'token': 'bogus'})
+        self.assertEqual(r.status_code, 400)
+
+
+class TokenRotationTest(ApiTestCase):
+    def test_rotate_and_reuse(self):
+        old = oauth_tools.get_access_token(self.user)
+        token = new_access_token(self.user)
+        self.assertNotEqual(token['access_token'], old['access_token'])
+        self.assertEqual(list(AccessToken.objects.values_list('token', flat=True)), [token['access_token']])
+        self.assertEqual(RefreshToken.objects.get().token, token['refresh_token'])
+        self.assertEqual(new_access_token(self.user, reuse=True)['access_token'], token['access_token'])
+
+
+class TokenCacheTest(ApiTestCase):
+    url = '/api/v1/degrees/'
+
+    def test_cached(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        with self.assertNumQueries(0):
+            # the token and the degree list are cached
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_invalidated_by_rotation(self):
+        self.client.get(self.url)
+        new_access_token(self.user)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_expiry(self):
+        self.client.get(self.url)
+        token = self.client.defaults['HTTP_AUTHORIZATION'].split()[1]
+        AccessToken.objects.filter(token=token).update(expires=self.now - timedelta(seconds=1))
+        cached = token_cache.get(token_cache_key(token))
+        cached.expires = self.now - timedelta(seconds=1)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_deactivated_user(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+@override_settings(ORBIT_TOKEN_MODE='jwt')
+class SignedTokenTest(ApiTestCase):
+    url = '/api/v1/degrees/'
+
+    def test_issue_and_verify(self):
+        token = self.client.defaults['HTTP_AUTHORIZATION'].split()[1]
+        self.assertEqual(token.count('.'), 2)
+        self.assertEqual(AccessToken.objects.count(), 0)
+        request = RequestFactory().get(self.url, HTTP_AUTHORIZATION='Bearer ' + token)
+        with self.assertNumQueries(0):
+            user, auth = JWTAuthentication().authenticate(request)
+        self.assertEqual((user.pk, user.username, user.is_active), (self.user.pk, 'member', True))
+        self.assertTrue(auth.is_valid(['read', 'write']))
+        with self.assertRaises(TypeError):
+            user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_expired(self):
+        claims = decode_jwt(self.client.defaults['HTTP_AUTHORIZATION'].split()[1])
+        claims['exp'] = claims['iat'] - 1
+        r = self.client.get(self.url, HTTP_AUTHORIZATION='Bearer ' + encode_jwt(claims))
+        self.assertEqual(r.status_code, 401)
+        self.assertEqual(json.loads(r.content)['detail'], 'Token has expired')
+
+    def test_logout_revokes_token(self):
+        other = new_access_token(self.user)['access_token']
+        self.assertEqual(self.client.get('/api/v1/auth/logout/').status_code, 200)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+        # only the presented token is revoked
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Bearer ' + other).status_code, 200)
+
+    def test_deactivated_user(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+        # a token issued to an inactive user
+        claims = decode_jwt(self.client.defaults['HTTP_AUTHORIZATION'].split()[1])
+        claims['active'] = False
+        r = self.client.get(self.url, HTTP_AUTHORIZATION='Bearer ' + encode_jwt(claims))
+        self.assertEqual(json.loads(r.content)['detail'], 'User inactive or deleted')
+
+    def test_cache_check(self):
+        with self.settings(DEBUG=False):
+            self.assertEqual([e.id for e in check_jwt_cache(None)], ['orbit.E002'])
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'cache'}}):
+            self.assertEqual(check_jwt_cache(None), [])
+
+
+class LogoutTest(ApiTestCase):
+    def test_deletes_presented_token(self):
+        self.assertEqual(self.client.get('/api/v1/auth/logout/').status_code, 200)
+        self.assertEqual(AccessToken.objects.count(), 0)
+        self.assertEqual(self.client.get('/api/v1/degrees/').status_code, 401)
+
+
+@override_settings(AUTHENTICATION_BACKENDS=settings.AUTHENTICATION_BACKENDS + ('users.backends.LocalOAuth2',))
+class SocialLoginTest(ApiTestCase):
+    def setUp(self):
+        super(SocialLoginTest, self).setUp()
+        del self.client.defaults['HTTP_AUTHORIZATION']
+        patch(self, psa_utils, 'BACKENDS', settings.AUTHENTICATION_BACKENDS)
+        self.verified = []
+        user_data = LocalOAuth2.user_data
+        def verify(backend, access_token, *args, **kwargs):
+            self.verified.append(access_token)
+            return user_data(backend, access_token, *args, **kwargs)
+        patch(self, LocalOAuth2, 'user_data', verify)
+
+    def login(self, social_token):
+        r = self.client.get('/api/v1/auth/login/local/{0}/'.format(social_token))
+        self.assertEqual(r.status_code, 200)
+        return json.loads(r.content)
+
+    def test_cache_hit_and_miss(self):
+        first = self.login('fb-token-1')
+        again = self.login('fb-token-1')
+        self.assertEqual(again['user'], first['user'])
+        self.assertNotEqual(again['token']['access_token'], first['token']['access_token'])
+        self.assertEqual(self.verified, ['fb-token-1'])
+        other = self.login('fb-token-2')
+        self.assertNotEqual(other['user']['id'], first['user']['id'])
+        self.assertEqual(self.verified, ['fb-token-1', 'fb-token-2'])
+
+    def test_inactive_user_is_verified_again(self):
+        user_id = self.login('fb-token-1')['user']['id']
+        User.objects.filter(pk=user_id).update(is_active=False)
+        self.client.get('/api/v1/auth/login/local/fb-token-1/')
+        self.assertEqual(self.verified, ['fb-token-1', 'fb-token-1'])
+
+
+class MissingCustomerTest(ApiTestCase):
+    def test_no_customer(self):
+        self.customer.delete()
+        r = self.client.get('/api/v1/shop/client-token/', {'customer': '1'})
+        self.assertEqual(r.status_code, 400)
+        ppo = PointPurchaseOption.objects.create(points=Decimal('50'), price=Decimal('9.99'))
+        r = self.post_json('/api/v1/shop/checkout/', {'point-purchase-option-id': ppo.pk, 'payment-method-token': 'tok'})
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(json.loads(r.content)['error_message'], 'Local customer object not found for user')
+        self.assertEqual(self.client.get('/api/v1/auth/status/').status_code, 400)
+
+    def test_vault_customer_pending(self):
+        def generate(params=None):
+            raise ValueError('Customer specified by customer_id does not exist')
+        patch(self, braintree.ClientToken, 'generate', staticmethod(generate))
+        r = self.client.get('/api/v1/shop/client-token/', {'customer': '1'})
+        self.assertEqual(r.status_code, 409)
+
+
+delivered = []
+
+def failing_consumer(events):
+    raise RuntimeError('consumer down')
+
+def recording_consumer(events):
+    delivered.extend(event.pk for event in events)
+
+
+@override_settings(ORBIT_OUTBOX_MAX_ATTEMPTS=2, ORBIT_OUTBOX_RETRY_BACKOFF=10,
+    ORBIT_OUTBOX_CONSUMERS={'test': ['users.tests.failing_consumer']})
+class OutboxTest(TestCase):
+    def setUp(self):
+        del delivered[:]
+        self.event = emit('test', n=1)
+
+    def test_backoff(self):
+        self.assertEqual(dispatch_batch(), (0, 1))
+        event = OutboxEvent.objects.get(pk=self.event.pk)
+        self.assertEqual(event.attempts, 1)
+        self.assertEqual(event.lastError, 'consumer down')
+        self.assertGreater(event.nextAttempt, timezone.now() + timedelta(seconds=9))
+        # not due yet
+        self.assertEqual(dispatch_batch(), (0, 0))
+        OutboxEvent.objects.filter(pk=event.pk).update(nextAttempt=timezone.now())
+        self.assertEqual(dispatch_batch(), (0, 1))
+        event = OutboxEvent.objects.get(pk=event.pk)
+        # doubled after the second attempt
+        self.assertGreater(event.nextAttempt, timezone.now() + timedelta(seconds=19))
+
+    def test_dead(self):
+        OutboxEvent.objects.filter(pk=self.event.pk).update(attempts=1)
+        self.assertEqual(dispatch_batch(), (0, 1))
+        OutboxEvent.objects.filter(pk=self.event.pk).update(nextAttempt=timezone.now())
+        self.assertEqual(dispatch_batch(), (0, 0))
+        self.assertEqual(outbox_stats()['dead'], 1)
+        self.assertEqual(outbox_stats()['pending'], 0)
+        with self.settings(ORBIT_OUTBOX_CONSUMERS={'test': ['users.tests.recording_consumer']}):
+            self.assertEqual(retry_dead(), 1)
+            self.assertEqual(dispatch_batch(), (1, 0))
+        self.assertEqual(delivered, [self.event.pk])
+        self.assertEqual(outbox_stats()['dead'], 0)
+
+
+def noop_task():
+    pass
+
+
+@override_settings(ORBIT_JOB_LEASE=60)
+class RequeueStaleTest(TestCase):
+    def setUp(self):
+        self.job = enqueue(noop_task, max_attempts=2)
+        claim('w1', 1)
+
+    def expire_lease(self):
+        Job.objects.filter(pk=self.job.pk).update(heartbeat=timezone.now() - timedelta(seconds=61))
+
+    def test_running_job_kept(self):
+        self.assertEqual(requeue_stale(), 0)
+        self.expire_lease()
+        # the worker renews its lease before requeue_stale runs
+        self.assertEqual(heartbeat('w1'), 1)
+        self.assertEqual(requeue_stale(), 0)
+        self.assertEqual(Job.objects.get(pk=self.job.pk).state, Job.STATE_RUNNING)
+
+    def test_expired_lease(self):
+        self.expire_lease()
+        self.assertEqual(requeue_stale(), 1)
+        job = Job.objects.get(pk=self.job.pk)
+        self.assertEqual((job.state, job.attempts, job.lockedBy), (Job.STATE_QUEUED, 1, ''))
+        self.assertGreater(job.runAt, timezone.now())
+        # the second lost attempt is the last one
+        Job.objects.filter(pk=job.pk).update(runAt=timezone.now())
+        self.assertEqual(len(claim('w2', 1)), 1)
+        self.expire_lease()
+        self.assertEqual(requeue_stale(), 0)
+        job = Job.objects.get(pk=job.pk)
+        self.assertEqual((job.state, job.attempts), (Job.STATE_FAILED, 2))
+        self.assertEqual(OutboxEvent.objects.filter(topic='job.failed').count(), 1)
+
+
+class DocumentGcTest(ApiTestCase):
+    def setUp(self):
+        super(DocumentGcTest, self).setUp()
+        use_temp_media_root(self)
+
+    def make_entry(self, filename):
+        entry = Entry.objects.create(user=self.user, activityDate=self.now, description='doc',
+            entryType=EntryType.objects.get(name=ENTRYTYPE_SRCME))
+        SRCme.objects.create(entry=entry, credits=Decimal('1'))
+        entry.document.save(filename, ContentFile(b'%PDF'))
+        return entry
+
+    def test_delete_entry(self):
+        entry = self.make_entry('a.pdf')
+        name = entry.document.name
+        r = self.client.delete('/api/v1/feed/{0}/'.format(entry.pk))
+        self.assertEqual(r.status_code, 204)
+        # the file outlives the request
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(list(DocumentTombstone.objects.values_list('name', flat=True)), [name])
+        self.assertEqual(purge_batch(), (1, 0))
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(DocumentTombstone.objects.exists())
+
+    def test_referenced_again(self):
+        entry = self.make_entry('b.pdf')
+        DocumentTombstone.objects.create(name=entry.document.name)
+        self.assertEqual(purge_batch(), (1, 0))
+        self.assertTrue(default_storage.exists(entry.document.name))
+
+    def test_gc_documents(self):
+        entry = self.make_entry('c.pdf')
+        orphan = default_storage.save('entries/sub/orphan.pdf', ContentFile(b'%PDF'))
+        call_command('gc_documents', min_age=0, max_rate=0, stdout=StringIO())
+        self.assertTrue(default_storage.exists(entry.document.name))
+        self.assertFalse(default_storage.exists(orphan))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RefdataInvalidationTest(TransactionTestCase):
+    def test_on_commit(self):
+        before = refdata_cache.invalidations
+        with transaction.atomic():
+            Degree.objects.create(abbrev='XD', name='Test degree')
+            self.assertEqual(refdata_cache.invalidations, before)
+        self.assertEqual(refdata_cache.invalidations, before + 1)
+
+
+class ConditionalGetTest(ApiTestCase):
+    def make_entry(self):
+        entry = Entry.objects.create(user=self.user, activityDate=self.now, description='x',
+            entryType=EntryType.objects.get(name=ENTRYTYPE_SRCME))
+        SRCme.objects.create(entry=entry, credits=Decimal('1'))
+        return entry
+
+    def test_feed(self):
+        entry = self.make_entry()
+        r = self.client.get('/api/v1/feed/')
+        self.assertEqual(r.status_code, 200)
+        etag = r['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertEqual(r['Cache-Control'], 'private, no-cache')
+        r = self.client.get('/api/v1/feed/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((r.status_code, r.content, r['ETag']), (304, b'', etag))
+        # a deleted entry changes the version
+        Entry.objects.filter(pk=entry.pk).delete()
+        r = self.client.get('/api/v1/feed/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r['ETag'], etag)
+        etag = r['ETag']
+        self.make_entry()
+        r = self.client.get('/api/v1/feed/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+
+    def test_object(self):
+        url = '/api/v1/accounts/{0}/'.format(self.customer.pk)
+        r = self.client.get(url)
+        self.assertEqual(r.status_code, 200)
+        r = self.client.get(url, HTTP_IF_MODIFIED_SINCE=r['Last-Modified'])
+        self.assertEqual(r.status_code, 304)
+        r = self.client.get(url, HTTP_IF_NONE_MATCH='W/"other"')
+        self.assertEqual(r.status_code, 200)
+        r = self.client.get(url, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r.status_code, 304)
+
+
+class ProfileSearchTest(ApiTestCase):
+    def setUp(self):
+        super(ProfileSearchTest, self).setUp()
+        self.md = Degree.objects.create(abbrev='MD', name='Doctor of Medicine')
+        self.do = Degree.objects.create(abbrev='DO', name='Doctor of Osteopathy')
+        self.radiology = PracticeSpecialty.objects.create(name='Radiology')
+        self.profiles = []
+        for i, (first, last, npi) in enumerate((('Ann', 'Smith', '111'), ('Bob', 'Smithers', '222'), ('Ann', 'Jones', ''))):
+            user = User.objects.create(username='p{0}'.format(i))
+            self.profiles.append(Profile.objects.create(user=user, firstName=first, lastName=last,
+                npiNumber=npi, inviteId='invite{0}'.format(i)))
+        self.profiles[0].degrees.add(self.md)
+        self.profiles[1].degrees.add(self.md, self.do)
+        self.profiles[2].degrees.add(self.do)
+        self.profiles[2].specialties.add(self.radiology)
+
+    def search(self, **params):
+        r = self.client.get('/api/v1/profiles/', params)
+        self.assertEqual(r.status_code, 200)
+        return [p['id'] for p in json.loads(r.content)['results']]
+
+    def ids(self, *indexes):
+        return [self.profiles[i].pk for i in indexes]
+
+    def test_name(self):
+        self.assertEqual(self.search(name='smith'), self.ids(0, 1))
+        self.assertEqual(self.search(name='an smithe'), [])
+        self.assertEqual(self.search(name='bo smith'), self.ids(1))
+
+    def test_npi(self):
+        self.assertEqual(self.search(npi='222'), self.ids(1))
+
+    def test_m2m(self):
+        # a profile with both degrees is listed once
+        self.assertEqual(self.search(degree='{0},{1}'.format(self.md.pk, self.do.pk)), self.ids(2, 0, 1))
+        self.assertEqual(self.search(degree=self.do.pk, specialty=self.radiology.pk), self.ids(2))
+        r = self.client.get('/api/v1/profiles/', {'degree': 'md'})
+        self.assertEqual(r.status_code, 400)
+
+    def test_query_count(self):
+        # the first request caches the token
+        self.search(name='smith')
+        # count, page, and one prefetch per m2m relation
+        with self.assertNumQueries(5):
+            self.search(name='smith')
+
+
+class SRCmeBulkTest(ApiTestCase):
+    url = '/api/v1/feed/cme-bulk/'
+
+    def setUp(self):
+        super(SRCmeBulkTest, self).setUp()
+        use_temp_media_root(self)
+        self.tag = CmeTag.objects.first()
+
+    def item(self, **kwargs):
+        item = {'activityDate': '2017-01-10T12:00:00Z', 'description': 'article', 'credits': 1.5, 'tags': [self.tag.pk]}
+        item.update(kwargs)
+        return item
+
+    def test_json(self):
+        r = self.post_json(self.url, {'entries': [self.item(), self.item(tags=[])]}, HTTP_IDEMPOTENCY_KEY='b1')
+        self.assertEqual(r.status_code, 201)
+        ids = [e['id'] for e in json.loads(r.content)['entries']]
+        self.assertEqual(SRCme.objects.filter(entry__user=self.user).count(), 2)
+        self.assertEqual(SRCme.objects.get(pk=ids[0]).credits, Decimal('1.5'))
+        self.assertEqual(list(Entry.objects.get(pk=ids[0]).tags.all()), [self.tag])
+        self.assertEqual(OutboxEvent.objects.filter(topic='srcme.created').count(), 2)
+
+    def test_invalid_items(self):
+        items = [self.item(), self.item(tags=[0]), self.item(credits=1000), self.item()]
+        del items[3]['tags']
+        r = self.post_json(self.url, {'entries': items}, HTTP_IDEMPOTENCY_KEY='b2')
+        self.assertEqual(r.status_code, 400)
+        errors = dict((e['index'], sorted(e['errors'])) for e in json.loads(r.content)['errors'])
+        self.assertEqual(errors, {1: ['tags'], 2: ['credits'], 3: ['tags']})
+        self.assertFalse(Entry.objects.exists())
+
+    def test_documents(self):
+        content = b'%PDF-1.4 bulk'
+        md5 = hashlib.md5(content).hexdigest()
+        entries = [self.item(document='doc1', fileMd5=md5), self.item()]
+        r = self.client.post(self.url, {
+            'entries': json.dumps(entries),
+            'doc1': SimpleUploadedFile('Paper.PDF', content)
+        }, HTTP_IDEMPOTENCY_KEY='b3')
+        self.assertEqual(r.status_code, 201)
+        entry = Entry.objects.get(pk=json.loads(r.content)['entries'][0]['id'])
+        self.assertEqual(entry.document.name, 'entries/{0}.pdf'.format(md5))
+        self.assertTrue(default_storage.exists(entry.document.name))
+        # a wrong md5 rejects the request
+        entries[0]['fileMd5'] = '0' * 32
+        r = self.client.post(self.url, {
+            'entries': json.dumps(entries),
+            'doc1': SimpleUploadedFile('paper.pdf', content)
+        }, HTTP_IDEMPOTENCY_KEY='b4')
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(Entry.objects.count(), 2)
+
+
+class PageTest(TestCase):
+    def test_get_for_url(self):
+        page = Page.objects.get_for_url('https://Radiopaedia.org/articles/x#top', 'First')
+        same = Page.objects.get_for_url('https://radiopaedia.org/articles/x', 'Second')
+        self.assertEqual(same.pk, page.pk)
+        # the url and title as first seen are kept
+        self.assertEqual((same.url, same.title), ('https://Radiopaedia.org/articles/x#top', 'First'))
+
+    def test_get_for_urls(self):
+        existing = Page.objects.get_for_url('https://radiopaedia.org/articles/a', 'A')
+        found = Page.objects.get_for_urls({
+            'https://radiopaedia.org/articles/a': 'New title',
+            'https://radiopaedia.org/articles/b': 'B',
+            'https://Radiopaedia.org/articles/b#top': '',
+        })
+        self.assertEqual(found[existing.urlHash], existing.pk)
+        self.assertEqual(Page.objects.get(pk=existing.pk).title, 'A')
+        self.assertEqual(Page.objects.get(pk=found[url_hash('https://radiopaedia.org/articles/b')]).title, 'B')
+        self.assertEqual(Page.objects.count(), 2)
+
+    def test_get_for_urls_race(self):
+        # another request inserts page c after the lookup of existing pages
+        concurrent = Page.objects.get_for_url('https://radiopaedia.org/articles/c', 'Concurrent')
+        lookups = []
+        def racing_filter(**kwargs):
+            lookups.append(kwargs)
+            if len(lookups) == 1:
+                return Page.objects.none()
+            return Page.objects.get_queryset().filter(**kwargs)
+        Page.objects.filter = racing_filter
+        self.addCleanup(delattr, Page.objects, 'filter')
+        urls = {'https://radiopaedia.org/articles/c': 'C', 'https://radiopaedia.org/articles/d': 'D'}
+        with transaction.atomic():
+            found = Page.objects.get_for_urls(urls)
+        self.assertEqual(found[concurrent.urlHash], concurrent.pk)
+        self.assertEqual(Page.objects.get(pk=found[url_hash('https://radiopaedia.org/articles/d')]).title, 'D')
+        self.assertEqual(Page.objects.count(), 2)
+
+
+@override_settings(ORBIT_OFFER_MIN_DWELL=120, ORBIT_OFFER_MIN_VISITS=1)
+class ActivityTest(ApiTestCase):
+    def event(self, url='https://radiopaedia.org/articles/x', dwell=60):
+        return {'url': url, 'pageTitle': 'X', 'startTime': self.now, 'dwell': dwell}
+
+    def test_ingest(self):
+        events = [
+            {'url': 'https://radiopaedia.org/articles/x', 'startTime': '2017-01-10T12:00:00Z', 'endTime': '2017-01-10T12:03:00Z'},
+            {'url': 'not a url', 'startTime': '2017-01-10T12:00:00Z', 'dwell': 10},
+            {'url': 'https://radiopaedia.org/articles/y', 'startTime': '2017-01-10T12:00:00Z'},
+        ]
+        r = self.post_json('/api/v1/activity/', {'events': events}, HTTP_IDEMPOTENCY_KEY='a1')
+        self.assertEqual(r.status_code, 202)
+        data = json.loads(r.content)
+        self.assertEqual((data['accepted'], [x['index'] for x in data['rejected']]), (1, [1, 2]))
+        self.assertEqual(list(ActivityEvent.objects.values_list('user', 'dwell')), [(self.user.pk, 180)])
+        r = self.post_json('/api/v1/activity/', {'events': []}, HTTP_IDEMPOTENCY_KEY='a2')
+        self.assertEqual(r.status_code, 400)
+
+    def test_process(self):
+        add_events(self.user, [self.event(), self.event('https://Radiopaedia.org/articles/x#a'),
+            self.event('https://radiopaedia.org/articles/y')])
+        self.assertEqual(process_activity(batch_size=2), (3, 1))
+        self.assertFalse(ActivityEvent.objects.exists())
+        x = PageActivity.objects.get(page__urlHash=url_hash('https://radiopaedia.org/articles/x'))
+        self.assertEqual((x.visits, x.dwell), (2, 120))
+        self.assertIsNotNone(x.offered)
+        # the second visit of y is due, x is not offered again
+        add_events(self.user, [self.event('https://radiopaedia.org/articles/y'), self.event()])
+        self.assertEqual(process_activity(), (2, 1))
+        self.assertEqual(BrowserCmeOffer.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(PageActivity.objects.get(pk=x.pk).visits, 3)
+
+    def test_claim_conflict(self):
+        add_events(self.user, [self.event(dwell=100), self.event(dwell=50), self.event(dwell=10)])
+        first = ActivityEvent.objects.order_by('pk').first()
+        calls = []
+        def racing_filter(**kwargs):
+            # a concurrent run claims the first event after this run read it
+            calls.append(kwargs)
+            if len(calls) == 1:
+                ActivityEvent.objects.get_queryset().filter(pk=first.pk).delete()
+            return ActivityEvent.objects.get_queryset().filter(**kwargs)
+        ActivityEvent.objects.filter = racing_filter
+        try:
+            with self.assertRaises(ClaimConflict):
+                with transaction.atomic():
+                    claim_events(10)
+        finally:
+            del ActivityEvent.objects.filter
+        # the batch was rolled back (here with the simulated concurrent delete)
+        self.assertEqual(ActivityEvent.objects.count(), 3)
+        self.assertFalse(PageActivity.objects.exists())
+
+
+class LargeTableAdminTest(TestCase):
+    fixtures = ['entrytypes']
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.org', 'pw')
+        self.client.force_login(self.admin)
+        self.member = User.objects.create(username='member')
+        etype = EntryType.objects.get(name=ENTRYTYPE_SRCME)
+        self.new, self.old = [Entry.objects.create(user=self.member, entryType=etype,
+            activityDate=timezone.now(), description=d) for d in ('new', 'old')]
+        Entry.objects.filter(pk=self.old.pk).update(created=timezone.now().replace(year=2015, month=6, day=1))
+
+    def changelist(self, url, **params):
+        r = self.client.get(url, params)
+        self.assertEqual(r.status_code, 200)
+        return r.context['cl']
+
+    def test_created_filter(self):
+        url = '/admin/users/entry/'
+        cl = self.changelist(url)
+        self.assertEqual(cl.result_count, 2)
+        choices = [c['display'] for c in cl.filter_specs[-1].choices(cl)]
+        self.assertIn('2015', choices)
+        self.assertIn(str(timezone.localtime(timezone.now()).year), choices)
+        self.assertEqual([e.pk for e in self.changelist(url, created_range='2015').result_list], [self.old.pk])
+        self.assertEqual([e.pk for e in self.changelist(url, created_range='7d').result_list], [self.new.pk])
+        # an invalid value does not filter
+        self.assertEqual(self.changelist(url, created_range='bogus').result_count, 2)
+
+    def test_exact_search(self):
+        Customer.objects.create(user=self.member)
+        url = '/admin/users/customer/'
+        self.assertEqual(self.changelist(url, q='member').result_count, 1)
+        self.assertEqual(self.changelist(url, q='membe').result_count, 0)
+        customer = Customer.objects.get(user=self.member)
+        self.assertEqual(self.changelist(url, q=str(customer.customerId)).result_count, 1)
+
+
+class ArchiveTest(ApiTestCase):
+    def make_entry(self, description, valid=False):
+        entry = Entry.objects.create(user=self.user, activityDate=self.now, description=description, valid=valid,
+            entryType=EntryType.objects.get(name=ENTRYTYPE_SRCME))
+        SRCme.objects.create(entry=entry, credits=Decimal('1.5'))
+        Entry.objects.filter(pk=entry.pk).update(modified=self.now - timedelta(days=2))
+        return entry
+
+    def lookup(self, kind, pk):
+        return self.client.get('/api/v1/archive/{0}/{1}/'.format(kind, pk))
+
+    def test_entries(self):
+        tag = CmeTag.objects.first()
+        archived = self.make_entry('archived')
+        archived.tags.add(tag)
+        live = self.make_entry('live', valid=True)
+        paid = self.make_entry('paid')
+        PointTransaction.objects.create(customer=self.customer, entry=paid, points=Decimal('1'),
+            pricePaid=Decimal('0'), transactionId='t1')
+        other = self.make_entry('other')
+        Entry.objects.filter(pk=other.pk).update(user=User.objects.create(username='other'))
+        call_command('archive_data', entry_days=1, offer_days=1, max_rate=0, stdout=StringIO())
+        self.assertEqual(list(Entry.objects.order_by('pk').values_list('pk', flat=True)), [live.pk, paid.pk])
+        r = self.lookup('entries', archived.pk)
+        self.assertEqual(r.status_code, 200)
+        data = json.loads(r.content)
+        self.assertIsNotNone(data['archived'])
+        self.assertEqual(data['data']['entry']['description'], 'archived')
+        self.assertEqual((data['data']['srcme']['credits'], data['data']['tags']), ('1.50', [tag.pk]))
+        # the live row is read through, in the same format
+        data = json.loads(self.lookup('entries', live.pk).content)
+        self.assertIsNone(data['archived'])
+        self.assertEqual(data['data']['srcme']['credits'], '1.50')
+        # the entry of another user is not found
+        self.assertEqual(ArchivedRecord.objects.filter(objectId=other.pk).count(), 1)
+        self.assertEqual(self.lookup('entries', other.pk).status_code, 404)
+        self.assertEqual(self.lookup('entries', 0).status_code, 404)
+
+    def test_offers(self):
+        page = Page.objects.get_for_url('https://radiopaedia.org/articles/x', 'X')
+        expired, live = [BrowserCmeOffer.objects.create(user=self.user, activityDate=self.now, page=page,
+            expireDate=expireDate, points=Decimal('10'), credits=Decimal('0.5'))
+            for expireDate in (self.now - timedelta(days=2), self.now + timedelta(days=1))]
+        call_command('archive_data', entry_days=1, offer_days=1, max_rate=0, stdout=StringIO())
+        self.assertEqual(list(BrowserCmeOffer.objects.values_list('pk', flat=True)), [live.pk])
+        data = json.loads(self.lookup('offers', expired.pk).content)
+        self.assertIsNotNone(data['archived'])
+        self.assertEqual((data['data']['offer']['url'], data['data']['offer']['pageTitle']), (page.url, 'X'))
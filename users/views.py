@@ -1,24 +1,41 @@
 from decimal import Decimal
 import json
+import os
 from pprint import pprint
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
 from django.db import transaction
+from django.db.models import Count, Max
 from django.http import QueryDict
 from django.utils import timezone
-from rest_framework import generics, permissions, status
+from rest_framework import exceptions, generics, permissions, status
 from rest_framework.pagination import PageNumberPagination
-from rest_framework.parsers import FormParser,MultiPartParser
+from rest_framework.parsers import FormParser,JSONParser,MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from oauth2_provider.ext.rest_framework import TokenHasReadWriteScope, TokenHasScope
+from common.conditional import ConditionalGetMixin, ObjectConditionalGetMixin
+from common.dbrouter import ReplicaReadMixin
+from common.throttling import throttle_stats
+from common.tieredcache import cache_stats
 from common.viewutils import  newUuid
 # app
 from .models import *
 from .serializers import *
 from .permissions import *
+from .identity import get_identity
+from .idempotency import idempotent
+from .documents import tombstone_document
+from .feedsync import get_changes, InvalidSyncToken
+from .jobs import queue_stats
+from .activity import add_events
+from .archive import find_entry, find_offer
+from .refdata import CachedListMixin
+from .outbox import outbox_stats, emit, emit_many, TOPIC_BALANCE_CHANGED, TOPIC_BRCME_REDEEMED, TOPIC_SRCME_CREATED, TOPIC_ENTRY_DELETED
 
 # Degree
-class DegreeList(generics.ListCreateAPIView):
+class DegreeList(CachedListMixin, generics.ListCreateAPIView):
     queryset = Degree.objects.all().order_by('abbrev')
     serializer_class = DegreeSerializer
     permission_classes = [IsAdminOrAuthenticated, TokenHasReadWriteScope]
@@ -29,7 +46,7 @@ class DegreeDetail(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAdminOrAuthenticated, TokenHasReadWriteScope]
 
 # PracticeSpecialty
-class PracticeSpecialtyList(generics.ListCreateAPIView):
+class PracticeSpecialtyList(CachedListMixin, generics.ListCreateAPIView):
     queryset = PracticeSpecialty.objects.all().order_by('name')
     serializer_class = PracticeSpecialtySerializer
     permission_classes = [IsAdminOrAuthenticated, TokenHasReadWriteScope]
@@ -40,7 +57,7 @@ class PracticeSpecialtyDetail(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAdminOrAuthenticated, TokenHasReadWriteScope]
 
 # CmeTag
-class CmeTagList(generics.ListCreateAPIView):
+class CmeTagList(CachedListMixin, generics.ListCreateAPIView):
     queryset = CmeTag.objects.all().order_by('name')
     serializer_class = CmeTagSerializer
     permission_classes = [IsAdminOrAuthenticated, TokenHasReadWriteScope]
@@ -51,7 +68,7 @@ class CmeTagDetail(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAdminOrAuthenticated, TokenHasReadWriteScope]
 
 # EntryType
-class EntryTypeList(generics.ListCreateAPIView):
+class EntryTypeList(CachedListMixin, generics.ListCreateAPIView):
     queryset = EntryType.objects.all().order_by('name')
     serializer_class = EntryTypeSerializer
     permission_classes = [IsAdminOrAuthenticated, TokenHasReadWriteScope]
@@ -65,15 +82,53 @@ class EntryTypeDetail(generics.RetrieveUpdateDestroyAPIView):
 # Profile
 # A list of profiles is readable by any authenticated user
 # A profile cannot be created from the API because it is created by the psa pipeline for each user.
-class ProfileList(generics.ListAPIView):
-    queryset = Profile.objects.all().order_by('lastName')
+class ProfileList(ReplicaReadMixin, generics.ListAPIView):
+    """
+    Query params (all optional, combined with AND):
+        name: prefix of lastName, or "first last" for prefixes of
+            firstName and lastName (case-insensitive)
+        npi: NPI number
+        degree: comma separated Degree ids (any of)
+        specialty: comma separated PracticeSpecialty ids (any of)
+    """
     serializer_class = ProfileSerializer
     permission_classes = [permissions.IsAuthenticated, TokenHasReadWriteScope]
 
+    def get_id_list(self, param):
+        value = self.request.query_params.get(param)
+        if not value:
+            return None
+        try:
+            return [int(v) for v in value.split(',')]
+        except ValueError:
+            raise exceptions.ValidationError({param: 'Must be a comma separated list of ids'})
+
+    def get_queryset(self):
+        qset = Profile.objects.all()
+        params = self.request.query_params
+        name = params.get('name', '').split()
+        if len(name) == 1:
+            qset = qset.filter(lastName__istartswith=name[0])
+        elif name:
+            qset = qset.filter(firstName__istartswith=name[0], lastName__istartswith=' '.join(name[1:]))
+        if params.get('npi'):
+            qset = qset.filter(npiNumber=params['npi'])
+        # subqueries on the m2m tables avoid duplicate rows (no DISTINCT needed)
+        degree_ids = self.get_id_list('degree')
+        if degree_ids:
+            qset = qset.filter(pk__in=Profile.degrees.through.objects
+                .filter(degree_id__in=degree_ids).values('profile_id'))
+        specialty_ids = self.get_id_list('specialty')
+        if specialty_ids:
+            qset = qset.filter(pk__in=Profile.specialties.through.objects
+                .filter(practicespecialty_id__in=specialty_ids).values('profile_id'))
+        # m2m ids of the page are fetched in one query per relation
+        return qset.prefetch_related('cmeTags', 'degrees', 'specialties').order_by('lastName', 'pk')
+
 # A profile is viewable by any authenticated user.
 # A profile can edited only by the owner from the API
 # A profile cannot be deleted from the API
-class ProfileDetail(generics.RetrieveUpdateAPIView):
+class ProfileDetail(ObjectConditionalGetMixin, generics.RetrieveUpdateAPIView):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
     permission_classes = [IsOwnerOrAuthenticated, TokenHasReadWriteScope]
@@ -90,7 +145,7 @@ class CustomerList(generics.ListAPIView):
 # A customer is viewable by any Admin user (or the user that is the owner of the account)
 # A customer cannot be edited from the API because it only contains read-only fields
 # A customer cannot be deleted from the API
-class CustomerDetail(generics.RetrieveAPIView):
+class CustomerDetail(ObjectConditionalGetMixin, generics.RetrieveAPIView):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     permission_classes = [IsOwnerOrAdmin, TokenHasReadWriteScope]
@@ -123,7 +178,7 @@ class PRODetail(generics.RetrieveUpdateDestroyAPIView):
 class BrowserCmeOfferPagination(PageNumberPagination):
     page_size = 5
 
-class BrowserCmeOfferList(generics.ListAPIView):
+class BrowserCmeOfferList(ReplicaReadMixin, generics.ListAPIView):
     """
     Find the top N un-redeemed and unexpired offers order by expireDate
     (earliest first) for the authenticated user.
@@ -139,7 +194,7 @@ class BrowserCmeOfferList(generics.ListAPIView):
             user=user,
             expireDate__gt=now,
             redeemed=False
-            ).order_by('expireDate')
+            ).select_related('page').order_by('expireDate')
 
 class GetBrowserCmeOffer(APIView):
     """
@@ -161,7 +216,7 @@ class GetBrowserCmeOffer(APIView):
             user=request.user,
             expireDate__gt=now,
             redeemed=False
-            ).order_by('expireDate')
+            ).select_related('page').order_by('expireDate')
         if qset.exists():
             offer = qset[0]
         else:
@@ -171,13 +226,61 @@ class GetBrowserCmeOffer(APIView):
 #
 # FEED
 #
-class FeedList(generics.ListAPIView):
+class FeedList(ReplicaReadMixin, ConditionalGetMixin, generics.ListAPIView):
     serializer_class = EntryReadSerializer
     permission_classes = [permissions.IsAuthenticated, TokenHasReadWriteScope]
 
+    def get_validators(self, request, *args, **kwargs):
+        """Feed version from one aggregate query on the (user, modified, id) index.
+        An added or changed entry raises max(modified), and a deleted or
+        invalidated entry lowers the count. No Last-Modified is returned: a
+        delete does not raise max(modified), so If-Modified-Since would get a
+        stale 304 (and it has only second granularity).
+        """
+        stats = Entry.objects.filter(user=request.user, valid=True).aggregate(
+            last_modified=Max('modified'), num=Count('id'))
+        last_modified = stats['last_modified']
+        version = '{0}:{1}'.format(last_modified.isoformat() if last_modified else '', stats['num'])
+        return (version, None)
+
     def get_queryset(self):
         user = self.request.user
-        return Entry.objects.filter(user=user, valid=True).select_related('entryType').order_by('-created')
+        return Entry.objects.filter(user=user, valid=True) \
+            .select_related('entryType', 'brcme__page', 'exbrcme__page') \
+            .order_by('-created')
+
+class FeedSync(APIView):
+    """
+    Returns the changes to the user's feed since the given sync token.
+    Query params:
+        token: syncToken of the previous response. Omit to get all entries.
+        limit: max number of changes (default 100, max 500)
+    Response:
+        entries: created or changed entries
+        deleted: ids of deleted entries
+        syncToken: token for the next sync
+        more: true if more changes are pending
+        reset: true if the token is too old. Drop all entries and sync
+            again without a token.
+    Reads from the primary: the sync token must not skip writes that a
+    lagging replica has not applied yet.
+    """
+    permission_classes = [permissions.IsAuthenticated, TokenHasReadWriteScope]
+
+    def get(self, request, format=None):
+        try:
+            limit = min(int(request.query_params.get('limit', 100)), 500)
+            if limit < 1:
+                raise ValueError('limit must be positive')
+            changes = get_changes(request.user, request.query_params.get('token'), limit)
+        except (ValueError, InvalidSyncToken) as e:
+            context = {
+                'success': False,
+                'error': str(e)
+            }
+            return Response(context, status=status.HTTP_400_BAD_REQUEST)
+        changes['entries'] = EntryReadSerializer(changes['entries'], many=True, context={'request': request}).data
+        return Response(changes)
 
 class FeedEntryDetail(generics.RetrieveDestroyAPIView):
     serializer_class = EntryReadSerializer
@@ -188,11 +291,20 @@ class FeedEntryDetail(generics.RetrieveDestroyAPIView):
         return Entry.objects.filter(user=user, valid=True).select_related('entryType')
 
     def delete(self, request, *args, **kwargs):
-        """Override to delete associated document if one exists"""
+        """Override to delete associated document if one exists.
+        The document is deleted from storage in the background once the
+        entry is deleted.
+        """
         instance = self.get_object()
-        if instance.document:
-            instance.document.delete()
-        return self.destroy(request, *args, **kwargs)
+        with transaction.atomic():
+            if instance.document:
+                tombstone_document(instance.document.name)
+            response = self.destroy(request, *args, **kwargs)
+            EntryTombstone.objects.create(user_id=instance.user_id, entryId=instance.pk)
+            emit(TOPIC_ENTRY_DELETED,
+                userId=instance.user_id,
+                entryId=kwargs['pk'])
+        return response
 
 
 class CreateBrowserCme(generics.CreateAPIView):
@@ -200,9 +312,11 @@ class CreateBrowserCme(generics.CreateAPIView):
     Create a BrowserCme Entry in the user's feed.
     This action redeems the BrowserCmeOffer specified in the
     request, and deducts points from the customer's balance.
+    Send an Idempotency-Key header to make retries safe.
     """
     serializer_class = BRCmeCreateSerializer
     permission_classes = [permissions.IsAuthenticated, TokenHasReadWriteScope]
+    throttle_scope = 'redeem'
 
     def perform_create(self, serializer, format=None):
         user = self.request.user
@@ -214,7 +328,7 @@ class CreateBrowserCme(generics.CreateAPIView):
             offer.save()
             # create PointTransaction
             pointsDeducted = -1*offer.points
-            PointTransaction.objects.create(
+            pt = PointTransaction.objects.create(
                 customer=self.customer,
                 points=pointsDeducted,
                 pricePaid=Decimal('0'),
@@ -223,14 +337,26 @@ class CreateBrowserCme(generics.CreateAPIView):
             # deduct points from user's balance
             self.customer.balance += pointsDeducted
             self.customer.save()
+            emit(TOPIC_BRCME_REDEEMED,
+                userId=user.pk,
+                entryId=brcme.pk,
+                offerId=offer.pk,
+                credits=offer.credits,
+                points=offer.points)
+            emit(TOPIC_BALANCE_CHANGED,
+                userId=user.pk,
+                points=pointsDeducted,
+                balance=self.customer.balance,
+                transactionId=pt.transactionId,
+                reason='redeem')
         return brcme
 
+    @idempotent
     def create(self, request, *args, **kwargs):
         """Override create to add custom keys to response"""
         # get local customer instance for request.user
-        try:
-            self.customer = Customer.objects.get(user=request.user)
-        except ObjectDoesNotExist:
+        self.customer = get_identity(request).customer
+        if self.customer is None:
             context = {
                 'success': False,
                 'error': 'Local customer object not found for user'
@@ -251,6 +377,193 @@ class CreateBrowserCme(generics.CreateAPIView):
         return Response(context, status=status.HTTP_201_CREATED)
 
 
+class ActivityIngest(APIView):
+    """
+    Store a batch of browsing events of the plugin.
+    Send JSON {"events": [event, ...]} with event keys:
+        url: str
+        pageTitle: str (optional)
+        startTime: str
+        endTime: str (optional if dwell is given)
+        dwell: int (optional. Seconds spent on the page)
+    Valid events are stored and turned into BrowserCmeOffers by a
+    background job. Invalid events are dropped and listed in rejected.
+    Send an Idempotency-Key header to make retries safe.
+    """
+    permission_classes = [permissions.IsAuthenticated, TokenHasReadWriteScope]
+    throttle_scope = 'activity'
+
+    @idempotent
+    def post(self, request, format=None):
+        data = request.data if isinstance(request.data, dict) else {}
+        events = data.get('events')
+        max_events = getattr(settings, 'ORBIT_ACTIVITY_MAX_EVENTS', 500)
+        if not isinstance(events, list) or not events or len(events) > max_events:
+            context = {
+                'success': False,
+                'error': 'events must be a list of 1 to {0} objects'.format(max_events)
+            }
+            return Response(context, status=status.HTTP_400_BAD_REQUEST)
+        # one serializer validates all events (like ListSerializer), so
+        # that its fields are not rebuilt for each event
+        serializer = ActivityEventSerializer()
+        valid_events = []
+        rejected = []
+        for index, event in enumerate(events):
+            try:
+                valid_events.append(serializer.run_validation(event))
+            except exceptions.ValidationError as e:
+                rejected.append({'index': index, 'errors': e.detail})
+        if valid_events:
+            add_events(request.user, valid_events)
+        context = {
+            'success': bool(valid_events),
+            'accepted': len(valid_events),
+            'rejected': rejected
+        }
+        return Response(context, status=status.HTTP_202_ACCEPTED if valid_events else status.HTTP_400_BAD_REQUEST)
+
+class RedeemBrowserCmeBatch(APIView):
+    """
+    Redeem several BrowserCmeOffers of the user in one transaction.
+    Send JSON {"redemptions": [item, ...]} with item keys:
+        offerId: int
+        description: str
+        purpose: int (0 or 1)
+        planEffect: int (0 or 1)
+        tags: list of CmeTag ids
+    Each offer that can be redeemed creates a BrowserCme Entry and a
+    PointTransaction. The points of all redeemed offers are deducted from
+    the customer's balance at once. Offers that cannot be redeemed (not
+    found, already redeemed, expired, invalid item) are listed in failed.
+    Send an Idempotency-Key header to make retries safe.
+    """
+    permission_classes = [permissions.IsAuthenticated, TokenHasReadWriteScope]
+    throttle_scope = 'redeem'
+
+    @idempotent
+    def post(self, request, format=None):
+        data = request.data if isinstance(request.data, dict) else {}
+        items = data.get('redemptions')
+        max_items = getattr(settings, 'ORBIT_BULK_IMPORT_MAX_ITEMS', 200)
+        if not isinstance(items, list) or not items or len(items) > max_items:
+            context = {
+                'success': False,
+                'error': 'redemptions must be a list of 1 to {0} objects'.format(max_items)
+            }
+            return Response(context, status=status.HTTP_400_BAD_REQUEST)
+        context = {'tag_ids': set(CmeTag.objects.values_list('pk', flat=True))}
+        valid_items = []
+        failed = []
+        for index, item in enumerate(items):
+            serializer = BRCmeBatchItemSerializer(data=item, context=context)
+            if serializer.is_valid():
+                valid_items.append((index, serializer.validated_data))
+            else:
+                failed.append({
+                    'index': index,
+                    'offerId': item.get('offerId') if isinstance(item, dict) else None,
+                    'errors': serializer.errors
+                })
+        try:
+            redeemed, balance = self.redeem(request.user, valid_items, failed)
+        except Customer.DoesNotExist:
+            context = {
+                'success': False,
+                'error': 'Local customer object not found for user'
+            }
+            return Response(context, status=status.HTTP_400_BAD_REQUEST)
+        context = {
+            'success': bool(redeemed),
+            'redeemed': redeemed,
+            'failed': sorted(failed, key=lambda f: f['index']),
+            'balance': balance
+        }
+        return Response(context, status=status.HTTP_201_CREATED if redeemed else status.HTTP_400_BAD_REQUEST)
+
+    def redeem(self, user, items, failed):
+        """Redeem the offers of items [(index, data)] with one bulk write per table.
+        Appends the items that cannot be redeemed to failed.
+        Returns (list of redeemed dicts, new balance).
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            # lock the customer and offers so that concurrent redemptions are serialized
+            customer = Customer.objects.select_for_update().get(pk=user.pk)
+            offers = BrowserCmeOffer.objects.select_for_update() \
+                .filter(user=user, pk__in=[data['offerId'] for index, data in items]) \
+                .in_bulk()
+            accepted = []
+            seen = set()
+            for index, data in items:
+                offerId = data['offerId']
+                offer = offers.get(offerId)
+                if offer is None:
+                    error = 'Offer not found'
+                elif offer.redeemed or offerId in seen:
+                    error = 'Offer has already been redeemed'
+                elif offer.expireDate < now:
+                    error = 'Offer has already expired'
+                else:
+                    seen.add(offerId)
+                    accepted.append((offer, data))
+                    continue
+                failed.append({'index': index, 'offerId': offerId, 'error': error})
+            if not accepted:
+                return [], customer.balance
+            etype = EntryType.objects.get(name=ENTRYTYPE_BRCME)
+            entries = [
+                Entry(entryType=etype, activityDate=offer.activityDate, description=data['description'], user=user)
+                for offer, data in accepted
+            ]
+            Entry.objects.bulk_create_with_ids(entries)
+            BrowserCme.objects.bulk_create([
+                BrowserCme(
+                    entry_id=entry.pk,
+                    offer=offer,
+                    purpose=data['purpose'],
+                    planEffect=data['planEffect'],
+                    page_id=offer.page_id,
+                    credits=offer.credits)
+                for entry, (offer, data) in zip(entries, accepted)
+            ])
+            EntryTag = Entry.tags.through
+            EntryTag.objects.bulk_create([
+                EntryTag(entry_id=entry.pk, cmetag_id=tag_id)
+                for entry, (offer, data) in zip(entries, accepted)
+                for tag_id in set(data.get('tags', []))
+            ])
+            BrowserCmeOffer.objects.filter(pk__in=[offer.pk for offer, data in accepted]) \
+                .update(redeemed=True, modified=now)
+            transactions = [
+                PointTransaction(
+                    customer=customer,
+                    entry_id=entry.pk,
+                    points=-1*offer.points,
+                    pricePaid=Decimal('0'),
+                    transactionId=newUuid())
+                for entry, (offer, data) in zip(entries, accepted)
+            ]
+            PointTransaction.objects.bulk_create(transactions)
+            pointsDeducted = sum(pt.points for pt in transactions)
+            customer.balance += pointsDeducted
+            customer.save(update_fields=('balance', 'modified'))
+            emit_many(TOPIC_BRCME_REDEEMED, [
+                dict(userId=user.pk, entryId=entry.pk, offerId=offer.pk, credits=offer.credits, points=offer.points)
+                for entry, (offer, data) in zip(entries, accepted)
+            ])
+            emit(TOPIC_BALANCE_CHANGED,
+                userId=user.pk,
+                points=pointsDeducted,
+                balance=customer.balance,
+                transactionIds=[pt.transactionId for pt in transactions],
+                reason='redeem')
+        redeemed = [
+            {'offerId': offer.pk, 'id': entry.pk, 'created': entry.created, 'credits': offer.credits}
+            for entry, (offer, data) in zip(entries, accepted)
+        ]
+        return redeemed, customer.balance
+
 class UpdateBrowserCme(generics.UpdateAPIView):
     """
     Update a BrowserCme Entry in the user's feed.
@@ -302,6 +615,10 @@ class CreateSRCmeSpec(generics.CreateAPIView):
         user = self.request.user
         with transaction.atomic():
             srcme = serializer.save(user=user)
+            emit(TOPIC_SRCME_CREATED,
+                userId=user.pk,
+                entryId=srcme.pk,
+                credits=srcme.credits)
         return srcme
 
     def create(self, request, *args, **kwargs):
@@ -355,6 +672,10 @@ class CreateSRCme(generics.CreateAPIView):
         user = self.request.user
         with transaction.atomic():
             srcme = serializer.save(user=user)
+            emit(TOPIC_SRCME_CREATED,
+                userId=user.pk,
+                entryId=srcme.pk,
+                credits=srcme.credits)
         return srcme
 
     def create(self, request, *args, **kwargs):
@@ -378,6 +699,121 @@ class CreateSRCme(generics.CreateAPIView):
         }
         return Response(context, status=status.HTTP_201_CREATED)
 
+class CreateSRCmeBulk(APIView):
+    """
+    Create many SRCme Entries in the user's feed in one request.
+    Send JSON {"entries": [item, ...]}, or multipart form data with an
+    entries field holding the JSON list and one file part per document.
+    Item keys:
+        activityDate: str
+        description: str
+        credits: number
+        tags: list of CmeTag ids (optional)
+        fileMd5: str (optional. md5sum of the document)
+        document: str (optional. Name of the file part of the document)
+    All items are validated first. If any item is invalid, no entry is
+    created and the response lists the errors by item index.
+    Send an Idempotency-Key header to make retries safe.
+    """
+    permission_classes = [permissions.IsAuthenticated, TokenHasReadWriteScope]
+    parser_classes = (JSONParser, MultiPartParser, FormParser)
+
+    def error_response(self, error, **extra):
+        context = {
+            'success': False,
+            'error': error
+        }
+        context.update(extra)
+        return Response(context, status=status.HTTP_400_BAD_REQUEST)
+
+    def parse_items(self, request):
+        """Returns list of item dicts with file parts in place of their names"""
+        # a JSON body can also be a list or a scalar
+        data = request.data if isinstance(request.data, dict) else {}
+        items = data.get('entries')
+        if isinstance(items, basestring):
+            items = json.loads(items)
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ValueError('entries must be a list of objects')
+        for item in items:
+            if item.get('document'):
+                item['document'] = request.FILES.get(item['document'])
+            else:
+                item.pop('document', None)
+        return items
+
+    @idempotent
+    def post(self, request, format=None):
+        try:
+            items = self.parse_items(request)
+        except ValueError as e:
+            return self.error_response('Malformed JSON for entries key: {0}'.format(e))
+        max_items = getattr(settings, 'ORBIT_BULK_IMPORT_MAX_ITEMS', 200)
+        if not items or len(items) > max_items:
+            return self.error_response('Number of entries must be between 1 and {0}'.format(max_items))
+        context = {'tag_ids': set(CmeTag.objects.values_list('pk', flat=True))}
+        valid_items = []
+        errors = []
+        for index, item in enumerate(items):
+            serializer = SRCmeBulkItemSerializer(data=item, context=context)
+            if serializer.is_valid():
+                valid_items.append(serializer.validated_data)
+            else:
+                errors.append({'index': index, 'errors': serializer.errors})
+        if errors:
+            return self.error_response('Invalid entries', errors=errors)
+        entries = self.perform_create(request.user, valid_items)
+        context = {
+            'success': True,
+            'entries': [{'id': entry.pk, 'created': entry.created} for entry in entries]
+        }
+        return Response(context, status=status.HTTP_201_CREATED)
+
+    def perform_create(self, user, items):
+        """Insert Entry, SRCme and tag rows with one bulk insert per table"""
+        etype = EntryType.objects.get(name=ENTRYTYPE_SRCME)
+        document_field = Entry._meta.get_field('document')
+        saved_documents = []
+        try:
+            with transaction.atomic():
+                entries = []
+                for data in items:
+                    entry = Entry(
+                        entryType=etype,
+                        activityDate=data['activityDate'],
+                        description=data['description'],
+                        user=user
+                    )
+                    newDoc = data.get('document')
+                    if newDoc:
+                        fileExt = os.path.splitext(newDoc.name)[1]
+                        fileMd5 = data.get('fileMd5', '')
+                        docName = fileMd5 + fileExt if fileMd5 else newDoc.name
+                        entry.document = default_storage.save(
+                            document_field.generate_filename(None, docName.lower()), newDoc)
+                        saved_documents.append(entry.document.name)
+                    entries.append(entry)
+                Entry.objects.bulk_create_with_ids(entries)
+                SRCme.objects.bulk_create([
+                    SRCme(entry_id=entry.pk, credits=data['credits'])
+                    for entry, data in zip(entries, items)
+                ])
+                EntryTag = Entry.tags.through
+                EntryTag.objects.bulk_create([
+                    EntryTag(entry_id=entry.pk, cmetag_id=tag_id)
+                    for entry, data in zip(entries, items)
+                    for tag_id in set(data.get('tags', []))
+                ])
+                emit_many(TOPIC_SRCME_CREATED, [
+                    dict(userId=user.pk, entryId=entry.pk, credits=data['credits'])
+                    for entry, data in zip(entries, items)
+                ])
+        except Exception:
+            for name in saved_documents:
+                default_storage.delete(name)
+            raise
+        return entries
+
 class UpdateSRCme(generics.UpdateAPIView):
     """
     Update an existing SRCme Entry in the user's feed. This
@@ -403,7 +839,8 @@ class UpdateSRCme(generics.UpdateAPIView):
             form_data.setlist('tags', tag_ids)
         serializer = self.get_serializer(instance, data=form_data, partial=partial)
         serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
+        with transaction.atomic():
+            self.perform_update(serializer)
         entry = Entry.objects.get(pk=instance.pk)
         context = {
             'success': True,
@@ -441,7 +878,8 @@ class UpdateSRCmeSpec(generics.UpdateAPIView):
         else:
             serializer = self.get_serializer(instance, data=form_data, partial=partial)
             serializer.is_valid(raise_exception=True)
-            self.perform_update(serializer)
+            with transaction.atomic():
+                self.perform_update(serializer)
             entry = Entry.objects.get(pk=instance.pk)
             context = {
                 'success': False,
@@ -454,8 +892,54 @@ class UpdateSRCmeSpec(generics.UpdateAPIView):
 class UserFeedbackList(generics.ListCreateAPIView):
     serializer_class = UserFeedbackSerializer
     permission_classes = [permissions.IsAuthenticated, TokenHasReadWriteScope]
+    throttle_scope = 'feedback'
     def get_queryset(self):
         return UserFeedback.objects.filter(user=self.request.user)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
+
+
+# Archive
+class ArchiveLookup(APIView):
+    """
+    Returns an Entry or BrowserCmeOffer of the user by id, also if it has
+    been archived. Response:
+        archived: time it was archived, or null
+        data: the row and its dependent rows (see users/archive.py)
+    """
+    permission_classes = [permissions.IsAuthenticated, TokenHasReadWriteScope]
+
+    def get(self, request, kind, pk, format=None):
+        if kind == 'entries':
+            found = find_entry(pk)
+            key = 'entry'
+        else:
+            found = find_offer(pk)
+            key = 'offer'
+        if found is None or found[0][key]['user_id'] != request.user.pk:
+            context = {
+                'success': False,
+                'error': 'Not found'
+            }
+            return Response(context, status=status.HTTP_404_NOT_FOUND)
+        payload, archived = found
+        return Response({'archived': archived, 'data': payload})
+
+
+# Metrics
+class Metrics(APIView):
+    """Operational metrics for staff: background job queue depth and
+    latency, pending and dead outbox events, the stats of the caches of the
+    serving process, and the number of requests rejected by the throttles
+    per scope"""
+    permission_classes = [permissions.IsAdminUser, TokenHasReadWriteScope]
+
+    def get(self, request, format=None):
+        context = {
+            'jobs': queue_stats(),
+            'outbox': outbox_stats(),
+            'caches': cache_stats(),
+            'throttle': throttle_stats()
+        }
+        return Response(context)